@@ -0,0 +1,171 @@
+import argparse
+import os
+import time
+
+import profiler
+from src.bench.BenchInput import BenchInput
+from src.bench.BenchOutput import BenchOutput
+from src.bench.Processer import Processer
+from src.bench.scaled_chinook import generate_scaled_chinook
+from src.lib.Config import Config, OutputFormat
+from src.lib.SqliteConnector import SqliteConnector
+from src.lib.utils import create_dir_if_not_exists, log, read_json, write_json
+from src.profiling.GenAi import LlmProvider
+from src.profiling.ProfilingConfig import ProfilingConfig
+
+# ------------------------------------------------------
+# Times the profiler and the evaluator on Chinook databases of growing size
+#
+#   uv run bench_scale.py -o out/scale --scales 10 100 1000
+#
+# The evaluator replays the dataset queries as if the agent had answered every
+# question with the expected sql: both queries of every question are run.
+
+
+def construct_outputs(dataset_paths: list[str], source_path: str) -> list[BenchOutput]:
+    # Queries failing on the original database would fail the analysis
+    source = SqliteConnector(source_path, do_logging=False)
+    outputs = []
+    for dataset_path in dataset_paths:
+        for j in read_json(dataset_path)["input"]:
+            bench_input = BenchInput.init_from_json(j)
+            if source.select(bench_input.sql) is None:
+                log(f"[WARN] Skipping query {dataset_path}#{bench_input.id}, it fails on {source_path}")
+                continue
+            outputs.append(BenchOutput(bench_input, bench_input.sql, None))
+    return outputs
+
+
+def bench_scale(scale: int, db_path: str, args: argparse.Namespace) -> dict:
+    result: dict = {"scale": scale, "db_path": db_path}
+
+    if args.reuse and os.path.isfile(db_path):
+        log(f"[LOG] Reusing {db_path}")
+    else:
+        start = time.perf_counter()
+        result["row_counts"] = generate_scaled_chinook(
+            args.source, db_path, scale, seed=args.seed
+        )
+        result["generation_s"] = time.perf_counter() - start
+    result["size_bytes"] = os.path.getsize(db_path)
+
+    ProfilingConfig.init(
+        ProfilingConfig(
+            DO_LOGGING=not args.silent,
+            DB_CONN_STRING=db_path,
+            MAX_RPM=-1,
+            OUTPUT_PATH=f"{args.output_path}/profile_{scale}x",
+            OUTPUT_FORMAT=OutputFormat.JSON,
+            DO_EXTRACTION=True,
+            DO_LLM_SUMMARY=False,
+            SAVE_METADATA=False,
+            DRY_RUN=False,
+            SKIP_INTERACTIONS=True,
+            DB_BACKEND=args.backend,
+            WORKERS=args.workers,
+            APPROX=args.approx,
+            USE_CACHE=False,
+            PARTITION_ROWS=args.partition_rows,
+            USE_LLM_CACHE=False,
+            LLM_CACHE_TTL_DAYS=30,
+            LLM_CACHE_MAX_MB=256,
+            PROMPT_TOKEN_BUDGET=2000,
+            BATCH_TABLES=1,
+            BATCH_TOKEN_BUDGET=8000,
+            LLM_CONCURRENCY=8,
+            MAX_TPM=-1,
+            LLM_PROVIDER=LlmProvider.FAKE,
+            LLM_FAILURE_RATE=0.0,
+            LLM_STREAM=False,
+            COLUMN_CHUNK_SIZE=100,
+        )
+    )
+    start = time.perf_counter()
+    db_metadata = profiler.run_metadata_extraction()
+    result["run_metadata_extraction_s"] = time.perf_counter() - start
+    result["profiled_rows"] = sum(t.row_count for t in db_metadata.tables)
+
+    processer = Processer(db_path, construct_outputs(args.datasets, args.source))
+    processer.db.do_logging = False
+    start = time.perf_counter()
+    stats = processer.construct_stats()
+    result["construct_stats_s"] = time.perf_counter() - start
+    result["queries"] = stats["success_rate"]["total"]
+    result["exact_match"] = stats["success_rate"]["exact_match"]
+
+    log(
+        f"[LOG] {scale}x: {result['profiled_rows']} rows, "
+        f"run_metadata_extraction={result['run_metadata_extraction_s']:.2f}s, "
+        f"construct_stats={result['construct_stats_s']:.2f}s"
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generates scaled Chinook databases and times the profiler and the evaluator on each of them"
+    )
+    parser.add_argument(
+        "-o", "--output-path", type=str, required=True, help="Folder of the databases and results"
+    )
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100],
+        help="Scale factors, # of times the Chinook rows are copied (default=1 10 100)",
+    )
+    parser.add_argument("--source", type=str, default="db/Chinook.db")
+    parser.add_argument(
+        "--datasets",
+        type=str,
+        nargs="+",
+        default=["db/dataset_1.json", "db/dataset_2.json"],
+        help="Question/sql lists replayed by the evaluator",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--reuse",
+        action="store_true",
+        default=False,
+        help="Don't generate again the databases already in the output folder",
+    )
+    parser.add_argument(
+        "-b", "--backend", type=ProfilingConfig.arg_backend_validate, default="sqlite"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=ProfilingConfig.arg_positive_int_validate, default=1
+    )
+    parser.add_argument("--approx", action="store_true", default=False)
+    parser.add_argument(
+        "--partition-rows",
+        type=ProfilingConfig.arg_non_negative_int_validate,
+        default=1_000_000,
+    )
+    parser.add_argument(
+        "-s", "--silent", action="store_true", default=False, help="Disable logging"
+    )
+    args = parser.parse_args()
+    args.output_path = args.output_path.removesuffix("/")
+
+    # The generator logs before the profiling config is set
+    Config.DO_LOGGING = not args.silent
+    create_dir_if_not_exists(args.output_path)
+
+    results = []
+    for scale in args.scales:
+        db_path = f"{args.output_path}/chinook_{scale}x.db"
+        results.append(bench_scale(scale, db_path, args))
+        # Written after every scale, the big ones take a while
+        write_json(f"{args.output_path}/scale_bench.json", {"results": results})
+
+    log("\nscale | rows | run_metadata_extraction (s) | construct_stats (s)")
+    for r in results:
+        log(
+            f"{r['scale']}x | {r['profiled_rows']} | "
+            f"{r['run_metadata_extraction_s']:.2f} | {r['construct_stats_s']:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
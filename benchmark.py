@@ -128,7 +128,12 @@ def run_analysis():
         BenchOutput.from_dict(o) for o in report["output"]
     ]
 
-    processer = Processer(BenchConfig.DB_CONN_STRING, bench_outputs)
+    processer = Processer(
+        BenchConfig.DB_CONN_STRING,
+        bench_outputs,
+        BenchConfig.CROSS_CHECK_BACKEND,
+        BenchConfig.COLUMNAR_RESULTS,
+    )
 
     # Changes like so: out/foo.json -> out/foo.stats.json
     stats_filepath = ".stats.".join(BenchConfig.BENCH_REPORT_PATH.split("."))
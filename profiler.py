@@ -1,75 +1,583 @@
-import queue
+import asyncio
+import contextlib
+import hashlib
+import math
+import os
+import multiprocessing
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
+import numpy as np
+
+from src.lib.DbConnector import DbBackend, DbConnector, create_connector, quote_identifier
 from src.lib.SqliteConnector import SqliteConnector
 from src.lib.utils import (
+    is_database_pattern,
+    list_database_files,
     log,
     write_json,
     read_dir_files,
     human_in_the_loop,
     sqlite_export,
     create_dir_if_not_exists,
-    run_rate_limited_tasks_with_retry
+    run_async_tasks_with_retry
 )
-from src.profiling.GenAi import TableDescriptionOutput, TableDescription, field_desc_creation_str, table_desc_creation_str, GenAiApi, AiApiError
-from src.profiling.GeminiApi import Gemini
-from src.lib.Config import OutputFormat
+from src.lib.RateLimiter import RateLimiter
+from src.profiling.GenAi import TableDescriptionOutput, TableDescription, field_desc_creation_str, table_desc_creation_str, GenAiApi, AiApiError, create_llm
+from src.lib.Config import Config, OutputFormat
 from src.profiling.ProfilingConfig import ProfilingConfig
+from src.profiling.Catalog import Catalog, schema_hash
+from src.profiling.ProfileCache import ProfileCache
+from src.profiling.LlmCache import LlmCache
+from src.profiling.LlmUsage import LlmUsage
+from src.profiling.SchemaIndex import column_lookup_creation_str, schema_index_rows, schema_search_creation_str
+from src.profiling.PromptEncoding import count_tokens, pack_table_batches
+from src.profiling.Partitions import PartialProfile, PartitionCheckpoints, table_partitions
+from src.profiling.Relationships import (
+    declared_relationships,
+    infer_relationships,
+    key_candidate_columns,
+    signature_candidate_columns,
+)
+from src.profiling.Sketches import (
+    ColumnSketches,
+    RowReservoir,
+    Z_95,
+    equi_depth_histogram,
+    mean_bound,
+    numeric_values,
+    proportion_bound,
+    sqlite_sort_key,
+    storage_class,
+)
 from src.profiling.Models import (
     DatabaseMetadata,
     LengthMetaData,
     TableMetadata,
     ColumnMetadata,
-    ModelOutput
+    FrequentValue,
+    HistogramBucket,
+    NumericStats,
+    ModelOutput,
+    FieldDescription,
 )
 
 
+def column_index_flags(db: DbConnector, tablename: str) -> dict[str, dict[str, bool]]:
+    # {column_name: {is_indexed, is_unique, is_covered}} of the columns in an index
+    flags: dict[str, dict[str, bool]] = {}
+    for index in db.table_indexes(tablename):
+        # A partial index doesn't hold every row
+        if index["partial"]:
+            continue
+        columns = index["columns"]
+        for i, column_name in enumerate(columns):
+            f = flags.setdefault(
+                column_name, {"is_indexed": False, "is_unique": False, "is_covered": False}
+            )
+            f["is_covered"] = True
+            f["is_indexed"] = f["is_indexed"] or i == 0
+            f["is_unique"] = f["is_unique"] or (index["unique"] and len(columns) == 1)
+    return flags
+
+
 def table_profile(
-    db: SqliteConnector, tablename: str, sample_size: int
+    db: DbConnector,
+    tablename: str,
+    sample_size: int,
+    fused: bool = True,
+    use_indexes: bool = True,
+    partial: PartialProfile | None = None,
 ) -> TableMetadata:
-    row_count = db.table_row_count(tablename)
-
+    # `partial` holds the merged partitions of a big table, see profile_partition
     cols = db.table_columns(tablename)
 
-    columns_metadata = []
-    for c in cols:
+    no_index = {"is_indexed": False, "is_unique": False, "is_covered": False}
+    index_flags = column_index_flags(db, tablename) if use_indexes else {}
+    # Columns leading an index: distinct count and min/max come from the index b-tree
+    index_backed = {n for n, f in index_flags.items() if f["is_indexed"]}
+    scans_avoided = 0
+
+    if partial is not None:
+        row_count, columns_stats = partial.row_count, partial.stats
+    elif fused:
+        # One aggregate scan for all the columns instead of ~6 per column
+        row_count, columns_stats = db.fused_column_stats(
+            tablename, [c["column_name"] for c in cols], index_backed
+        )
+    else:
+        row_count = db.table_row_count(tablename)
+        columns_stats = {c["column_name"]: None for c in cols}
+
+    # Counts of every column first, they tell which columns the scan keeps the smallest values of
+    columns_counts = []
+    for i, c in enumerate(cols):
         column_name = c["column_name"]
-        column_type = c["column_type"]
-        allows_null = c["allows_null"]
-        is_pk = c["is_pk"]
-        null_count, non_null_count = db.count_nulls_and_nonnulls(tablename, column_name)
-        distinct_count = db.distinct_count(tablename, column_name)
-
-        # TODO do max/min only for integer and not for string
-        if non_null_count > 0:
-            mn, mx = None, None 
+        flags = index_flags.get(column_name, no_index)
+        from_index = column_name in index_backed
+        estimates: dict[str, float | None] = {}
+
+        stats = columns_stats[column_name]
+        if stats is None:
+            if from_index:
+                # Index seek on the nulls instead of a scan
+                null_count = db.null_count(tablename, column_name)
+                non_null_count = row_count - null_count
+                scans_avoided += 1
+            else:
+                null_count, non_null_count = db.count_nulls_and_nonnulls(tablename, column_name)
+        else:
+            null_count = stats["null_count"]
+            non_null_count = stats["non_null_count"]
+
+        if flags["is_unique"]:
+            # Every non null value is distinct, no query at all
+            distinct_count = non_null_count
+            scans_avoided += 1
+        elif from_index:
+            # Walks the sorted index, no temp b-tree
+            distinct_count = db.distinct_count(tablename, column_name)
+            scans_avoided += 1
+        elif stats is None:
+            distinct_count = db.distinct_count(tablename, column_name)
+        elif stats["distinct_count"] is None:
+            # Partitioned table, distinct counts of the partitions don't add up
+            hll = partial.sketches[i].hll if partial is not None else None
+            assert hll is not None
+            distinct_count = min(round(hll.estimate()), non_null_count)
+            estimates["distinct_count"] = Z_95 * hll.relative_error * distinct_count
         else:
+            distinct_count = stats["distinct_count"]
+
+        if non_null_count == 0:
+            mn, mx = None, None
+        elif from_index:
+            mn, mx = db.min_max_from_index(tablename, column_name)
+            scans_avoided += 1
+        elif stats is None:
             mn, mx = db.min_max_for_column(tablename, column_name)
+        else:
+            mn, mx = stats["min_value"], stats["max_value"]
+
+        if stats is None:
+            min_len, avg_len, max_len = db.length_stats_sql(tablename, column_name)
+        else:
+            min_len, avg_len, max_len = stats["min_length"], stats["avg_length"], stats["max_length"]
 
-        min_len, avg_len, max_len = db.length_stats_sql(tablename, column_name)
+        columns_counts.append(
+            {
+                "null_count": null_count,
+                "non_null_count": non_null_count,
+                "distinct_count": distinct_count,
+                "min_value": mn,
+                "max_value": mx,
+                "length": LengthMetaData(min=min_len, average=avg_len, max=max_len),
+                "estimates": estimates,
+            }
+        )
+
+    if partial is not None:
+        sketches, reservoir = partial.sketches, partial.reservoir
+    else:
+        # One streaming pass for what SQL can't aggregate in one scan: the top values
+        # (counters exact up to MAX_GROUPED_VALUES distinct values), the signatures
+        # and a seeded sample of the rows (quantiles, histograms, previews).
+        # Storage classes and moments are aggregated by the database
+        names = [c["column_name"] for c in cols]
+        smallest_columns = {
+            n
+            for n, counts in zip(names, columns_counts)
+            if counts["distinct_count"] == counts["non_null_count"] > MAX_GROUPED_VALUES
+        }
+        sketches, reservoir = scan_table(
+            db,
+            tablename,
+            cols,
+            distinct=False,
+            reservoir_size=SAMPLE_ROWS,
+            minhash_columns=set(
+                signature_candidate_columns(cols, index_flags, declared_relationships(db, tablename))
+            ),
+            top_k_capacity=MAX_GROUPED_VALUES,
+            smallest_columns=smallest_columns,
+        )
+        value_stats = db.value_stats(tablename, names, shifts=sample_means(reservoir.rows, names))
+
+    columns_metadata = []
+    for i, (c, counts) in enumerate(zip(cols, columns_counts)):
+        column_name = c["column_name"]
+        values = [r[i] for r in reservoir.rows if r[i] is not None]
 
         samples = []
-        if non_null_count > 0 and sample_size > 0:
-            samples = db.sample_values(tablename, column_name, sample_size=sample_size)
-            # TODO maybe change this max preview to be configurable
-            MAX_PREVIEW_SIZE = 5
-            samples = samples[: min(MAX_PREVIEW_SIZE, len(samples) - 1)]
+        if counts["non_null_count"] > 0 and sample_size > 0:
+            samples = preview_samples(values[:sample_size])
 
+        if partial is not None:
+            fields = sketch_fields(sketches[i], reservoir, i, row_count)
+        else:
+            fields = exact_fields(
+                sketches[i],
+                reservoir,
+                i,
+                value_stats[column_name],
+                row_count=row_count,
+                non_null_count=counts["non_null_count"],
+            )
+        fields["estimates"] = counts.pop("estimates") | fields["estimates"]
         col_metadata = ColumnMetadata(
             name=column_name,
-            declared_type=column_type,
-            allows_null=allows_null,
-            is_pk=is_pk,
-            null_count=null_count,
-            non_null_count=non_null_count,
-            distinct_count=distinct_count,
-            min_value=mn,
-            max_value=mx,
-            length=LengthMetaData(min=min_len, average=avg_len, max=max_len),
+            declared_type=c["column_type"],
+            allows_null=c["allows_null"],
+            is_pk=c["is_pk"],
             samples=samples,
+            **counts,
+            **fields,
+            **index_flags.get(column_name, no_index),
         )
         columns_metadata.append(col_metadata)
 
-    return TableMetadata(name=tablename, columns=columns_metadata, row_count=row_count)
+    if scans_avoided > 0:
+        log(f"[LOG] {tablename}: {scans_avoided} column stats read from indexes")
+
+    return TableMetadata(
+        name=tablename,
+        columns=columns_metadata,
+        row_count=row_count,
+        scans_avoided=scans_avoided,
+        foreign_keys=declared_relationships(db, tablename),
+    )
+
+
+def preview_samples(samples: list) -> list:
+    # TODO maybe change this max preview to be configurable
+    MAX_PREVIEW_SIZE = 5
+    return samples[: min(MAX_PREVIEW_SIZE, len(samples) - 1)]
+
+
+def approx_table_profile(
+    db: DbConnector,
+    tablename: str,
+    sample_size: int,
+    reservoir_size: int = 10_000,
+    chunk_size: int = 10_000,
+    partial: PartialProfile | None = None,
+) -> TableMetadata:
+    # Single streaming pass, no sort nor temp b-tree:
+    # - distinct counts from a HyperLogLog per column
+    # - nulls, lengths and samples from a uniform reservoir of rows
+    # - top values, histograms and signatures from the same sketches as table_profile
+    # Every estimated field is recorded in ColumnMetadata.estimates with its error bound.
+    # `partial` holds the merged approx partitions of a big table, see profile_partition
+    cols = db.table_columns(tablename)
+
+    if partial is not None:
+        sketches, reservoir = partial.sketches, partial.reservoir
+    else:
+        sketches, reservoir = scan_table(
+            db,
+            tablename,
+            cols,
+            distinct=True,
+            reservoir_size=reservoir_size,
+            chunk_size=chunk_size,
+        )
+
+    row_count = reservoir.seen
+    sample_rows = len(reservoir.rows)
+    index_flags = column_index_flags(db, tablename)
+    no_index = {"is_indexed": False, "is_unique": False, "is_covered": False}
+
+    columns_metadata = []
+    for i, c in enumerate(cols):
+        estimates: dict[str, float | None] = {}
+        values = [r[i] for r in reservoir.rows if r[i] is not None]
+
+        if reservoir.is_exhaustive:
+            # The sample is the whole table, everything is exact
+            non_null_count = len(values)
+            distinct_count = len(set(values))
+        else:
+            non_null_count = round(len(values) / sample_rows * row_count)
+            null_bound = proportion_bound(len(values), sample_rows, row_count)
+            estimates["null_count"] = null_bound
+            estimates["non_null_count"] = null_bound
+
+            hll = sketches[i].hll
+            assert hll is not None
+            distinct_count = min(round(hll.estimate()), non_null_count)
+            estimates["distinct_count"] = Z_95 * hll.relative_error * distinct_count
+        null_count = row_count - non_null_count
+
+        lengths = [len(v) if isinstance(v, (str, bytes)) else len(str(v)) for v in values]
+        min_len = min(lengths) if len(lengths) > 0 else None
+        avg_len = sum(lengths) / len(lengths) if len(lengths) > 0 else None
+        max_len = max(lengths) if len(lengths) > 0 else None
+        if not reservoir.is_exhaustive and len(lengths) > 0:
+            estimates["length.min"] = None
+            estimates["length.average"] = mean_bound(lengths, non_null_count)
+            estimates["length.max"] = None
+
+        samples = []
+        if non_null_count > 0 and sample_size > 0:
+            samples = preview_samples(values[:sample_size])
+
+        fields = sketch_fields(sketches[i], reservoir, i, row_count)
+        fields["estimates"] = estimates | fields["estimates"]
+        columns_metadata.append(
+            ColumnMetadata(
+                name=c["column_name"],
+                declared_type=c["column_type"],
+                allows_null=c["allows_null"],
+                is_pk=c["is_pk"],
+                null_count=null_count,
+                non_null_count=non_null_count,
+                distinct_count=distinct_count,
+                min_value=sketches[i].min_value,
+                max_value=sketches[i].max_value,
+                length=LengthMetaData(min=min_len, average=avg_len, max=max_len),
+                samples=samples,
+                **fields,
+                **index_flags.get(c["column_name"], no_index),
+            )
+        )
+
+    return TableMetadata(
+        name=tablename,
+        columns=columns_metadata,
+        row_count=row_count,
+        foreign_keys=declared_relationships(db, tablename),
+    )
+
+
+# Reported per column
+TOP_K = 10
+HISTOGRAM_BUCKETS = 10
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+# Rows read by python in exact mode, the quantiles come from them
+SAMPLE_ROWS = 10_000
+
+
+def scan_table(
+    db: DbConnector,
+    tablename: str,
+    cols: list[dict],
+    distinct: bool,
+    reservoir_size: int = 10_000,
+    chunk_size: int = 10_000,
+    where: str | None = None,
+    seed: int = 0,
+    minhash_columns: set[str] | None = None,
+    top_k_capacity: int = 64,
+    smallest_columns: set[str] | None = None,
+) -> tuple[list[ColumnSketches], RowReservoir]:
+    # One streaming pass over the table, memory is fixed whatever its size:
+    # sketches per column and a uniform reservoir of rows.
+    # Signatures of the key candidates unless minhash_columns is given, the
+    # smallest values of smallest_columns are kept (unique columns)
+    if minhash_columns is None:
+        minhash_columns = set(key_candidate_columns(cols))
+    smallest_columns = smallest_columns or set()
+    names = [c["column_name"] for c in cols]
+    sketches = [
+        ColumnSketches(
+            distinct=distinct,
+            minhash=n in minhash_columns,
+            top_k_capacity=top_k_capacity,
+            smallest_k=TOP_K if n in smallest_columns else 0,
+        )
+        for n in names
+    ]
+    reservoir = RowReservoir(reservoir_size, seed=seed)
+
+    q = f"SELECT {', '.join(map(quote_identifier, names))} FROM {quote_identifier(tablename)}"
+    if where is not None:
+        q += f" WHERE {where}"
+    for rows in db.select_chunks(q, chunk_size):
+        reservoir.add(rows)
+        for column_sketches, values in zip(sketches, zip(*rows)):
+            column_sketches.add(values)
+
+    return sketches, reservoir
+
+
+def sketch_fields(
+    sketches: ColumnSketches, reservoir: RowReservoir, column_index: int, row_count: int
+) -> dict:
+    # ColumnMetadata fields read from the scan sketches
+    estimates: dict[str, float | None] = {}
+
+    top_k = sketches.top_k
+    if top_k.error > 0:
+        # Counts are at most top_k.error below the true counts
+        estimates["top_values"] = float(top_k.error)
+
+    values = [r[column_index] for r in reservoir.rows if r[column_index] is not None]
+    # Non null values of the whole table, scaled from the reservoir
+    non_null_count = round(len(values) / max(len(reservoir.rows), 1) * row_count)
+    histogram = equi_depth_histogram(values, HISTOGRAM_BUCKETS, non_null_count)
+    if not reservoir.is_exhaustive and len(histogram) > 0:
+        estimates["histogram"] = proportion_bound(
+            len(values) // len(histogram), len(reservoir.rows), row_count
+        )
+
+    numeric = None
+    moments = sketches.moments
+    if moments.count > 0:
+        assert moments.min is not None and moments.max is not None
+        # Quantiles of the reservoir, exact when it holds the whole table
+        quantiles, sampled = quantiles_of(values)
+        if not reservoir.is_exhaustive and sampled > 0:
+            # Bound on the rank of the quantiles, as a share of the values
+            estimates["numeric.quantiles"] = Z_95 * math.sqrt(0.25 / sampled)
+        numeric = NumericStats(
+            count=moments.count,
+            mean=moments.mean,
+            stddev=moments.stddev,
+            min=moments.min,
+            max=moments.max,
+            zero_count=moments.zero_count,
+            negative_count=moments.negative_count,
+            quantiles=quantiles,
+        )
+
+    return {
+        "storage_classes": dict(sorted(sketches.storage_classes.items())),
+        "numeric": numeric,
+        "top_values": [FrequentValue(value=v, count=n) for v, n in top_k.top(TOP_K)],
+        "histogram": [HistogramBucket(lower=lo, upper=hi, count=n) for lo, hi, n in histogram],
+        "estimates": estimates,
+        "minhash": sketches.minhash.signature() if sketches.minhash is not None else None,
+    }
+
+
+def quantiles_of(values: list) -> tuple[dict[str, float], int]:
+    # (quantiles of the numbers among the values, # of numbers)
+    numbers = numeric_values(values, Counter(map(storage_class, values)))
+    quantiles = np.quantile(numbers, QUANTILES) if len(numbers) > 0 else []
+    return {f"p{round(q * 100)}": float(v) for q, v in zip(QUANTILES, quantiles)}, len(numbers)
+
+
+def sample_means(sample: list[tuple], names: list[str]) -> dict[str, float]:
+    # Mean of the numbers of each column of the sample
+    means = {}
+    for name, values in zip(names, zip(*sample)):
+        numbers = numeric_values(values, Counter(map(storage_class, values)))
+        if len(numbers) > 0:
+            means[name] = float(np.mean(numbers))
+    return means
+
+
+def grouped_histogram(value_counts: list[tuple]) -> list[HistogramBucket]:
+    # Same buckets as equi_depth_histogram over every value, from the count of each value
+    non_null_count = sum(n for _, n in value_counts)
+    buckets = min(HISTOGRAM_BUCKETS, non_null_count)
+    # Rank of the last row of each value
+    ends = np.cumsum([n for _, n in value_counts])
+
+    def value_at(rank: int):
+        return value_counts[int(np.searchsorted(ends, rank, side="right"))][0]
+
+    histogram = []
+    for i in range(buckets):
+        start = i * non_null_count // buckets
+        end = (i + 1) * non_null_count // buckets
+        histogram.append(
+            HistogramBucket(lower=value_at(start), upper=value_at(end - 1), count=end - start)
+        )
+    return histogram
+
+
+# Exact top values and histogram of the columns with at most this # of distinct values
+MAX_GROUPED_VALUES = 10_000
+
+
+def exact_fields(
+    sketches: ColumnSketches,
+    reservoir: RowReservoir,
+    column_index: int,
+    value_stats: dict,
+    row_count: int,
+    non_null_count: int,
+) -> dict:
+    # Same fields as sketch_fields with the exact storage classes and moments of
+    # value_stats. Top values and histogram are exact while the counters hold
+    # every value, the histogram and quantiles come from the sampled rows otherwise
+    estimates: dict[str, float | None] = {}
+    values = [r[column_index] for r in reservoir.rows if r[column_index] is not None]
+    top_k = sketches.top_k
+
+    top_values: list[tuple] = []
+    histogram: list[HistogramBucket] = []
+    if non_null_count == 0:
+        pass
+    elif top_k.error == 0:
+        top_values = top_k.top(TOP_K)
+        histogram = grouped_histogram(
+            sorted(top_k.counters.items(), key=lambda vc: sqlite_sort_key(vc[0]))
+        )
+    else:
+        if sketches.smallest_k > 0:
+            # Every value appears once, the first ones by value are the top ones
+            top_values = [(v, 1) for v in sketches.smallest]
+        else:
+            top_values = top_k.top(TOP_K)
+            # Counts are at most top_k.error below the true counts
+            estimates["top_values"] = float(top_k.error)
+        histogram = [
+            HistogramBucket(lower=lo, upper=hi, count=n)
+            for lo, hi, n in equi_depth_histogram(values, HISTOGRAM_BUCKETS, non_null_count)
+        ]
+        if not reservoir.is_exhaustive and len(histogram) > 0:
+            estimates["histogram"] = proportion_bound(
+                len(values) // len(histogram), len(reservoir.rows), row_count
+            )
+
+    numeric = None
+    if value_stats["numeric"] is not None:
+        quantiles, sampled = quantiles_of(values)
+        if not reservoir.is_exhaustive and sampled > 0:
+            # Bound on the rank of the quantiles, as a share of the values
+            estimates["numeric.quantiles"] = Z_95 * math.sqrt(0.25 / sampled)
+        numeric = NumericStats(**value_stats["numeric"], quantiles=quantiles)
+
+    return {
+        "storage_classes": dict(sorted(value_stats["storage_classes"].items())),
+        "numeric": numeric,
+        "top_values": [FrequentValue(value=v, count=n) for v, n in top_values],
+        "histogram": histogram,
+        "estimates": estimates,
+        "minhash": sketches.minhash.signature() if sketches.minhash is not None else None,
+    }
+
+
+def profile_partition(
+    db: DbConnector, tablename: str, partition: tuple[int, int], approx: bool = False
+) -> PartialProfile:
+    # Mergeable stats of a rowid range, merged ones go to table_profile(partial=...)
+    # or approx_table_profile(partial=...) which only needs the scan
+    cols = db.table_columns(tablename)
+    lo, hi = partition
+    where = f"{db.rowid_column()} BETWEEN {lo} AND {hi}"
+
+    stats: dict[str, dict] = {}
+    if not approx:
+        row_count, stats = db.fused_column_stats(
+            tablename, [c["column_name"] for c in cols], distinct=False, where=where
+        )
+    # Seeded by range so the reservoirs of the partitions draw differently
+    sketches, reservoir = scan_table(db, tablename, cols, distinct=True, where=where, seed=lo)
+    if approx:
+        row_count = reservoir.seen
+    return PartialProfile(row_count, stats, sketches, reservoir)
+
+
+def profile_table(
+    db: DbConnector, tablename: str, sample_size: int, approx: bool
+) -> TableMetadata:
+    if approx:
+        return approx_table_profile(db=db, tablename=tablename, sample_size=sample_size)
+    return table_profile(db=db, tablename=tablename, sample_size=sample_size)
 
 
 def read_metadata_backup_folder(foldername: str) -> DatabaseMetadata | None:
@@ -95,16 +603,225 @@ def read_metadata_backup_folder(foldername: str) -> DatabaseMetadata | None:
         print(err)
         return None
 
-def run_metadata_extraction() -> DatabaseMetadata:
-    db = SqliteConnector(ProfilingConfig.DB_CONN_STRING)
-    db_metadata = {}
-    tables: list[TableMetadata] = []
-    for tablename in db.list_tables():
-        result = table_profile(db=db, tablename=tablename, sample_size=10)
-        db_metadata[tablename] = result
-        tables.append(result)
+# Bumped when the profiles change, cached profiles of an older version are dropped
+PROFILE_VERSION = 2
+
+# Sub folders of the output path holding the profile cache and the finished partitions
+PROFILE_CACHE_FOLDER = "profile_cache"
+PARTITION_CHECKPOINT_FOLDER = "profile_checkpoints"
+# llm responses by hash of the prompt, see src/profiling/LlmCache.py
+LLM_CACHE_FOLDER = "llm_cache"
+
+# Backend and connectors (by db) of a profiling worker process, see init_profiling_worker.
+# A worker profiles tables of any database so one pool serves several databases
+_worker_backend: DbBackend | None = None
+_worker_dbs: dict[str, DbConnector] = {}
+
+
+def init_profiling_worker(backend: DbBackend, do_logging: bool) -> None:
+    global _worker_backend
+    # Workers don't inherit the config when processes are spawned
+    Config.DO_LOGGING = do_logging
+    _worker_backend = backend
+
+
+def _worker_db(conn_string: str) -> DbConnector:
+    assert _worker_backend is not None, "init_profiling_worker wasn't called"
+    if conn_string not in _worker_dbs:
+        _worker_dbs[conn_string] = create_connector(
+            _worker_backend, conn_string, Config.DO_LOGGING, read_only=True
+        )
+    return _worker_dbs[conn_string]
+
+
+def worker_table_profile(
+    conn_string: str, tablename: str, sample_size: int, approx: bool
+) -> TableMetadata:
+    return profile_table(_worker_db(conn_string), tablename, sample_size, approx)
+
+
+def worker_profile_partition(
+    conn_string: str, tablename: str, partition: tuple[int, int], approx: bool
+) -> PartialProfile:
+    return profile_partition(_worker_db(conn_string), tablename, partition, approx)
+
+
+def create_profiling_pool(workers: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        # fork isn't safe once db/llm client threads are running
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_profiling_worker,
+        initargs=(ProfilingConfig.DB_BACKEND, ProfilingConfig.DO_LOGGING),
+    )
+
+
+def run_metadata_extraction(
+    conn_string: str | None = None,
+    output_path: str | None = None,
+    pool: ProcessPoolExecutor | None = None,
+) -> DatabaseMetadata:
+    # Defaults to the configured database, `pool` is shared when profiling several databases
+    SAMPLE_SIZE = 10
+    conn_string = conn_string or ProfilingConfig.DB_CONN_STRING
+    output_path = output_path or ProfilingConfig.OUTPUT_PATH
+    db = create_connector(ProfilingConfig.DB_BACKEND, conn_string, read_only=True)
+    tablenames = db.list_tables()
+    db_metadata: dict[str, TableMetadata] = {}
+
+    # Anything changing the profiles, cached profiles and checkpoints of other options are stale
+    options = {
+        "sample_size": SAMPLE_SIZE,
+        "approx": ProfilingConfig.APPROX,
+        "partition_rows": ProfilingConfig.PARTITION_ROWS,
+        "profile_version": PROFILE_VERSION,
+    }
+
+    # Reuse the profiles of the tables that didn't change since the last run
+    cache: ProfileCache | None = None
+    fingerprints: dict[str, str] = {}
+    if ProfilingConfig.USE_CACHE:
+        cache = ProfileCache(f"{output_path}/{PROFILE_CACHE_FOLDER}")
+        data_version = db.data_version()
+        for tablename in tablenames:
+            fingerprints[tablename] = ProfileCache.table_fingerprint(
+                db, tablename, data_version, options
+            )
+            cached = cache.get(tablename, fingerprints[tablename])
+            if cached is not None:
+                db_metadata[tablename] = cached
+        log(f"[LOG] Reusing {len(db_metadata)}/{len(tablenames)} cached table profiles")
+
+    def on_profiled(tablename: str, table_metadata: TableMetadata) -> None:
+        db_metadata[tablename] = table_metadata
+        if cache is not None:
+            cache.put(tablename, fingerprints[tablename], table_metadata)
+
+    to_profile = [t for t in tablenames if t not in db_metadata]
 
-    return DatabaseMetadata(name=ProfilingConfig.DB_CONN_STRING, tables=tables)
+    # Big tables are profiled by rowid ranges, finished ranges are checkpointed
+    # so an interrupted run only profiles the remaining ones
+    partitions = {
+        t: table_partitions(db, t, ProfilingConfig.PARTITION_ROWS) for t in to_profile
+    }
+    partials: dict[str, dict[tuple[int, int], PartialProfile]] = {}
+    checkpoints: PartitionCheckpoints | None = None
+    if any(len(p) > 0 for p in partitions.values()):
+        checkpoints = PartitionCheckpoints(
+            f"{output_path}/{PARTITION_CHECKPOINT_FOLDER}",
+            conn_string,
+            db.data_version(),
+            options,
+        )
+
+    def finish_partitioned_table(tablename: str) -> None:
+        assert checkpoints is not None
+        if len(partials[tablename]) < len(partitions[tablename]):
+            return
+        # Merged in rowid order so the result doesn't depend on the completion order
+        ordered = [partials[tablename][p] for p in partitions[tablename]]
+        merged = ordered[0]
+        for partial in ordered[1:]:
+            merged.merge(partial)
+        if ProfilingConfig.APPROX:
+            table_metadata = approx_table_profile(db, tablename, SAMPLE_SIZE, partial=merged)
+        else:
+            table_metadata = table_profile(db, tablename, SAMPLE_SIZE, partial=merged)
+        on_profiled(tablename, table_metadata)
+        checkpoints.clear(tablename)
+
+    def on_partition(tablename: str, partition: tuple[int, int], partial: PartialProfile) -> None:
+        assert checkpoints is not None
+        checkpoints.put(tablename, partition, partial)
+        partials[tablename][partition] = partial
+        finish_partitioned_table(tablename)
+
+    # (tablename, rowid range or None for the whole table)
+    tasks: list[tuple[str, tuple[int, int] | None]] = []
+    for tablename in to_profile:
+        if len(partitions[tablename]) == 0:
+            tasks.append((tablename, None))
+            continue
+
+        assert checkpoints is not None
+        partials[tablename] = {}
+        for partition in partitions[tablename]:
+            partial = checkpoints.get(tablename, partition)
+            if partial is None:
+                tasks.append((tablename, partition))
+            else:
+                partials[tablename][partition] = partial
+        log(
+            f"[LOG] {tablename}: {len(partitions[tablename])} partitions "
+            f"({len(partials[tablename])} resumed from checkpoints)"
+        )
+        finish_partitioned_table(tablename)
+
+    if ProfilingConfig.WORKERS == 1 and pool is None:
+        for tablename, partition in tasks:
+            if partition is None:
+                on_profiled(
+                    tablename,
+                    profile_table(db, tablename, SAMPLE_SIZE, ProfilingConfig.APPROX),
+                )
+            else:
+                on_partition(
+                    tablename,
+                    partition,
+                    profile_partition(db, tablename, partition, ProfilingConfig.APPROX),
+                )
+    elif len(tasks) > 0:
+        # Biggest tables first so a big one doesn't start last and keep a single worker busy
+        def task_size(task: tuple[str, tuple[int, int] | None]) -> int:
+            tablename, partition = task
+            if partition is None:
+                return db.table_size_estimate(tablename)
+            return partition[1] - partition[0] + 1
+
+        schedule = sorted(tasks, key=task_size, reverse=True)
+
+        with contextlib.ExitStack() as stack:
+            if pool is None:
+                pool = stack.enter_context(create_profiling_pool(ProfilingConfig.WORKERS))
+            futures = {
+                (
+                    pool.submit(
+                        worker_table_profile,
+                        conn_string,
+                        tablename,
+                        SAMPLE_SIZE,
+                        ProfilingConfig.APPROX,
+                    )
+                    if partition is None
+                    else pool.submit(
+                        worker_profile_partition,
+                        conn_string,
+                        tablename,
+                        partition,
+                        ProfilingConfig.APPROX,
+                    )
+                ): (tablename, partition)
+                for tablename, partition in schedule
+            }
+            for i, future in enumerate(as_completed(futures)):
+                tablename, partition = futures[future]
+                if partition is None:
+                    on_profiled(tablename, future.result())
+                    log(f"Profiled table {tablename} [{i + 1}/{len(futures)}]")
+                else:
+                    on_partition(tablename, partition, future.result())
+                    log(f"Profiled table {tablename} rows {partition} [{i + 1}/{len(futures)}]")
+
+    # Same table order whatever the completion order
+    tables = [db_metadata[tablename] for tablename in tablenames]
+
+    # Needs every table profiled, inferred keys are never cached
+    inferred = infer_relationships(tables)
+    for relationship in inferred:
+        db_metadata[relationship.table].foreign_keys.append(relationship)
+    log(f"[LOG] Inferred {len(inferred)} undeclared foreign keys")
+
+    return DatabaseMetadata(name=conn_string, tables=tables)
 
 
 # TODO fix this fn
@@ -135,32 +852,193 @@ def fix_generated_output(
                     model_output.error = f"[ERR 2] Model hallucinated column name (hallucination={field_metadata})"
                     model_output.data = TableDescription.from_metadata(truth)
                     break
+            else:
+                # Same count and known names, a column described twice leaves another one out
+                names = [c.name for c in model_output.data.columns]
+                if len(set(names)) != len(names):
+                    repeated = sorted({n for n in names if names.count(n) > 1})
+                    model_output.success = False
+                    model_output.error = f"[ERR 3] Model described columns twice (repeated={repeated})"
+                    model_output.data = TableDescription.from_metadata(truth)
     
 
 
-def run_metadata_llm_summary(
-    db_metadata: DatabaseMetadata | None, report_filename: str, llm: GenAiApi
+# Max # of single table requests of a table giving no output at all
+SUMMARY_ATTEMPTS = 3
+# First delay before asking again a failed request, doubled on every failure
+RETRY_BACKOFF_SECONDS = 1.0
+
+
+async def summarize_batches(
+    llm: GenAiApi,
+    batches: list[list[TableMetadata]],
+    generations_output: dict[str, ModelOutput],
 ) -> None:
+    # Requests awaited LLM_CONCURRENCY per provider at a time, the results are merged here
+    # once gathered: the requests share no state
+    async def generation_cb(
+        batch: list[TableMetadata],
+    ) -> tuple[dict[str, ModelOutput], AiApiError | None]:
+        if len(batch) == 1:
+            result, api_error = await llm.asummarize_table_metadata(batch[0])
+            # We still add the result which is an empty table but it will be overwritten if we retry
+            return {batch[0].name: result}, api_error
+        # Tables the model didn't describe are left out, they are asked again in smaller batches
+        return await llm.asummarize_tables(batch)
+
+    # Requests of a table on its own, see SUMMARY_ATTEMPTS
+    single_attempts: Counter[str] = Counter()
+    while len(batches) > 0:
+        outputs = await run_async_tasks_with_retry(
+            cb=generation_cb,
+            cb_args=[(batch,) for batch in batches],
+            error_cb=llm.retry_strategy,
+            retry_limit=3,
+            max_concurrency=ProfilingConfig.LLM_CONCURRENCY * llm.provider_count(),
+            backoff_seconds=RETRY_BACKOFF_SECONDS,
+        )
+        for output in outputs:
+            # A raising request describes none of its tables
+            if not isinstance(output, Exception):
+                generations_output.update(output[0])
+
+        # The tables missing from a failed batch are split in two batches, down to
+        # a request per table. A table still missing after its own request
+        # (the request raised) is given up on after SUMMARY_ATTEMPTS requests
+        retry_batches = []
+        for batch in batches:
+            missing = [t for t in batch if t.name not in generations_output]
+            if len(missing) > 1:
+                half = math.ceil(len(missing) / 2)
+                retry_batches += [missing[:half], missing[half:]]
+            elif len(missing) == 1:
+                table = missing[0]
+                single_attempts[table.name] += len(batch) == 1
+                if single_attempts[table.name] < SUMMARY_ATTEMPTS:
+                    retry_batches.append(missing)
+                else:
+                    generations_output[table.name] = TableDescriptionOutput(
+                        success=False,
+                        error=f"No output after {SUMMARY_ATTEMPTS} requests",
+                        data=TableDescription.empty(),
+                    )
+        if len(retry_batches) > 0:
+            log(f"[WARN] Splitting failed batches, {len(retry_batches)} more requests")
+        batches = retry_batches
+
+
+async def summarize_wide_tables(
+    llm: GenAiApi,
+    tables: list[TableMetadata],
+    chunk_size: int,
+    generations_output: dict[str, ModelOutput],
+) -> None:
+    # The groups of chunk_size columns of every table are requested concurrently and
+    # checked on their own, a short request per table then describes the table from
+    # the descriptions of its columns
+    chunks: list[tuple[TableMetadata, list[ColumnMetadata], tuple[int, int]]] = []
+    for table in tables:
+        parts = math.ceil(len(table.columns) / chunk_size)
+        for i in range(parts):
+            chunks.append(
+                (table, table.columns[i * chunk_size : (i + 1) * chunk_size], (i + 1, parts))
+            )
+
+    outputs = await run_async_tasks_with_retry(
+        cb=llm.asummarize_columns,
+        cb_args=chunks,
+        error_cb=llm.retry_strategy,
+        retry_limit=3,
+        max_concurrency=ProfilingConfig.LLM_CONCURRENCY * llm.provider_count(),
+        backoff_seconds=RETRY_BACKOFF_SECONDS,
+    )
+    described: dict[str, list[FieldDescription]] = {t.name: [] for t in tables}
+    errors: dict[str, str] = {}
+    # In the order of the groups, so of the columns
+    for (table, _, (part, parts)), output in zip(chunks, outputs):
+        if isinstance(output, Exception) or output[0] is None:
+            errors.setdefault(table.name, f"No description of the columns {part}/{parts}")
+        else:
+            described[table.name] += output[0]
+
+    complete = [t for t in tables if t.name not in errors]
+    outputs = await run_async_tasks_with_retry(
+        cb=llm.asummarize_table_overview,
+        cb_args=[(t, described[t.name]) for t in complete],
+        error_cb=llm.retry_strategy,
+        retry_limit=3,
+        max_concurrency=ProfilingConfig.LLM_CONCURRENCY * llm.provider_count(),
+        backoff_seconds=RETRY_BACKOFF_SECONDS,
+    )
+    for table, output in zip(complete, outputs):
+        if isinstance(output, Exception) or output[0] is None:
+            errors[table.name] = "No table description"
+            continue
+        generations_output[table.name] = TableDescriptionOutput(
+            success=True,
+            error=None,
+            data=TableDescription(columns=described[table.name], table=output[0]),
+        )
+
+    for tablename, error in errors.items():
+        generations_output[tablename] = TableDescriptionOutput(
+            success=False, error=error, data=TableDescription.empty()
+        )
+
+
+def run_metadata_llm_summary(
+    db_metadata: DatabaseMetadata | None,
+    report_filename: str,
+    llm: GenAiApi,
+    output_path: str | None = None,
+) -> dict[str, ModelOutput] | None:
+    output_path = output_path or ProfilingConfig.OUTPUT_PATH
     # TODO add a custom folder
     # If no extraction we read the output folder for backed up file
     if not ProfilingConfig.DO_EXTRACTION:
-        db_metadata = read_metadata_backup_folder(ProfilingConfig.OUTPUT_PATH)
+        db_metadata = read_metadata_backup_folder(output_path)
 
     if db_metadata is None:
         log("Aborting llm summary")
-        return
+        return None
 
     generations_output: dict[str, ModelOutput] = {}
 
-    # TODO Remove the filter
-    run_args = [(table, generations_output) for table in db_metadata.tables if table.name == "Artist"]
+    tables = db_metadata.tables
+
+    # Unchanged prompts are answered by the cache, they don't wait for a rate limit slot
+    for table in tables:
+        cached = llm.cached_table_summary(table)
+        if cached is not None:
+            generations_output[table.name] = cached
+    if llm.cache is not None:
+        log(f"[LOG] Reusing {len(generations_output)}/{len(tables)} cached llm summaries")
+
+    to_summarize = [table for table in tables if table.name not in generations_output]
+    # Wide tables are summarized by groups of columns
+    chunk_size = ProfilingConfig.COLUMN_CHUNK_SIZE
+    wide_tables = [t for t in to_summarize if 0 < chunk_size < len(t.columns)]
+    # Several small tables per request when batching, a request per table otherwise
+    batches = pack_table_batches(
+        [t for t in to_summarize if t not in wide_tables],
+        ProfilingConfig.BATCH_TABLES,
+        ProfilingConfig.BATCH_TOKEN_BUDGET,
+        llm.prompt_token_budget,
+    )
 
     log("\n======= LLM RUN DETAILS =======")
     log(f"llm_model: {llm.get_model_name()}")
-    log(f"# of input tables: {len(run_args)}")
-    log(f"table_list: {[x[0].name for x in run_args]}")
-    log(f"output_path: {ProfilingConfig.OUTPUT_PATH}/{report_filename}.llm.json")
+    log(f"# of input tables: {len(to_summarize)}")
+    log(
+        f"# of requests: {len(batches) + sum(math.ceil(len(t.columns) / chunk_size) + 1 for t in wide_tables)}"
+    )
+    log(f"# of wide tables: {len(wide_tables)}")
+    log(f"table_list: {[t.name for t in to_summarize]}")
+    log(f"# of prompt tokens (estimate): {sum(count_tokens(llm.table_prompt(t)) for t in to_summarize)}")
+    log(f"output_path: {output_path}/{report_filename}.llm.json")
     log(f"Max RPM: {ProfilingConfig.MAX_RPM}")
+    log(f"Max TPM: {ProfilingConfig.MAX_TPM}")
+    log(f"Max concurrent requests: {ProfilingConfig.LLM_CONCURRENCY * llm.provider_count()}")
     log("========                 =======\n")
 
     # If no logging set we don't ask for confirmation
@@ -172,45 +1050,31 @@ def run_metadata_llm_summary(
 
     if not proceed_confirmation:
         log("\n[WARN] Aborting llm table summarization !\n")
-        return
+        return None
 
     # TODO add a way to read from a saved output instead
     # ---------------------------------
     # Rate limited api calls
-    error_queue = queue.Queue()
-    def generation_cb(
-        table_metadata: TableMetadata, output_dict: dict[str, ModelOutput]
-    ):
-        result, api_error = llm.summarize_table_metadata(table_metadata)
-        if api_error is not None:
-            error_queue.put((api_error, (table_metadata, output_dict)))
-
-        # We still add the result which is an empty table but it will be overwritten if we retry   
-        output_dict[table_metadata.name] = result
-
-    # run_rate_limited_tasks(
-    #     cb=generation_cb,
-    #     cb_args=run_args
-    # )
-    run_rate_limited_tasks_with_retry(
-        cb=generation_cb,
-        cb_args=run_args,
-        error_queue=error_queue,
-        retry_limit=3,
-        error_cb=llm.retry_strategy
+    # The limits apply to the calls reaching the model, not to the cached responses
+    llm.rate_limiter = RateLimiter(ProfilingConfig.MAX_RPM, ProfilingConfig.MAX_TPM)
+    llm.usage = LlmUsage()
+    start = time.perf_counter()
+    asyncio.run(summarize_batches(llm, batches, generations_output))
+    asyncio.run(summarize_wide_tables(llm, wide_tables, chunk_size, generations_output))
+    usage_summary = llm.usage.summary(
+        time.perf_counter() - start, llm.price_per_million_tokens()
     )
+    llm.rate_limiter, llm.usage = None, None
 
-
-    
     # Ensures model didn't hallucinate table or field name 
     fix_generated_output(generations_output, db_metadata) 
 
     # generations_output = json_import("out/profiles/Chinook/ty_gemini.llm.json")
 
-    create_dir_if_not_exists(ProfilingConfig.OUTPUT_PATH)
+    create_dir_if_not_exists(output_path)
     export_success = export_model_outputs(
         generations_output,
-        f"{ProfilingConfig.OUTPUT_PATH}/{report_filename}.llm",
+        f"{output_path}/{report_filename}.llm",
         ProfilingConfig.OUTPUT_FORMAT,
     )
 
@@ -228,13 +1092,24 @@ def run_metadata_llm_summary(
     log(f"# success: {success_count}")
     log(f"# errors: {error_count}")
     log(
-        f"\n[LOG] Summary generated at {ProfilingConfig.OUTPUT_PATH}/{report_filename}.llm.json\n"
+        f"# tokens: {usage_summary['total_tokens']} in {usage_summary['calls']} calls "
+        f"({usage_summary['retries']} retries), {usage_summary['wall_seconds']:.1f}s, "
+        f"~${usage_summary['cost_usd']:.4f}"
+    )
+    log(
+        f"\n[LOG] Summary generated at {output_path}/{report_filename}.llm.json\n"
     )
 
+    # Where the quota went, next to the summary
+    if not write_json(f"{output_path}/{report_filename}.llm.usage.json", usage_summary):
+        log("[ERR] Couldn't export the llm usage")
+
     if not export_success:
         log("[ERR] Couldn't export your data")
         log(str({k: v.model_dump() for k, v in generations_output.items()}))
 
+    return generations_output
+
 
 def export_model_outputs(
     model_outputs: dict[str, TableDescriptionOutput], filepath: str, format: OutputFormat
@@ -254,9 +1129,6 @@ def export_model_outputs(
 
             field_count: int = 0
             for i, (tablename, model_output) in enumerate(model_outputs.items()):
-                # Defining schema
-                schema.append((tablename, table_desc_creation_str))
-
                 # Defining tuples to be inserted
                 # ---- TABLE DESCRIPTIONS
                 # (id, name, desc)
@@ -275,12 +1147,207 @@ def export_model_outputs(
                     sql_data[1].append((field_count, i, f.name, f.description))
                     field_count += 1
 
+            # ---- RETRIEVAL, see SchemaIndex
+            lookup_rows, search_rows = schema_index_rows(model_outputs)
+            schema += [
+                ("column_lookup", column_lookup_creation_str),
+                ("schema_search", schema_search_creation_str),
+            ]
+            sql_data += [lookup_rows, search_rows]
+
             return sqlite_export(sql_data, schema, filepath + ".sqlite")
         case _:
             raise ValueError(f"Output format unsupported: {format}")
 
 
-def run(llm: GenAiApi):
+column_profile_creation_str = """
+CREATE TABLE IF NOT EXISTS column_profile (
+    id INT PRIMARY KEY,
+    table_name TEXT,
+    column_name TEXT,
+    declared_type TEXT,
+    is_pk INT,
+    null_count INT,
+    non_null_count INT,
+    distinct_count INT,
+    min_value,
+    max_value,
+    mean REAL,
+    stddev REAL,
+    min_length INT,
+    avg_length REAL,
+    max_length INT
+)
+"""
+
+# min_value, max_value, value, lower and upper keep the storage class of the profiled column
+column_top_value_creation_str = """
+CREATE TABLE IF NOT EXISTS column_top_value (
+    column_id INT,
+    rank INT,
+    value,
+    count INT
+)
+"""
+
+column_histogram_creation_str = """
+CREATE TABLE IF NOT EXISTS column_histogram (
+    column_id INT,
+    bucket INT,
+    lower,
+    upper,
+    count INT
+)
+"""
+
+relationship_creation_str = """
+CREATE TABLE IF NOT EXISTS relationship (
+    table_name TEXT,
+    columns TEXT,
+    ref_table TEXT,
+    ref_columns TEXT,
+    declared INT,
+    containment REAL
+)
+"""
+
+
+def export_profile_sqlite(db_metadata: DatabaseMetadata, filepath: str) -> bool:
+    schema: list[tuple[str, str]] = [
+        ("column_profile", column_profile_creation_str),
+        ("column_top_value", column_top_value_creation_str),
+        ("column_histogram", column_histogram_creation_str),
+        ("relationship", relationship_creation_str),
+    ]
+    sql_data: list[list[tuple]] = [[], [], [], []]
+
+    column_id = 0
+    for table in db_metadata.tables:
+        for c in table.columns:
+            sql_data[0].append(
+                (
+                    column_id,
+                    table.name,
+                    c.name,
+                    c.declared_type,
+                    c.is_pk,
+                    c.null_count,
+                    c.non_null_count,
+                    c.distinct_count,
+                    c.min_value,
+                    c.max_value,
+                    c.numeric.mean if c.numeric is not None else None,
+                    c.numeric.stddev if c.numeric is not None else None,
+                    c.length.min,
+                    c.length.average,
+                    c.length.max,
+                )
+            )
+            for rank, top_value in enumerate(c.top_values):
+                sql_data[1].append((column_id, rank, top_value.value, top_value.count))
+            for i, bucket in enumerate(c.histogram):
+                sql_data[2].append((column_id, i, bucket.lower, bucket.upper, bucket.count))
+            column_id += 1
+
+        for r in table.foreign_keys:
+            sql_data[3].append(
+                (
+                    r.table,
+                    ",".join(r.columns),
+                    r.ref_table,
+                    ",".join(r.ref_columns),
+                    r.declared,
+                    r.containment,
+                )
+            )
+
+    return sqlite_export(sql_data, schema, filepath)
+
+
+# Written in the output path when profiling several databases
+CATALOG_FILENAME = "catalog.sqlite"
+
+
+def database_output_path(db_path: str) -> str:
+    # Sub folder of a database (cache, checkpoints) when profiling several databases
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    digest = hashlib.sha1(os.path.abspath(db_path).encode()).hexdigest()[:8]
+    return f"{ProfilingConfig.OUTPUT_PATH}/{stem}_{digest}"
+
+
+def run_multi_database_extraction(db_paths: list[str]) -> dict[str, DatabaseMetadata]:
+    # Databases are profiled concurrently, the tables of all of them share
+    # one pool of ProfilingConfig.WORKERS processes
+    if ProfilingConfig.WORKERS == 1:
+        return {p: run_metadata_extraction(p, database_output_path(p)) for p in db_paths}
+
+    results: dict[str, DatabaseMetadata] = {}
+    with (
+        create_profiling_pool(ProfilingConfig.WORKERS) as pool,
+        # Threads only schedule the tables of their database in the pool
+        ThreadPoolExecutor(max_workers=ProfilingConfig.WORKERS) as threads,
+    ):
+        futures = {
+            threads.submit(run_metadata_extraction, p, database_output_path(p), pool): p
+            for p in db_paths
+        }
+        for i, future in enumerate(as_completed(futures)):
+            results[futures[future]] = future.result()
+            log(f"Profiled database {futures[future]} [{i + 1}/{len(futures)}]")
+
+    return {p: results[p] for p in db_paths}
+
+
+def run_multi_database(llm: GenAiApi) -> None:
+    db_paths = list_database_files(ProfilingConfig.DB_CONN_STRING)
+    log(f"[LOG] {len(db_paths)} databases found at {ProfilingConfig.DB_CONN_STRING}")
+
+    if ProfilingConfig.DRY_RUN:
+        print(
+            f"[DRY] run_multi_database: profiling {len(db_paths)} databases into "
+            f"{ProfilingConfig.OUTPUT_PATH}/{CATALOG_FILENAME}"
+        )
+        return
+    if not ProfilingConfig.DO_EXTRACTION:
+        log("[ERR] --no-extraction is unsupported when profiling several databases")
+        return
+
+    db_metadatas = run_multi_database_extraction(db_paths)
+
+    # Databases sharing a schema share their llm summaries
+    schema_hashes = {
+        p: schema_hash(SqliteConnector(p, do_logging=False, read_only=True)) for p in db_paths
+    }
+    schemas: dict[str, list[str]] = {}
+    for p in db_paths:
+        schemas.setdefault(schema_hashes[p], []).append(p)
+    log(f"[LOG] {len(schemas)} distinct schemas across {len(db_paths)} databases")
+
+    descriptions: dict[str, dict[str, ModelOutput]] = {}
+    if ProfilingConfig.DO_LLM_SUMMARY:
+        for h, paths in schemas.items():
+            # The first database of a schema stands for the others
+            outputs = run_metadata_llm_summary(
+                db_metadatas[paths[0]],
+                report_filename=h[:16],
+                llm=llm,
+                output_path=f"{ProfilingConfig.OUTPUT_PATH}/schemas",
+            )
+            if outputs is not None:
+                descriptions[h] = outputs
+    else:
+        log("[LOG] Skipped llm summary")
+
+    create_dir_if_not_exists(ProfilingConfig.OUTPUT_PATH)
+    catalog = Catalog(f"{ProfilingConfig.OUTPUT_PATH}/{CATALOG_FILENAME}")
+    for p in db_paths:
+        catalog.add_database(
+            p, schema_hashes[p], db_metadatas[p], descriptions.get(schema_hashes[p])
+        )
+    log(f"\n[LOG] Catalog generated at {ProfilingConfig.OUTPUT_PATH}/{CATALOG_FILENAME}\n")
+
+
+def run(llm: GenAiApi | None = None):
     _profiling_config = ProfilingConfig.create_from_parser()
     ProfilingConfig.init(_profiling_config)
 
@@ -288,6 +1355,30 @@ def run(llm: GenAiApi):
     log(str(_profiling_config.model_dump()))
     log("==============================================\n")
 
+    # The provider of --llm unless one is given
+    if llm is None:
+        llm = create_llm(ProfilingConfig.LLM_PROVIDER, ProfilingConfig.LLM_FAILURE_RATE)
+
+    if ProfilingConfig.USE_LLM_CACHE and not ProfilingConfig.DRY_RUN:
+        llm.set_cache(
+            LlmCache(
+                f"{ProfilingConfig.OUTPUT_PATH}/{LLM_CACHE_FOLDER}",
+                max_bytes=ProfilingConfig.LLM_CACHE_MAX_MB * 1024 * 1024,
+                ttl_seconds=ProfilingConfig.LLM_CACHE_TTL_DAYS * 24 * 3600
+                if ProfilingConfig.LLM_CACHE_TTL_DAYS > 0
+                else None,
+            )
+        )
+
+    llm.prompt_token_budget = (
+        ProfilingConfig.PROMPT_TOKEN_BUDGET if ProfilingConfig.PROMPT_TOKEN_BUDGET > 0 else None
+    )
+    llm.stream = ProfilingConfig.LLM_STREAM
+
+    if is_database_pattern(ProfilingConfig.DB_CONN_STRING):
+        run_multi_database(llm)
+        return
+
     extracted_metadata = None
     # ---------------------------------
     # Read metadata by querying database and save the metadata to output_path if requested
@@ -309,6 +1400,11 @@ def run(llm: GenAiApi):
             create_dir_if_not_exists(ProfilingConfig.OUTPUT_PATH)
             for table_metadata in extracted_metadata.tables:
                 write_json(f"{ProfilingConfig.OUTPUT_PATH}/{table_metadata.name}.json", table_metadata.model_dump())
+            # The json files are the backup read when skipping the extraction, sqlite comes on top
+            if ProfilingConfig.OUTPUT_FORMAT == OutputFormat.SQLITE:
+                export_profile_sqlite(
+                    extracted_metadata, f"{ProfilingConfig.OUTPUT_PATH}/profile.sqlite"
+                )
         
     else:
         log("[LOG] Skipped metadata extraction")
@@ -339,5 +1435,4 @@ def test():
 
 
 if __name__ == "__main__":
-    llm = Gemini()
-    run(llm)
+    run()
@@ -6,6 +6,7 @@ from enum import Enum
 from pydantic import BaseModel, ValidationError
 
 from src.lib.Config import Config
+from src.lib.DbConnector import DbBackend
 from src.lib.utils import read_json
 
 
@@ -28,6 +29,8 @@ class BenchConfig(Config):
     SAVE_STATS: bool
     DO_GENERATION_CHART: bool
     DO_ERROR_CHART: bool
+    CROSS_CHECK_BACKEND: DbBackend | None
+    COLUMNAR_RESULTS: bool
 
     @classmethod
     def init(cls, config: BenchConfig):
@@ -46,6 +49,8 @@ class BenchConfig(Config):
         cls.SAVE_STATS = config.SAVE_STATS
         cls.DO_GENERATION_CHART = config.DO_GENERATION_CHART
         cls.DO_ERROR_CHART = config.DO_ERROR_CHART
+        cls.CROSS_CHECK_BACKEND = config.CROSS_CHECK_BACKEND
+        cls.COLUMNAR_RESULTS = config.COLUMNAR_RESULTS
 
     @staticmethod
     def create_from_appsettings(
@@ -109,6 +114,8 @@ class AppSettings(BaseModel):
             SAVE_STATS=appsettings.analysis.save_stats_file,
             DO_GENERATION_CHART=appsettings.analysis.do_generation_chart,
             DO_ERROR_CHART=appsettings.analysis.do_error_chart,
+            CROSS_CHECK_BACKEND=appsettings.analysis.cross_check_backend,
+            COLUMNAR_RESULTS=appsettings.analysis.columnar_results,
         )
 
 
@@ -133,6 +140,10 @@ class AnalysisSettings(BaseModel):
     save_stats_file: bool
     do_error_chart: bool
     do_generation_chart: bool
+    # Second engine the gold and generated sql are run on, e.g. "duckdb"
+    cross_check_backend: DbBackend | None = None
+    # Fetch query results as numpy/arrow columns and compare them vectorized
+    columnar_results: bool = False
 
 
 class RunType(Enum):
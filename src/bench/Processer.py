@@ -3,17 +3,59 @@ import re
 from src.bench.BenchOutput import BenchOutput
 from src.bench.BenchInput import BenchInput
 from src.lib.SqliteConnector import SqliteConnector
-from src.lib.utils import remove_limit_clause, check_equality, read_json, create_graph
+from src.lib.DbConnector import DbBackend, DbConnector, create_connector
+from src.lib.columnar import Columns, row_count
+from src.lib.utils import (
+    remove_limit_clause,
+    check_equality,
+    check_equality_columnar,
+    has_top_level_order_by,
+    read_json,
+    create_graph,
+)
 
 
 class Processer:
-    def __init__(self, db_conn_str: str, bench_outputs: list[BenchOutput]) -> None:
+    def __init__(
+        self,
+        db_conn_str: str,
+        bench_outputs: list[BenchOutput],
+        cross_check_backend: DbBackend | None = None,
+        columnar: bool = False,
+    ) -> None:
         self.outputs: list[BenchOutput] = bench_outputs
+        # Fetch results as column arrays and compare them vectorized
+        self.columnar: bool = columnar
         self.db: SqliteConnector = SqliteConnector(db_conn_str)
+        # Second engine running the same queries to check the results are consistent
+        self.cross_check_db: DbConnector | None = (
+            None
+            if cross_check_backend is None
+            else create_connector(cross_check_backend, db_conn_str)
+        )
 
     def inputs(self) -> list[BenchInput]:
         return [o.matching_input for o in self.outputs]
 
+    def select_result(self, db: DbConnector, sql: str) -> list | Columns | None:
+        if self.columnar:
+            return db.select_columns(sql)
+        result = db.select(sql)
+        return None if result is None else list(result)
+
+    def results_equal(self, a: list | Columns, b: list | Columns, ordered: bool = True) -> bool:
+        if isinstance(a, dict) and isinstance(b, dict):
+            return check_equality_columnar(a, b, ordered)
+        assert isinstance(a, list) and isinstance(b, list)
+        return check_equality(a, b, ordered)
+
+    @staticmethod
+    def result_shape(result: list | Columns) -> tuple[int, int]:
+        # (# of rows, # of fields)
+        if isinstance(result, dict):
+            return row_count(result), len(result)
+        return len(result), 0 if len(result) == 0 else len(result[0])
+
     def get_error_stats(self):
         error_count = 0
         error_justifications = []
@@ -34,6 +76,7 @@ class Processer:
         no_match_details = []
         sql_error = 0
         sql_error_details = []
+        engine_mismatch_details = []
 
         for o in self.outputs:
             if o.error is not None:
@@ -41,11 +84,16 @@ class Processer:
 
             generated_sql = remove_limit_clause(o.generated_sql or "")
 
-            exact_result_set = self.db.select(o.matching_input.sql)
-            llm_result_set = self.db.select(generated_sql)
+            exact_result_set = self.select_result(self.db, o.matching_input.sql)
+            llm_result_set = self.select_result(self.db, generated_sql)
+
+            assert isinstance(exact_result_set, list | dict), f"type={type(exact_result_set)}"
+            assert isinstance(llm_result_set, list | dict), f"type={type(llm_result_set)}"
 
-            assert isinstance(exact_result_set, list), f"type={type(exact_result_set)}"
-            assert isinstance(llm_result_set, list), f"type={type(llm_result_set)}"
+            if self.cross_check_db is not None:
+                engine_mismatch_details.extend(
+                    self.cross_check(o, exact_result_set, llm_result_set)
+                )
 
             # Handling sql errors
             if exact_result_set is None:
@@ -64,18 +112,14 @@ class Processer:
 
             else:
                 # Comparing set
-                set_match = check_equality(llm_result_set, exact_result_set)
+                set_match = self.results_equal(llm_result_set, exact_result_set)
 
                 if set_match:
                     exact_match += 1
                 else:
                     no_match += 1
-                    row_count = len(exact_result_set)
-                    llm_row_count = len(llm_result_set)
-                    field_count = 0 if row_count == 0 else len(exact_result_set[0])
-                    llm_field_count = (
-                        0 if llm_row_count == 0 else len(llm_result_set[0])
-                    )
+                    row_count, field_count = self.result_shape(exact_result_set)
+                    llm_row_count, llm_field_count = self.result_shape(llm_result_set)
 
                     no_match_details.append(
                         {
@@ -92,8 +136,51 @@ class Processer:
             "exact_match": exact_match,
             "no_match": {"count": no_match, "details": no_match_details},
             "sql_error": {"count": sql_error, "details": sql_error_details},
+            "engine_mismatch": {
+                "count": len(engine_mismatch_details),
+                "details": engine_mismatch_details,
+            },
         }
 
+    def cross_check(
+        self,
+        o: BenchOutput,
+        exact_result_set: list | Columns,
+        llm_result_set: list | Columns,
+    ) -> list[dict]:
+        # Runs the gold and generated sql on the second engine, the results must match sqlite's
+        assert self.cross_check_db is not None
+        mismatches = []
+        for kind, sql, result_set in (
+            ("expected", o.matching_input.sql, exact_result_set),
+            ("generated", remove_limit_clause(o.generated_sql or ""), llm_result_set),
+        ):
+            other_result_set = self.select_result(self.cross_check_db, sql)
+
+            if other_result_set is None:
+                reason = "sql error"
+            elif (row_count := self.result_shape(result_set)[0]) != (
+                other_row_count := self.result_shape(other_result_set)[0]
+            ):
+                reason = f"# of row=({row_count}, {other_row_count})"
+            # Without ORDER BY each engine returns the rows in its own order
+            elif not self.results_equal(
+                other_result_set, result_set, ordered=has_top_level_order_by(sql)
+            ):
+                reason = "different values"
+            else:
+                continue
+
+            mismatches.append(
+                {
+                    "id": o.matching_input.id,
+                    "query": kind,
+                    "sql": sql,
+                    "reason": reason,
+                }
+            )
+        return mismatches
+
     def construct_stats(self):
         return {
             "success_rate": self.get_success_rate(),
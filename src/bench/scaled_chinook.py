@@ -0,0 +1,270 @@
+from __future__ import annotations
+import datetime
+import os
+import sqlite3
+from typing import Callable
+
+import numpy as np
+
+from src.lib.utils import log
+
+# ------------------------------------------------------
+# Scaled Chinook generator
+#
+# Builds a database with the Chinook schema and `scale` times its rows. Every
+# scaled table is copied `scale` times as blocks, block k gets the ids
+# id + k * max(id) so ids never collide. Block 0 is the original data, the
+# dataset queries keep their meaning. The other blocks vary the values:
+#   - foreign keys point at the same parent row of a random block, popular
+#     tracks|customers stay popular and every key exists
+#   - names get the block number, customers mix first|last names
+#   - durations|sizes are jittered, invoices are moved in time
+# Lookup tables and the staff aren't scaled.
+
+# Copied once whatever the scale
+FIXED_TABLES = ["Genre", "MediaType", "Employee"]
+# Parents before children
+SCALED_TABLES = [
+    "Artist",
+    "Album",
+    "Track",
+    "Playlist",
+    "PlaylistTrack",
+    "Customer",
+    "Invoice",
+    "InvoiceLine",
+]
+# Single column primary key of the scaled tables, PlaylistTrack has none
+PRIMARY_KEYS = {
+    "Artist": "ArtistId",
+    "Album": "AlbumId",
+    "Track": "TrackId",
+    "Playlist": "PlaylistId",
+    "Customer": "CustomerId",
+    "Invoice": "InvoiceId",
+    "InvoiceLine": "InvoiceLineId",
+}
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Invoices of the other blocks are moved by up to this many days
+MAX_DATE_SHIFT_DAYS = 180
+# Spread of the duration jitter (log-normal sigma)
+DURATION_SIGMA = 0.25
+
+
+class Block:
+    """Random draws shared by the rows of a block of a table"""
+
+    def __init__(self, k: int, scale: int, rng: np.random.Generator, size: int) -> None:
+        self.k: int = k
+        # Plain lists, sqlite3 would store numpy integers as blobs
+        # Block of the referenced rows, block 0 keeps its original references
+        self.remote: list[int] = (
+            [0] * size if k == 0 else rng.integers(0, scale, size).tolist()
+        )
+        self.jitter: list[float] = (
+            [1.0] * size if k == 0 else rng.lognormal(0.0, DURATION_SIGMA, size).tolist()
+        )
+        self.shift: list[int] = (
+            [0] * size
+            if k == 0
+            else rng.integers(-MAX_DATE_SHIFT_DAYS, MAX_DATE_SHIFT_DAYS + 1, size).tolist()
+        )
+        self.picks: list[int] = (
+            rng.permutation(size).tolist() if k > 0 else list(range(size))
+        )
+
+
+def _variant(text: str | None, k: int) -> str | None:
+    if text is None or k == 0:
+        return text
+    return f"{text} ({k + 1})"
+
+
+def _shift_date(date: str, days: int) -> str:
+    if days == 0:
+        return date
+    shifted = datetime.datetime.strptime(date, DATE_FORMAT) + datetime.timedelta(days=days)
+    return shifted.strftime(DATE_FORMAT)
+
+
+def _row_generators(
+    rows: dict[str, list[tuple]], offsets: dict[str, int]
+) -> dict[str, Callable[[int, tuple, Block], tuple]]:
+    # (row index, original row, block) -> generated row
+    def ref(tablename: str, id: int | None, block: int) -> int | None:
+        return None if id is None else id + block * offsets[tablename]
+
+    customers = rows["Customer"]
+
+    def artist(i: int, r: tuple, b: Block) -> tuple:
+        id, name = r
+        return (ref("Artist", id, b.k), _variant(name, b.k))
+
+    def album(i: int, r: tuple, b: Block) -> tuple:
+        id, title, artist_id = r
+        return (ref("Album", id, b.k), _variant(title, b.k), ref("Artist", artist_id, b.remote[i]))
+
+    def track(i: int, r: tuple, b: Block) -> tuple:
+        id, name, album_id, media_type_id, genre_id, composer, ms, size, price = r
+        # The size of a track follows its duration
+        return (
+            ref("Track", id, b.k),
+            _variant(name, b.k),
+            ref("Album", album_id, b.k),
+            media_type_id,
+            genre_id,
+            composer,
+            max(1, int(ms * b.jitter[i])),
+            None if size is None else int(size * b.jitter[i]),
+            price,
+        )
+
+    def playlist(i: int, r: tuple, b: Block) -> tuple:
+        id, name = r
+        return (ref("Playlist", id, b.k), _variant(name, b.k))
+
+    def playlist_track(i: int, r: tuple, b: Block) -> tuple:
+        # Unique as the original pairs are unique and the block only offsets the track
+        playlist_id, track_id = r
+        return (ref("Playlist", playlist_id, b.k), ref("Track", track_id, b.remote[i]))
+
+    def customer(i: int, r: tuple, b: Block) -> tuple:
+        id, first, last, *location, email, support_rep_id = r
+        if b.k > 0:
+            first = customers[b.picks[i]][1]
+            last = customers[b.picks[(i + 1) % len(customers)]][2]
+            domain = email.split("@")[-1]
+            email = f"{first}.{last}{ref('Customer', id, b.k)}@{domain}".lower().replace(" ", "")
+        return (ref("Customer", id, b.k), first, last, *location, email, support_rep_id)
+
+    def invoice(i: int, r: tuple, b: Block) -> tuple:
+        # The billing address is the address of the customer, same in every block
+        id, customer_id, date, *billing, total = r
+        return (
+            ref("Invoice", id, b.k),
+            ref("Customer", customer_id, b.remote[i]),
+            _shift_date(date, b.shift[i]),
+            *billing,
+            total,
+        )
+
+    def invoice_line(i: int, r: tuple, b: Block) -> tuple:
+        # Lines stay on the invoice of their block so the invoice totals still add up,
+        # the unit price is the one of the track in every block
+        id, invoice_id, track_id, price, quantity = r
+        return (
+            ref("InvoiceLine", id, b.k),
+            ref("Invoice", invoice_id, b.k),
+            ref("Track", track_id, b.remote[i]),
+            price,
+            quantity,
+        )
+
+    return {
+        "Artist": artist,
+        "Album": album,
+        "Track": track,
+        "Playlist": playlist,
+        "PlaylistTrack": playlist_track,
+        "Customer": customer,
+        "Invoice": invoice,
+        "InvoiceLine": invoice_line,
+    }
+
+
+def generate_scaled_chinook(
+    source_path: str,
+    target_path: str,
+    scale: int,
+    seed: int = 0,
+    batch_rows: int = 100_000,
+) -> dict[str, int]:
+    """
+    Writes a Chinook database with `scale` times the rows of `source_path` to
+    `target_path` (overwritten). Same seed, same database.
+
+    Returns the # of rows by tablename
+    """
+    assert scale >= 1, f"[ASSERT] scale={scale}"
+    rng = np.random.default_rng(seed)
+
+    try:
+        os.remove(target_path)
+    except FileNotFoundError:
+        pass
+
+    # Plain sqlite3 connections, the whole load is one transaction without journal
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        target.execute("PRAGMA journal_mode = OFF")
+        target.execute("PRAGMA synchronous = OFF")
+
+        schema = source.execute(
+            "SELECT type, sql FROM sqlite_master WHERE sql IS NOT NULL ORDER BY type DESC"
+        ).fetchall()
+        for kind, sql in schema:
+            if kind == "table":
+                target.execute(sql)
+
+        rows = {
+            tablename: source.execute(f'SELECT * FROM "{tablename}" ORDER BY rowid').fetchall()
+            for tablename in FIXED_TABLES + SCALED_TABLES
+        }
+        offsets = {
+            tablename: source.execute(f'SELECT MAX("{pk}") FROM "{tablename}"').fetchone()[0]
+            for tablename, pk in PRIMARY_KEYS.items()
+        }
+        row_generators = _row_generators(rows, offsets)
+
+        def insert(tablename: str, data: list[tuple]) -> None:
+            if len(data) == 0:
+                return
+            placeholders = ", ".join("?" * len(data[0]))
+            target.executemany(f'INSERT INTO "{tablename}" VALUES ({placeholders})', data)
+
+        for tablename in FIXED_TABLES:
+            insert(tablename, rows[tablename])
+
+        pending: dict[str, list[tuple]] = {t: [] for t in SCALED_TABLES}
+        for k in range(scale):
+            for tablename in SCALED_TABLES:
+                original = rows[tablename]
+                block = Block(k, scale, rng, len(original))
+                generate = row_generators[tablename]
+                pending[tablename].extend(generate(i, r, block) for i, r in enumerate(original))
+                if len(pending[tablename]) >= batch_rows:
+                    insert(tablename, pending[tablename])
+                    pending[tablename] = []
+            if scale >= 10 and (k + 1) % (scale // 10) == 0:
+                log(f"[LOG] Generated {k + 1}/{scale} blocks of {target_path}")
+        for tablename, data in pending.items():
+            insert(tablename, data)
+
+        # Indexes built once the rows are in, faster than maintaining them on every insert
+        for kind, sql in schema:
+            if kind == "index":
+                target.execute(sql)
+        target.commit()
+
+        return {
+            tablename: target.execute(f'SELECT COUNT(*) FROM "{tablename}"').fetchone()[0]
+            for tablename in FIXED_TABLES + SCALED_TABLES
+        }
+    finally:
+        source.close()
+        target.close()
+
+
+def expected_row_counts(source_path: str, scale: int) -> dict[str, int]:
+    # Row counts generate_scaled_chinook must produce
+    source = sqlite3.connect(source_path)
+    try:
+        return {
+            tablename: source.execute(f'SELECT COUNT(*) FROM "{tablename}"').fetchone()[0]
+            * (scale if tablename in SCALED_TABLES else 1)
+            for tablename in FIXED_TABLES + SCALED_TABLES
+        }
+    finally:
+        source.close()
@@ -0,0 +1,169 @@
+from __future__ import annotations
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, TypeVar
+
+from src.lib.DbConnector import FetchType, fetch_cursor
+
+
+T = TypeVar("T")
+
+
+class AsyncSqliteConnector:
+    """
+    asyncio facade over sqlite.
+
+    Queries are sent to a bounded thread pool where each job borrows one of
+    `pool_size` pooled connections, so the event loop keeps running other
+    coroutines (http calls, llm calls...) while sqlite works.
+    Cancelling an awaiting coroutine (task.cancel(), asyncio.wait_for timeout)
+    interrupts the statement running on its connection, a job that didn't
+    start yet never runs.
+    """
+
+    # # of sqlite VM instructions between two checks of the cancellation
+    PROGRESS_INSTRUCTIONS: int = 1000
+
+    def __init__(
+        self, conn_string: str, pool_size: int = 4, do_logging: bool = True
+    ) -> None:
+        assert pool_size > 0, f"pool_size set to {pool_size}, must be > 0"
+        self.conn_string: str = conn_string
+        self.pool_size: int = pool_size
+        self.do_logging: bool = do_logging
+
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="sqlite"
+        )
+        # Created lazily so the queue belongs to the loop that uses it
+        self._pool: asyncio.Queue[sqlite3.Connection] | None = None
+        self._connections: list[sqlite3.Connection] = []
+
+    async def __aenter__(self) -> AsyncSqliteConnector:
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    def log(self, msg: str) -> None:
+        if self.do_logging:
+            print(msg)
+
+    # -----------------------------------------------
+    # Connection pool
+
+    async def _acquire(self) -> sqlite3.Connection:
+        if self._pool is None:
+            self._pool = asyncio.Queue()
+
+        if self._pool.empty() and len(self._connections) < self.pool_size:
+            conn = sqlite3.connect(self.conn_string, check_same_thread=False)
+            self._connections.append(conn)
+            return conn
+
+        return await self._pool.get()
+
+    def _release(self, loop: asyncio.AbstractEventLoop, conn: sqlite3.Connection) -> None:
+        # Called from the worker thread once the job is done. A job finishing
+        # after close() has no pool to go back to, its connection is closed
+        pool = self._pool
+        if pool is None:
+            conn.close()
+            return
+        try:
+            loop.call_soon_threadsafe(pool.put_nowait, conn)
+        except RuntimeError:
+            # Loop already closed, the connection is closed by close()
+            pass
+
+    def _guarded(
+        self,
+        conn: sqlite3.Connection,
+        cb: Callable[[sqlite3.Connection], T],
+        cancelled: threading.Event,
+    ) -> tuple[bool, T | None]:
+        if cancelled.is_set():
+            return False, None
+        # conn.interrupt() is lost when it comes before the statement starts,
+        # the progress handler aborts the statement whenever the job is cancelled
+        conn.set_progress_handler(cancelled.is_set, self.PROGRESS_INSTRUCTIONS)
+        try:
+            return True, cb(conn)
+        except sqlite3.OperationalError as err:
+            if not cancelled.is_set():
+                self.log(f"[Warning] Sql Error: {err}")
+            return False, None
+        finally:
+            conn.set_progress_handler(None, 0)
+
+    async def _run(
+        self, cb: Callable[[sqlite3.Connection], T]
+    ) -> tuple[bool, T | None]:
+        loop = asyncio.get_running_loop()
+        conn = await self._acquire()
+
+        cancelled = threading.Event()
+        job: Future[tuple[bool, T | None]] = self._executor.submit(
+            self._guarded, conn, cb, cancelled
+        )
+        # The connection goes back to the pool only when the thread let go of it
+        job.add_done_callback(lambda _: self._release(loop, conn))
+
+        try:
+            return await asyncio.wrap_future(job)
+        except asyncio.CancelledError:
+            # A queued job is dropped, a running thread can't be cancelled but
+            # sqlite can abort its statement
+            cancelled.set()
+            if not job.cancel():
+                conn.interrupt()
+            raise
+
+    async def close(self) -> None:
+        for conn in self._connections:
+            conn.interrupt()
+        await asyncio.to_thread(self._executor.shutdown, True)
+
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
+        self._pool = None
+
+    # -----------------------------------------------
+    # Queries
+
+    async def select(
+        self, sql_query: str, fetch: FetchType | tuple[FetchType, int] = FetchType.ALL
+    ) -> list | tuple | None:
+        def execute(conn: sqlite3.Connection) -> list | tuple | None:
+            cursor = conn.cursor()
+            cursor.execute(sql_query)
+            return fetch_cursor(cursor, fetch)
+
+        success, data = await self._run(execute)
+
+        if data is None or not success:
+            return None
+        else:
+            return data
+
+    async def execute(self, sql_query: str) -> bool:
+        def execute(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute(sql_query)
+
+        success, _ = await self._run(execute)
+
+        return success
+
+    async def insert(self, insert_query: str, data: list[tuple]) -> bool:
+        def insert(conn: sqlite3.Connection) -> bool:
+            with conn:
+                conn.executemany(insert_query, data)
+            self.log(f"[LOG] Inserted {len(data)} rows")
+            return True
+
+        success, _ = await self._run(insert)
+        return success
@@ -0,0 +1,458 @@
+from __future__ import annotations
+import math
+from abc import ABC, abstractmethod
+from enum import Enum
+from typing import Any, Iterator
+
+from src.lib.columnar import ColumnarFormat, Columns
+
+
+class FetchType(Enum):
+    ALL = (1,)
+    ONE = (2,)
+    MANY = 3
+
+
+def fetch_cursor(cursor: Any, fetch: FetchType | tuple[FetchType, int]) -> list | tuple | None:
+    # Works with any DB-API cursor (sqlite3, duckdb...)
+    match fetch:
+        case FetchType.ALL:
+            return cursor.fetchall()
+        case FetchType.ONE:
+            return cursor.fetchone()
+        case (FetchType.MANY, result_count) if isinstance(result_count, int):
+            return cursor.fetchmany(result_count)
+        case _:
+            raise Exception("[Warning] Incorrect fetch type: ", fetch)
+
+
+def quote_identifier(name: str) -> str:
+    # Table|column name as a SQL identifier, the queries take the names as they are stored
+    return '"' + name.replace('"', '""') + '"'
+
+
+class DbBackend(Enum):
+    SQLITE = "sqlite"
+    DUCKDB = "duckdb"
+
+
+class DbConnector(ABC):
+    """
+    Execution backend used by the profiler and the evaluator.
+
+    Backends implement the raw query/catalog methods, the profiler statistics
+    are plain SQL shared by every backend.
+    """
+
+    def __init__(self, conn_string: str, do_logging: bool = True) -> None:
+        self.conn_string: str = conn_string
+        self.do_logging: bool = do_logging
+
+    def log(self, msg: str) -> None:
+        if self.do_logging:
+            print(msg)
+
+    @abstractmethod
+    def select(
+        self, sql_query: str, fetch: FetchType | tuple[FetchType, int] = FetchType.ALL
+    ) -> list | tuple | None:
+        pass
+
+    @abstractmethod
+    def select_columns(
+        self, sql_query: str, columnar_format: ColumnarFormat = ColumnarFormat.AUTO
+    ) -> Columns | None:
+        # Column oriented result {column_name: array}, see src/lib/columnar.py
+        pass
+
+    @abstractmethod
+    def select_chunks(self, sql_query: str, chunk_size: int) -> Iterator[list[tuple]]:
+        # Streams the result chunk_size rows at a time, sql errors are raised
+        pass
+
+    @abstractmethod
+    def execute(self, sql_query: str) -> bool:
+        pass
+
+    @abstractmethod
+    def insert(self, insert_query: str, data: list[tuple]) -> bool:
+        pass
+
+    @abstractmethod
+    def test(self) -> bool:
+        pass
+
+    @abstractmethod
+    def list_tables(self) -> list[str]:
+        pass
+
+    @abstractmethod
+    def table_columns(self, tablename: str) -> list[dict[str, Any]]:
+        # Returns list of dicts: {column_id, column_name, column_type, allows_null, default_value, is_pk}
+        pass
+
+    @abstractmethod
+    def data_version(self) -> str:
+        # Changes whenever data is committed to the database, persists across connections
+        pass
+
+    def foreign_keys(self, tablename: str) -> list[dict[str, Any]]:
+        # Returns list of dicts: {columns, ref_table, ref_columns}
+        # Backends without declared foreign keys return none
+        return []
+
+    def has_table(self, tablename: str) -> bool:
+        return tablename in self.list_tables()
+
+    def text_length_sql(self, column_name: str) -> str:
+        # SQL expression giving the length of the value as text
+        return f"LENGTH({column_name})"
+
+    # -----------------------------------------------
+    # Stats for the profiler
+
+    def table_size_estimate(self, tablename: str) -> int:
+        # Cheap size hint used to schedule the biggest tables first
+        return self.table_row_count(tablename)
+
+    def rowid_range(self, tablename: str) -> tuple[int, int] | None:
+        # (min, max) rowid to split the table in ranges, None when rows have no stable id
+        return None
+
+    def rowid_column(self) -> str:
+        # Name of the rowid in the queries
+        return "rowid"
+
+    def table_row_count(self, tablename: str) -> int:
+        result = self.select(f"SELECT COUNT(*) FROM {quote_identifier(tablename)}", fetch=FetchType.ONE)
+        assert result is not None, f"[ASSERT] tablename={tablename}"
+        return result[0]
+
+    def count_nulls_and_nonnulls(
+        self, tablename: str, column_name: str
+    ) -> tuple[int, int]:
+        c = quote_identifier(column_name)
+        q = (
+            f"SELECT SUM(CASE WHEN {c} IS NULL THEN 1 ELSE 0 END) as nulls, "
+            f"SUM(CASE WHEN {c} IS NOT NULL THEN 1 ELSE 0 END) as nonnulls FROM {quote_identifier(tablename)}"
+        )
+
+        result = self.select(q, FetchType.ONE)
+        assert result is not None, (
+            f"[ASSERT] tablename={tablename}, colname={column_name}"
+        )
+
+        nulls, nonnulls = result
+
+        # SQLite returns None for SUM over empty set sometimes; coerce
+        nulls = int(nulls or 0)
+        nonnulls = int(nonnulls or 0)
+
+        return nulls, nonnulls
+
+    def distinct_count(self, tablename: str, column_name: str) -> int:
+        q = f"SELECT COUNT(DISTINCT {quote_identifier(column_name)}) FROM {quote_identifier(tablename)}"
+
+        result = self.select(q, FetchType.ONE)
+        assert result is not None, (
+            f"[ASSERT] tablename={tablename}, colname={column_name}"
+        )
+        # check type of result
+        return int(result[0] or 0)
+
+    def min_max_for_column(self, tablename, column_name) -> tuple[Any, Any]:
+        # Values keep their storage class, mixed columns compare in sqlite order
+        # (numbers < text < blobs)
+        c = quote_identifier(column_name)
+        q = f"SELECT MIN({c}), MAX({c}) FROM {quote_identifier(tablename)} WHERE {c} IS NOT NULL"
+
+        result = self.select(q, FetchType.ONE)
+        assert result is not None, (
+            f"[ASSERT] tablename={tablename}, colname={column_name}"
+        )
+
+        return result[0], result[1]
+
+    def length_stats_sql(
+        self, tablename: str, column_name: str
+    ) -> tuple[int | None, float | None, int | None]:
+        # For text-like values compute min/avg/max length using LENGTH().
+        c = quote_identifier(column_name)
+        length = self.text_length_sql(c)
+        q = (
+            f"SELECT MIN({length}), AVG({length}), MAX({length}) "
+            f"FROM {quote_identifier(tablename)} WHERE {c} IS NOT NULL"
+        )
+
+        result = self.select(q, FetchType.ONE)
+        assert result is not None, (
+            f"[ASSERT] tablename={tablename}, colname={column_name}"
+        )
+
+        if result is None:
+            return None, None, None
+        # AVG returns float or None
+        return (
+            int(result[0]) if result[0] is not None else None,
+            float(result[1]) if result[1] is not None else None,
+            int(result[2]) if result[2] is not None else None,
+        )
+
+    # -----------------------------------------------
+    # Index backed stats, only fast when the column leads an index
+
+    def table_indexes(self, tablename: str) -> list[dict[str, Any]]:
+        # Returns list of dicts: {name, unique, partial, columns}
+        # Backends without usable indexes return no index
+        return []
+
+    def null_count(self, tablename: str, column_name: str) -> int:
+        q = f"SELECT COUNT(*) FROM {quote_identifier(tablename)} WHERE {quote_identifier(column_name)} IS NULL"
+        result = self.select(q, FetchType.ONE)
+        assert result is not None, (
+            f"[ASSERT] tablename={tablename}, colname={column_name}"
+        )
+        return int(result[0])
+
+    def min_max_from_index(self, tablename: str, column_name: str) -> tuple[Any, Any]:
+        # A lone MIN() or MAX() is a single seek at one end of the index,
+        # both in the same SELECT would scan it
+        values = []
+        for agg in ("MIN", "MAX"):
+            result = self.select(
+                f"SELECT {agg}({quote_identifier(column_name)}) FROM {quote_identifier(tablename)}",
+                FetchType.ONE,
+            )
+            assert result is not None, (
+                f"[ASSERT] tablename={tablename}, colname={column_name}"
+            )
+            values.append(result[0])
+        return values[0], values[1]
+
+    def sample_values(
+        self,
+        tablename: str,
+        column_name: str,
+        sample_size: int,
+        force_random: bool = False,
+        row_count: int | None = None,
+    ):
+        # Fetch up to sample_size non-null values. Using simple LIMIT for sampling is biased,
+        # but it's fast and avoids full table scans; for better randomness, could ORDER BY RANDOM()
+        # but that's expensive on large tables. We'll use ORDER BY RANDOM() if sample_size is small relative.
+
+        # Pass the row count when known to avoid a COUNT(*) scan per column
+        total = self.table_row_count(tablename) if row_count is None else row_count
+
+        use_random = (
+            sample_size >= 100 and sample_size < 10000 and sample_size > total * 0.05
+        )
+        use_random = use_random or force_random
+
+        c = quote_identifier(column_name)
+        q = f"SELECT {c} FROM {quote_identifier(tablename)} WHERE {c} IS NOT NULL"
+        if use_random:
+            q += f" ORDER BY RANDOM() LIMIT {sample_size}"
+        else:
+            q += f" LIMIT {sample_size}"
+
+        result = self.select(q, FetchType.ALL)
+        assert result is not None, (
+            f"[ASSERT] tablename={tablename}, colname={column_name}"
+        )
+        return [r[0] for r in result]
+
+    # Max # of columns aggregated by a single query (sqlite caps a result to 2000 columns)
+    FUSED_STATS_MAX_COLUMNS: int = 100
+
+    def fused_column_stats(
+        self,
+        tablename: str,
+        column_names: list[str],
+        index_backed: set[str] | None = None,
+        distinct: bool = True,
+        where: str | None = None,
+    ) -> tuple[int, dict[str, dict[str, Any]]]:
+        """
+        Same stats as count_nulls_and_nonnulls, distinct_count, min_max_for_column
+        and length_stats_sql but for every column in one aggregate scan
+        (one scan per FUSED_STATS_MAX_COLUMNS columns).
+
+        Distinct count and min/max of the `index_backed` columns are left out
+        (None), they are cheaper to read from their index. distinct=False leaves
+        out every distinct count (they can't be merged across partitions).
+        `where` restricts the stats to part of the table.
+
+        Returns (row_count, {column_name: stats})
+        """
+        index_backed = index_backed or set()
+        STATS_PER_COLUMN = 8
+
+        row_count = 0
+        stats: dict[str, dict[str, Any]] = {}
+        for start in range(0, max(len(column_names), 1), self.FUSED_STATS_MAX_COLUMNS):
+            chunk = column_names[start : start + self.FUSED_STATS_MAX_COLUMNS]
+
+            select_list = ["COUNT(*)"]
+            for column_name in chunk:
+                c = quote_identifier(column_name)
+                length = self.text_length_sql(c)
+                # NULL placeholders keep STATS_PER_COLUMN results per column
+                skip = column_name in index_backed
+                # Aggregates skip nulls, no need for the WHERE IS NOT NULL of the per column queries
+                select_list += [
+                    f"SUM(CASE WHEN {c} IS NULL THEN 1 ELSE 0 END)",
+                    f"SUM(CASE WHEN {c} IS NOT NULL THEN 1 ELSE 0 END)",
+                    "NULL" if skip or not distinct else f"COUNT(DISTINCT {c})",
+                    "NULL" if skip else f"MIN({c})",
+                    "NULL" if skip else f"MAX({c})",
+                    f"MIN({length})",
+                    f"AVG({length})",
+                    f"MAX({length})",
+                ]
+
+            q = f'SELECT {", ".join(select_list)} FROM {quote_identifier(tablename)}'
+            if where is not None:
+                q += f" WHERE {where}"
+            result = self.select(q, FetchType.ONE)
+            assert result is not None, f"[ASSERT] tablename={tablename}, query={q}"
+
+            row_count = int(result[0])
+            for i, column_name in enumerate(chunk):
+                (
+                    nulls,
+                    nonnulls,
+                    distinct_count,
+                    mn,
+                    mx,
+                    min_len,
+                    avg_len,
+                    max_len,
+                ) = result[1 + i * STATS_PER_COLUMN : 1 + (i + 1) * STATS_PER_COLUMN]
+
+                stats[column_name] = {
+                    "null_count": int(nulls or 0),
+                    "non_null_count": int(nonnulls or 0),
+                    "distinct_count": None
+                    if column_name in index_backed or not distinct
+                    else int(distinct_count or 0),
+                    "min_value": mn,
+                    "max_value": mx,
+                    "min_length": int(min_len) if min_len is not None else None,
+                    "avg_length": float(avg_len) if avg_len is not None else None,
+                    "max_length": int(max_len) if max_len is not None else None,
+                }
+
+        return row_count, stats
+
+    # sqlite storage classes, see Sketches.storage_class
+    STORAGE_CLASSES: tuple[str, ...] = ("integer", "real", "text", "blob")
+
+    def storage_class_sql(self, column_name: str) -> str:
+        # SQL expression giving the sqlite storage class of the value, 'null' for NULL
+        return f"typeof({column_name})"
+
+    def value_stats(
+        self,
+        tablename: str,
+        column_names: list[str],
+        shifts: dict[str, float] | None = None,
+    ) -> dict[str, dict[str, Any]]:
+        """
+        Storage classes and numeric moments of every column, the same as the
+        ColumnSketches of a scan but aggregated by the database. One scan for
+        the storage classes then one for the moments of the columns holding
+        numbers, per FUSED_STATS_MAX_COLUMNS columns.
+
+        `shifts` are values close to the means (the mean of a sample), the
+        deviations are summed around them so big values close to each other
+        keep their digits.
+
+        Returns {column_name: {"storage_classes": {class: count},
+        "numeric": {count, mean, stddev, min, max, zero_count, negative_count} | None}}
+        """
+        shifts = shifts or {}
+
+        stats: dict[str, dict[str, Any]] = {}
+        for start in range(0, len(column_names), self.FUSED_STATS_MAX_COLUMNS):
+            chunk = column_names[start : start + self.FUSED_STATS_MAX_COLUMNS]
+
+            select_list = [
+                f"SUM({self.storage_class_sql(c)} = '{sc}')"
+                for c in map(quote_identifier, chunk)
+                for sc in self.STORAGE_CLASSES
+            ]
+            q = f'SELECT {", ".join(select_list)} FROM {quote_identifier(tablename)}'
+            result = self.select(q, FetchType.ONE)
+            assert result is not None, f"[ASSERT] tablename={tablename}, query={q}"
+
+            numeric_columns = []
+            for i, column_name in enumerate(chunk):
+                counts = result[i * len(self.STORAGE_CLASSES) : (i + 1) * len(self.STORAGE_CLASSES)]
+                classes = {sc: int(n) for sc, n in zip(self.STORAGE_CLASSES, counts) if n}
+                stats[column_name] = {"storage_classes": classes, "numeric": None}
+                if "integer" in classes or "real" in classes:
+                    numeric_columns.append(column_name)
+
+            if len(numeric_columns) == 0:
+                continue
+            STATS_PER_COLUMN = 6
+            select_list = []
+            for column_name in numeric_columns:
+                c = quote_identifier(column_name)
+                if not stats[column_name]["storage_classes"].keys() <= {"integer", "real"}:
+                    # Numbers only, NULL for the values of other storage classes
+                    c = f"CASE WHEN {self.storage_class_sql(c)} IN ('integer', 'real') THEN {c} END"
+                deviation = f"(CAST({c} AS DOUBLE) - {shifts.get(column_name, 0.0)!r})"
+                select_list += [
+                    f"SUM({deviation})",
+                    f"SUM({deviation} * {deviation})",
+                    f"MIN({c})",
+                    f"MAX({c})",
+                    f"SUM({c} = 0)",
+                    f"SUM({c} < 0)",
+                ]
+            q = f'SELECT {", ".join(select_list)} FROM {quote_identifier(tablename)}'
+            result = self.select(q, FetchType.ONE)
+            assert result is not None, f"[ASSERT] tablename={tablename}, query={q}"
+
+            for i, column_name in enumerate(numeric_columns):
+                deviations, squares, mn, mx, zeros, negatives = result[
+                    i * STATS_PER_COLUMN : (i + 1) * STATS_PER_COLUMN
+                ]
+                classes = stats[column_name]["storage_classes"]
+                count = classes.get("integer", 0) + classes.get("real", 0)
+                # Sum of the squared differences to the mean
+                m2 = max(float(squares) - float(deviations) ** 2 / count, 0.0)
+                stats[column_name]["numeric"] = {
+                    "count": count,
+                    "mean": shifts.get(column_name, 0.0) + float(deviations) / count,
+                    # Sample standard deviation, same as NumericMoments
+                    "stddev": math.sqrt(m2 / (count - 1)) if count > 1 else None,
+                    "min": float(mn),
+                    "max": float(mx),
+                    "zero_count": int(zeros or 0),
+                    "negative_count": int(negatives or 0),
+                }
+
+        return stats
+
+
+def create_connector(
+    backend: DbBackend,
+    conn_string: str,
+    do_logging: bool = True,
+    read_only: bool = False,
+) -> DbConnector:
+    # Imported here, the backends import this module
+    from src.lib.SqliteConnector import SqliteConnector
+    from src.lib.DuckDbConnector import DuckDbConnector
+
+    match backend:
+        case DbBackend.SQLITE:
+            return SqliteConnector(conn_string, do_logging, read_only)
+        case DbBackend.DUCKDB:
+            # duckdb only ever reads the sqlite file
+            return DuckDbConnector(conn_string, do_logging)
+        case _:
+            raise ValueError(f"Database backend unsupported: {backend}")
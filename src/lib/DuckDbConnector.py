@@ -0,0 +1,310 @@
+from __future__ import annotations
+import datetime
+import decimal
+import os
+import sqlite3
+from enum import Enum
+from typing import Any, Callable, Iterator, TypeVar
+
+from src.lib.DbConnector import DbConnector, FetchType, fetch_cursor
+from src.lib.SqliteConnector import SqliteConnector
+from src.lib.columnar import ColumnarFormat, Columns, column_to_numpy, rows_to_columns
+
+"""
+Optional dependency, not installed with the project:
+
+pip install duckdb
+
+"""
+
+T = TypeVar("T")
+
+
+class DuckDbMode(Enum):
+    # Read the sqlite file in place through duckdb's sqlite scanner extension
+    ATTACH = "attach"
+    # Load the sqlite tables once into a duckdb file next to the sqlite one
+    CONVERT = "convert"
+
+
+class DuckDbConnector(DbConnector):
+    """
+    Columnar execution backend for a sqlite database.
+
+    The catalog (tables, declared types, pk) is still read from sqlite so the
+    profiles are the same as with SqliteConnector, only the queries run in duckdb.
+    """
+
+    CONVERT_CHUNK_SIZE: int = 50_000
+
+    def __init__(
+        self,
+        conn_string: str,
+        do_logging: bool = True,
+        mode: DuckDbMode = DuckDbMode.ATTACH,
+        converted_path: str | None = None,
+    ) -> None:
+        super().__init__(conn_string, do_logging)
+        try:
+            import duckdb
+        except ImportError as err:
+            raise ImportError(
+                "The duckdb backend requires the duckdb package (pip install duckdb)"
+            ) from err
+
+        self._duckdb = duckdb
+        self.catalog: SqliteConnector = SqliteConnector(
+            conn_string, do_logging, read_only=True
+        )
+        self.converted_path: str = converted_path or conn_string + ".duckdb"
+
+        if mode == DuckDbMode.ATTACH and not self._attach():
+            self.log("[WARN] duckdb sqlite scanner unavailable, using a converted copy")
+            mode = DuckDbMode.CONVERT
+
+        if mode == DuckDbMode.CONVERT:
+            self._convert()
+        self.mode: DuckDbMode = mode
+
+    def _attach(self) -> bool:
+        self._conn = self._duckdb.connect()
+        try:
+            self._conn.execute("INSTALL sqlite; LOAD sqlite;")
+            self._conn.execute(
+                f"ATTACH '{self.conn_string}' AS src (TYPE sqlite, READ_ONLY); USE src;"
+            )
+        except self._duckdb.Error as err:
+            self.log(f"[Warning] DuckDb Error: {err}")
+            self._conn.close()
+            return False
+        return True
+
+    def _convert(self) -> None:
+        # Reuse the copy as long as the sqlite file didn't change
+        if os.path.isfile(self.converted_path) and os.path.getmtime(
+            self.converted_path
+        ) >= os.path.getmtime(self.conn_string):
+            self._conn = self._duckdb.connect(self.converted_path, read_only=True)
+            return
+
+        try:
+            os.remove(self.converted_path)
+        except FileNotFoundError:
+            pass
+
+        self.log(f"[LOG] Converting {self.conn_string} to {self.converted_path}")
+        conn = self._duckdb.connect(self.converted_path)
+        src = sqlite3.connect(self.conn_string)
+        try:
+            for tablename in self.catalog.list_tables():
+                self._convert_table(src, conn, tablename)
+        finally:
+            src.close()
+            conn.close()
+
+        self._conn = self._duckdb.connect(self.converted_path, read_only=True)
+
+    def _convert_table(self, src: sqlite3.Connection, dst: Any, tablename: str) -> None:
+        names = [c["column_name"] for c in self.catalog.table_columns(tablename)]
+
+        # sqlite types are per value: the duckdb type is picked from the storage
+        # classes actually found in each column (one scan per table)
+        storage_classes = ("integer", "real", "text", "blob")
+        flags = ", ".join(
+            f"MAX(typeof(\"{n}\") = '{sc}')" for n in names for sc in storage_classes
+        )
+        found = src.execute(f'SELECT {flags} FROM "{tablename}"').fetchone()
+
+        duck_types = []
+        for i in range(len(names)):
+            has_int, has_real, has_text, has_blob = (
+                bool(f) for f in found[i * 4 : i * 4 + 4]
+            )
+            if has_text or (has_blob and (has_int or has_real)):
+                duck_types.append("VARCHAR")
+            elif has_blob:
+                duck_types.append("BLOB")
+            elif has_real:
+                duck_types.append("DOUBLE")
+            elif has_int:
+                duck_types.append("BIGINT")
+            else:
+                duck_types.append("VARCHAR")
+
+        column_defs = ", ".join(f'"{n}" {t}' for n, t in zip(names, duck_types))
+        dst.execute(f'CREATE TABLE "{tablename}" ({column_defs})')
+
+        try:
+            import pyarrow as pa
+        except ImportError:
+            pa = None
+            self.log("[WARN] pyarrow not installed, the conversion will be slow")
+
+        placeholders = ", ".join("?" * len(names))
+        cursor = src.execute(f'SELECT * FROM "{tablename}"')
+        while True:
+            rows = cursor.fetchmany(self.CONVERT_CHUNK_SIZE)
+            if len(rows) == 0:
+                break
+
+            if pa is None:
+                dst.executemany(
+                    f'INSERT INTO "{tablename}" VALUES ({placeholders})', rows
+                )
+                continue
+
+            columns = []
+            for values, duck_type in zip(zip(*rows), duck_types):
+                if duck_type == "VARCHAR":
+                    # Mixed storage classes are stored as their text representation
+                    values = [v if v is None or isinstance(v, str) else str(v) for v in values]
+                columns.append(pa.array(values))
+
+            chunk = pa.table(columns, names=names)
+            dst.register("sqlite_chunk", chunk)
+            dst.execute(f'INSERT INTO "{tablename}" SELECT * FROM sqlite_chunk')
+            dst.unregister("sqlite_chunk")
+
+    def _raw_dog_conn(self, cb: Callable[[Any], T]) -> tuple[bool, T | None]:
+        try:
+            # A cursor is a duplicate of the connection, safe to use per thread
+            return True, cb(self._conn.cursor())
+        except self._duckdb.Error as err:
+            self.log(f"[Warning] DuckDb Error: {err}")
+            return False, None
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def select(
+        self, sql_query: str, fetch: FetchType | tuple[FetchType, int] = FetchType.ALL
+    ) -> list | tuple | None:
+        def execute(cursor) -> list | tuple | None:
+            cursor.execute(sql_query)
+            return to_sqlite_values(fetch_cursor(cursor, fetch))
+
+        success, data = self._raw_dog_conn(execute)
+
+        if data is None or not success:
+            return None
+        else:
+            return data
+
+    def select_columns(
+        self, sql_query: str, columnar_format: ColumnarFormat = ColumnarFormat.AUTO
+    ) -> Columns | None:
+        try:
+            import pyarrow as pa
+            import pyarrow.compute as pc
+        except ImportError:
+            pa = None
+
+        def execute(cursor) -> Columns:
+            cursor.execute(sql_query)
+            if pa is None:
+                names = [d[0] for d in cursor.description]
+                rows = to_sqlite_values(cursor.fetchall())
+                assert isinstance(rows, list)
+                return rows_to_columns(rows, names, columnar_format)
+
+            # Native columnar fetch, types mapped back to sqlite-like values
+            table = cursor.fetch_arrow_table()
+            columns: Columns = {}
+            for name, column in zip(table.column_names, table.columns):
+                column = column.combine_chunks()
+                if pa.types.is_decimal(column.type):
+                    column = pc.cast(column, pa.float64())
+                elif pa.types.is_temporal(column.type):
+                    column = pc.cast(column, pa.string())
+                columns[name] = (
+                    column_to_numpy(column)
+                    if columnar_format == ColumnarFormat.NUMPY
+                    else column
+                )
+            return columns
+
+        success, data = self._raw_dog_conn(execute)
+
+        if data is None or not success:
+            return None
+        else:
+            return data
+
+    def select_chunks(self, sql_query: str, chunk_size: int) -> Iterator[list[tuple]]:
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(sql_query)
+            while len(rows := cursor.fetchmany(chunk_size)) > 0:
+                result = to_sqlite_values(rows)
+                assert isinstance(result, list)
+                yield result
+        finally:
+            cursor.close()
+
+    def execute(self, sql_query: str) -> bool:
+        success, _ = self._raw_dog_conn(lambda cursor: cursor.execute(sql_query))
+        return success
+
+    def insert(self, insert_query: str, data: list[tuple]) -> bool:
+        def insert(cursor) -> bool:
+            cursor.executemany(insert_query, data)
+            self.log(f"[LOG] Inserted {len(data)} rows")
+            return True
+
+        success, _ = self._raw_dog_conn(insert)
+        return success
+
+    def test(self) -> bool:
+        result = self.select("SELECT version();", FetchType.ONE)
+        if result is None:
+            return False
+        self.log(f"[LOG] DuckDb Version is {result[0]}")
+        return True
+
+    def list_tables(self) -> list[str]:
+        return self.catalog.list_tables()
+
+    def data_version(self) -> str:
+        return self.catalog.data_version()
+
+    def table_columns(self, tablename: str) -> list[dict[str, Any]]:
+        return self.catalog.table_columns(tablename)
+
+    def foreign_keys(self, tablename: str) -> list[dict[str, Any]]:
+        return self.catalog.foreign_keys(tablename)
+
+    def text_length_sql(self, column_name: str) -> str:
+        # duckdb has no implicit cast to text
+        return f"LENGTH(CAST({column_name} AS VARCHAR))"
+
+    def storage_class_sql(self, column_name: str) -> str:
+        # A duckdb column has a single type, mapped to the storage class its
+        # values get once fetched (see to_sqlite_value)
+        t = f"typeof({column_name})"
+        return (
+            f"CASE WHEN {column_name} IS NULL THEN 'null' "
+            f"WHEN {t} IN ('TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', "
+            f"'UTINYINT', 'USMALLINT', 'UINTEGER', 'UBIGINT') THEN 'integer' "
+            f"WHEN {t} IN ('FLOAT', 'DOUBLE') OR {t} LIKE 'DECIMAL%' THEN 'real' "
+            f"WHEN {t} = 'BLOB' THEN 'blob' ELSE 'text' END"
+        )
+
+
+def to_sqlite_value(value: Any) -> Any:
+    # duckdb returns richer python types than sqlite, map them back so both
+    # backends produce comparable (and json serializable) results
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def to_sqlite_values(result: list | tuple | None) -> list | tuple | None:
+    if result is None:
+        return None
+    if isinstance(result, tuple):
+        return tuple(to_sqlite_value(v) for v in result)
+    return [tuple(to_sqlite_value(v) for v in row) for row in result]
@@ -0,0 +1,68 @@
+from __future__ import annotations
+import asyncio
+import time
+from collections import deque
+
+
+class RateLimiter:
+    """
+    Spaces the requests sent to an api so they stay under `max_rpm` requests
+    per minute and `max_tpm` tokens per minute, -1 disables a limit.
+
+    Tokens are booked when a request starts (its prompt) and when it ends
+    (its output, see spend), a request waits until the tokens of the last
+    minute leave room for its prompt. A prompt bigger than max_tpm goes once
+    the minute is empty.
+
+    Shared by the coroutines of one event loop: every wait() books the next
+    free slot, no lock is needed as nothing awaits between reading and
+    booking the slot.
+    """
+
+    WINDOW_SECONDS: float = 60
+
+    def __init__(self, max_rpm: int, max_tpm: int = -1) -> None:
+        assert max_rpm > 0 or max_rpm == -1, f"max rpm set to {max_rpm}, must be (-1 or >0)"
+        assert max_tpm > 0 or max_tpm == -1, f"max tpm set to {max_tpm}, must be (-1 or >0)"
+        self.max_rpm: int = max_rpm
+        # The +1 is just to make sure
+        self.delay_seconds: float = 0 if max_rpm == -1 else (self.WINDOW_SECONDS + 1) / max_rpm
+        self.max_tpm: int = max_tpm
+        self._next_slot: float = 0.0
+        # (time, tokens) of the last minute
+        self._tokens: deque[tuple[float, int]] = deque()
+        self._window_tokens: int = 0
+
+    def copy(self) -> RateLimiter:
+        # Same limits, none of the booked requests|tokens
+        return RateLimiter(self.max_rpm, self.max_tpm)
+
+    def _expire(self, now: float) -> None:
+        while len(self._tokens) > 0 and self._tokens[0][0] <= now - self.WINDOW_SECONDS:
+            self._window_tokens -= self._tokens.popleft()[1]
+
+    async def wait(self, tokens: int = 0) -> None:
+        if self.delay_seconds > 0:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.delay_seconds
+            if slot > now:
+                await asyncio.sleep(slot - now)
+
+        if self.max_tpm == -1:
+            return
+        while True:
+            now = time.monotonic()
+            self._expire(now)
+            if len(self._tokens) == 0 or self._window_tokens + tokens <= self.max_tpm:
+                break
+            # Until the oldest tokens leave the window
+            await asyncio.sleep(self._tokens[0][0] + self.WINDOW_SECONDS - now)
+        self.spend(tokens)
+
+    def spend(self, tokens: int) -> None:
+        # Tokens known once the request is done, negative when the prompt was overestimated
+        if self.max_tpm == -1 or tokens == 0:
+            return
+        self._tokens.append((time.monotonic(), tokens))
+        self._window_tokens += tokens
@@ -1,52 +1,62 @@
 from __future__ import annotations
+import os
 import sqlite3
-from enum import Enum
-from typing import Callable, Any, TypeVar
+from pathlib import Path
+from typing import Callable, Any, Iterator, TypeVar
 
+from src.lib.DbConnector import DbConnector, FetchType, fetch_cursor, quote_identifier
+from src.lib.columnar import ColumnarFormat, Columns, rows_to_columns
 
-T = TypeVar("T")
 
+T = TypeVar("T")
 
-class FetchType(Enum):
-    ALL = (1,)
-    ONE = (2,)
-    MANY = 3
 
+class SqliteConnector(DbConnector):
+    def __init__(
+        self, conn_string: str, do_logging: bool = True, read_only: bool = False
+    ) -> None:
+        super().__init__(conn_string, do_logging)
+        self.read_only: bool = read_only
 
-class SqliteConnector:
-    def __init__(self, conn_string: str, do_logging: bool = True) -> None:
-        self.conn_string: str = conn_string
-        self.do_logging: bool = do_logging
+    def _connect(self) -> sqlite3.Connection:
+        if self.read_only:
+            uri = Path(self.conn_string).resolve().as_uri() + "?mode=ro"
+            return sqlite3.connect(uri, uri=True)
+        return sqlite3.connect(self.conn_string)
 
     def _raw_dog_conn(
         self, cb: Callable[[sqlite3.Connection], T]
     ) -> tuple[bool, T | None]:
         try:
-            with sqlite3.connect(self.conn_string) as conn:
+            with self._connect() as conn:
                 return True, cb(conn)
         except sqlite3.OperationalError as err:
             self.log(f"[Warning] Sql Error: {err}")
             return False, None
 
-    def log(self, msg: str) -> None:
-        if self.do_logging:
-            print(msg)
-
     def select(
         self, sql_query: str, fetch: FetchType | tuple[FetchType, int] = FetchType.ALL
     ) -> list | tuple | None:
         def execute(conn: sqlite3.Connection) -> list | tuple | None:
             cursor = conn.cursor()
             cursor.execute(sql_query)
-            match fetch:
-                case FetchType.ALL:
-                    return cursor.fetchall()
-                case FetchType.ONE:
-                    return cursor.fetchone()
-                case (FetchType.MANY, result_count) if isinstance(result_count, int):
-                    return cursor.fetchmany(result_count)
-                case _:
-                    raise Exception("[Warning] Incorrect fetch type: ", fetch)
+            return fetch_cursor(cursor, fetch)
+
+        success, data = self._raw_dog_conn(execute)
+
+        if data is None or not success:
+            return None
+        else:
+            return data
+
+    def select_columns(
+        self, sql_query: str, columnar_format: ColumnarFormat = ColumnarFormat.AUTO
+    ) -> Columns | None:
+        def execute(conn: sqlite3.Connection) -> Columns:
+            cursor = conn.cursor()
+            cursor.execute(sql_query)
+            names = [d[0] for d in cursor.description]
+            return rows_to_columns(cursor.fetchall(), names, columnar_format)
 
         success, data = self._raw_dog_conn(execute)
 
@@ -55,6 +65,15 @@ class SqliteConnector:
         else:
             return data
 
+    def select_chunks(self, sql_query: str, chunk_size: int) -> Iterator[list[tuple]]:
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql_query)
+            while len(rows := cursor.fetchmany(chunk_size)) > 0:
+                yield rows
+        finally:
+            conn.close()
+
     def execute(self, sql_query: str) -> bool:
         def select(conn: sqlite3.Connection) -> None:
             cursor = conn.cursor()
@@ -75,6 +94,24 @@ class SqliteConnector:
         success, _ = self._raw_dog_conn(insert)
         return success
 
+    def insert_all(self, inserts: list[tuple[str, list[tuple]]]) -> bool:
+        # Several (insert_query, data) in one transaction, none of them lands when one fails
+        def insert(conn: sqlite3.Connection) -> bool:
+            try:
+                for insert_query, data in inserts:
+                    if len(data) > 0:
+                        conn.executemany(insert_query, data)
+            except sqlite3.IntegrityError as err:
+                conn.rollback()
+                self.log(f"[Warning] Sql Error: {err}")
+                return False
+            conn.commit()
+            self.log(f"[LOG] Inserted {sum(len(data) for _, data in inserts)} rows")
+            return True
+
+        success, inserted = self._raw_dog_conn(insert)
+        return success and bool(inserted)
+
     def test(self) -> bool:
         def test(conn: sqlite3.Connection):
             cursor = conn.cursor()
@@ -91,6 +128,21 @@ class SqliteConnector:
 
         return success
 
+    def data_version(self) -> str:
+        # PRAGMA data_version only changes while a connection stays open, the
+        # file change counter of the header (offset 24) is bumped by every commit.
+        # In WAL mode commits land in the -wal file first so it is part of the version.
+        with open(self.conn_string, "rb") as db_file:
+            db_file.seek(24)
+            change_counter = int.from_bytes(db_file.read(4), "big")
+
+        version = str(change_counter)
+        wal_path = self.conn_string + "-wal"
+        if os.path.isfile(wal_path):
+            stat = os.stat(wal_path)
+            version += f"-wal{stat.st_size}:{stat.st_mtime_ns}"
+        return version
+
     def has_table(self, tablename: str) -> bool:
         table_list = self.select(f"""
             SELECT name
@@ -116,15 +168,76 @@ class SqliteConnector:
     # -----------------------------------------------
     # Stats for the profiler
 
+    def table_indexes(self, tablename: str) -> list[dict[str, Any]]:
+        index_list = self.select(f"PRAGMA index_list({quote_identifier(tablename)})", FetchType.ALL)
+        assert index_list is not None, f"[ASSERT] tablename={tablename}"
+
+        indexes = []
+        # (seq, name, unique, origin, partial)
+        for _, name, unique, _, partial in index_list:
+            index_info = self.select(f"PRAGMA index_xinfo({quote_identifier(name)})", FetchType.ALL)
+            assert index_info is not None, f"[ASSERT] index={name}"
+            # (seqno, cid, name, desc, coll, key), name is None for expressions
+            keys = [row for row in sorted(index_info) if row[5] == 1]
+            # Another collation doesn't order|compare values like the column does
+            if any(row[2] is None or row[4].upper() != "BINARY" for row in keys):
+                continue
+            columns = [row[2] for row in keys]
+            indexes.append(
+                {
+                    "name": name,
+                    "unique": bool(unique),
+                    "partial": bool(partial),
+                    "columns": columns,
+                }
+            )
+
+        # An INTEGER PRIMARY KEY is the rowid: the table b-tree is its index
+        pk = [c for c in self.table_columns(tablename) if c["is_pk"]]
+        if len(pk) == 1 and pk[0]["column_type"].upper() == "INTEGER":
+            indexes.append(
+                {
+                    "name": "rowid",
+                    "unique": True,
+                    "partial": False,
+                    "columns": [pk[0]["column_name"]],
+                }
+            )
+        return indexes
+
+    def table_size_estimate(self, tablename: str) -> int:
+        # MAX(rowid) is a single b-tree seek, COUNT(*) a full scan
+        result = self.select(f"SELECT MAX(_rowid_) FROM {quote_identifier(tablename)}", FetchType.ONE)
+        if result is None:
+            # WITHOUT ROWID table
+            return self.table_row_count(tablename)
+        return int(result[0] or 0)
+
+    def rowid_range(self, tablename: str) -> tuple[int, int] | None:
+        sql = self.select(
+            f"SELECT sql FROM sqlite_master WHERE type='table' AND name='{tablename}'",
+            FetchType.ONE,
+        )
+        if sql is None or sql[0] is None or "WITHOUT ROWID" in sql[0].upper():
+            return None
+
+        # Both seeks at one end of the table b-tree
+        mn = self.select(f"SELECT MIN(_rowid_) FROM {quote_identifier(tablename)}", FetchType.ONE)
+        mx = self.select(f"SELECT MAX(_rowid_) FROM {quote_identifier(tablename)}", FetchType.ONE)
+        if mn is None or mx is None or mn[0] is None:
+            return None
+        return int(mn[0]), int(mx[0])
+
+    def rowid_column(self) -> str:
+        # Not shadowed by a column named rowid
+        return "_rowid_"
+
     def table_columns(self, tablename: str) -> list[dict[str, Any]]:
         # Returns list of dicts: {cid, name, type, notnull, dflt_value, pk}
-        q = f"PRAGMA table_info({tablename})"
+        q = f"PRAGMA table_info({quote_identifier(tablename)})"
         result = self.select(q, FetchType.ALL)
         assert result is not None, f"query: {q}"
 
-        r = self.select(f"PRAGMA table_info({tablename})", FetchType.ALL)
-        assert r is not None
-
         cols = []
         for row in result:
             cols.append(
@@ -139,108 +252,27 @@ class SqliteConnector:
             )
         return cols
 
-    def table_row_count(self, tablename: str) -> int:
-        result = self.select(f'SELECT COUNT(*) FROM "{tablename}"', fetch=FetchType.ONE)
-        assert result is not None, f"[ASSERT] tablename={tablename}"
-        return result[0]
-
-    def count_nulls_and_nonnulls(
-        self, tablename: str, column_name: str
-    ) -> tuple[int, int]:
-        q = (
-            f"SELECT SUM(CASE WHEN {column_name} IS NULL THEN 1 ELSE 0 END) as nulls, "
-            f"SUM(CASE WHEN {column_name} IS NOT NULL THEN 1 ELSE 0 END) as nonnulls FROM {tablename}"
-        )
-
-        result = self.select(q, FetchType.ONE)
-        assert result is not None, (
-            f"[ASSERT] tablename={tablename}, colname={column_name}"
-        )
-
-        nulls, nonnulls = result
-
-        # SQLite returns None for SUM over empty set sometimes; coerce
-        nulls = int(nulls or 0)
-        nonnulls = int(nonnulls or 0)
-
-        return nulls, nonnulls
-
-    def distinct_count(self, tablename: str, column_name: str) -> int:
-        q = f"SELECT COUNT(DISTINCT {column_name}) FROM {tablename}"
-
-        result = self.select(q, FetchType.ONE)
-        assert result is not None, (
-            f"[ASSERT] tablename={tablename}, colname={column_name}"
-        )
-        # check type of result
-        return int(result[0] or 0)
-
-    def min_max_for_column(
-        self, tablename, column_name
-    ) -> tuple[int | None, int | None]:
-        # We attempt MIN/MAX directly; for mixed types SQLite will try to compare.
-        q = f"SELECT MIN({column_name}), MAX({column_name}) FROM {tablename} WHERE {column_name} IS NOT NULL"
-
-        result = self.select(q, FetchType.ONE)
-        assert result is not None, (
-            f"[ASSERT] tablename={tablename}, colname={column_name}"
-        )
-
-        if result is None:
-            return None, None
-        return int(result[0]), int(result[1])
-
-    def length_stats_sql(
-        self, tablename: str, column_name: str
-    ) -> tuple[int | None, float | None, int | None]:
-        # For text-like values compute min/avg/max length using LENGTH().
-        q = (
-            f"SELECT MIN(LENGTH({column_name})), AVG(LENGTH({column_name})), MAX(LENGTH({column_name})) "
-            f"FROM {tablename} WHERE {column_name} IS NOT NULL"
-        )
-
-        result = self.select(q, FetchType.ONE)
-        assert result is not None, (
-            f"[ASSERT] tablename={tablename}, colname={column_name}"
-        )
-
-        if result is None:
-            return None, None, None
-        # AVG returns float or None
-        return (
-            int(result[0]) if result[0] is not None else None,
-            float(result[1]) if result[1] is not None else None,
-            int(result[2]) if result[2] is not None else None,
-        )
-
-    def sample_values(
-        self,
-        tablename: str,
-        column_name: str,
-        sample_size: int,
-        force_random: bool = False,
-    ):
-        # Fetch up to sample_size non-null values. Using simple LIMIT for sampling is biased,
-        # but it's fast and avoids full table scans; for better randomness, could ORDER BY RANDOM()
-        # but that's expensive on large tables. We'll use ORDER BY RANDOM() if sample_size is small relative.
-
-        total = self.table_row_count(tablename)
-
-        use_random = (
-            sample_size >= 100 and sample_size < 10000 and sample_size > total * 0.05
-        )
-        use_random = use_random or force_random
-
-        if use_random:
-            q = f"SELECT {column_name} FROM {tablename} WHERE {column_name} IS NOT NULL ORDER BY RANDOM() LIMIT {sample_size}"
-        else:
-            q = f"SELECT {column_name} FROM {tablename} WHERE {column_name} IS NOT NULL LIMIT {sample_size}"
-
+    def foreign_keys(self, tablename: str) -> list[dict[str, Any]]:
+        q = f"PRAGMA foreign_key_list({quote_identifier(tablename)})"
         result = self.select(q, FetchType.ALL)
-        assert result is not None, (
-            f"[ASSERT] tablename={tablename}, colname={column_name}"
-        )
-        return [r[0] for r in result]
+        assert result is not None, f"query: {q}"
+
+        # (id, seq, table, from, to, on_update, on_delete, match), one row per column
+        keys: dict[int, dict[str, Any]] = {}
+        for fk_id, _, ref_table, from_col, to_col, *_ in sorted(result):
+            key = keys.setdefault(
+                fk_id, {"columns": [], "ref_table": ref_table, "ref_columns": []}
+            )
+            key["columns"].append(from_col)
+            key["ref_columns"].append(to_col)
+
+        for key in keys.values():
+            # No referenced column means the primary key of the referenced table
+            if None in key["ref_columns"]:
+                pk = self.select(f"PRAGMA table_info({quote_identifier(key['ref_table'])})", FetchType.ALL)
+                assert pk is not None, f"[ASSERT] tablename={key['ref_table']}"
+                key["ref_columns"] = [r[1] for r in sorted(pk, key=lambda r: r[5]) if r[5] > 0]
+        return list(keys.values())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+from __future__ import annotations
+from enum import Enum
+from typing import Any
+
+import numpy as np
+
+
+class ColumnarFormat(Enum):
+    NUMPY = "numpy"
+    ARROW = "arrow"
+    # Arrow when pyarrow is installed, numpy otherwise
+    AUTO = "auto"
+
+
+# {column_name: np.ndarray | pa.Array}
+Columns = dict[str, Any]
+
+
+def _import_arrow():
+    try:
+        import pyarrow as pa
+
+        return pa
+    except ImportError:
+        return None
+
+
+def to_numpy_column(values: list | tuple) -> np.ndarray:
+    # Typed arrays only when every value shares a numeric type, sqlite columns
+    # can hold anything so nulls and mixed values stay python objects
+    if len(values) > 0 and all(type(v) is int for v in values):
+        try:
+            return np.array(values, dtype=np.int64)
+        except OverflowError:
+            pass
+    elif len(values) > 0 and all(type(v) is float or type(v) is int for v in values):
+        return np.array(values, dtype=np.float64)
+
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def rows_to_columns(
+    rows: list[tuple], names: list[str], columnar_format: ColumnarFormat
+) -> Columns:
+    # Transposing with zip stays in C, an empty result still has its columns
+    values = list(zip(*rows)) if len(rows) > 0 else [() for _ in names]
+
+    pa = None if columnar_format == ColumnarFormat.NUMPY else _import_arrow()
+    if pa is None and columnar_format == ColumnarFormat.ARROW:
+        raise ImportError("Arrow fetch mode requires the pyarrow package (pip install pyarrow)")
+
+    if pa is not None:
+        try:
+            return {n: pa.array(v) for n, v in zip(names, values)}
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Mixed storage classes in a column can't be typed by arrow
+            if columnar_format == ColumnarFormat.ARROW:
+                raise
+
+    return {n: to_numpy_column(v) for n, v in zip(names, values)}
+
+
+def column_to_numpy(column: Any) -> np.ndarray:
+    if isinstance(column, np.ndarray):
+        return column
+    # pyarrow array, nulls would become NaN with to_numpy
+    if column.null_count > 0:
+        return to_numpy_column(column.to_pylist())
+    return column.to_numpy(zero_copy_only=False)
+
+
+def row_count(columns: Columns) -> int:
+    for column in columns.values():
+        return len(column)
+    return 0
+
+
+# Integers up to 2**53 are exact in float64
+_FLOAT_EXACT_INT = 2**53
+
+
+def _cell_keys(column: np.ndarray) -> np.ndarray | None:
+    # One uint64 key per cell, equal python values (1 == 1.0) get equal keys.
+    # None when the cells can't be keyed exactly: python objects (text, nulls,
+    # mixed storage classes) or integers too big for a float64
+    if column.dtype.kind in "iu":
+        if len(column) > 0 and (
+            column.min() < -_FLOAT_EXACT_INT or column.max() > _FLOAT_EXACT_INT
+        ):
+            return None
+        column = column.astype(np.float64)
+    elif column.dtype.kind != "f":
+        return None
+    # -0.0 == 0.0 but their bits differ
+    return (column + 0.0).view(np.uint64)
+
+
+def row_keys(columns: Columns) -> np.ndarray | None:
+    # (rows, fields) matrix of cell keys, each row sorted so field order doesn't matter.
+    # None when a column can't be keyed, see _cell_keys
+    if len(columns) == 0:
+        return np.empty((0, 0), dtype=np.uint64)
+    keys = [_cell_keys(column_to_numpy(c)) for c in columns.values()]
+    if any(k is None for k in keys):
+        return None
+    matrix = np.stack(keys, axis=1)
+    matrix.sort(axis=1)
+    return matrix
+
+
+def columns_to_rows(columns: Columns) -> list[tuple]:
+    # Back to python rows, as returned by DbConnector.select
+    values = [
+        c.tolist() if isinstance(c, np.ndarray) else c.to_pylist() for c in columns.values()
+    ]
+    return list(zip(*values))
@@ -1,17 +1,23 @@
+import asyncio
+import glob
 import json
+from collections import Counter
 import re
 import os
-import threading
-import time
-from typing import Callable
-import queue
+from typing import Awaitable, Callable, TypeVar
 import random
 
 import matplotlib.pyplot as plt
+import numpy as np
 
 from src.lib.SqliteConnector import SqliteConnector
 from src.lib.Config import Config
 from src.lib.Errors import AiApiError
+from src.lib.columnar import Columns, columns_to_rows, row_keys
+from src.lib.RateLimiter import RateLimiter
+
+
+T = TypeVar("T")
 
 
 def chaos_monkey(failure_rate: float) -> bool:
@@ -69,6 +75,8 @@ def sqlite_export(
         success = success and db.execute(create_table)
         if not success:
             break
+        if len(table_data) == 0:
+            continue
         question_marks = ",?" * len(table_data[0])
         question_marks = question_marks.removeprefix(",")
         success = db.insert(
@@ -85,8 +93,14 @@ def normalize_result(result: list) -> tuple:
     return tuple(map(lambda x: sorted(x, key=hash), result))
 
 
-# NOTE it doesn't check for order
-def check_equality(table1: list, table2: list) -> bool:
+# NOTE it doesn't check for the order of the fields.
+# ordered=False compares the rows as multisets, whatever their order
+def check_equality(table1: list, table2: list, ordered: bool = True) -> bool:
+    if not ordered:
+        return Counter(map(tuple, normalize_result(table1))) == Counter(
+            map(tuple, normalize_result(table2))
+        )
+
     for a, b in zip(normalize_result(table1), normalize_result(table2)):
         if a != b:
             return False
@@ -94,6 +108,30 @@ def check_equality(table1: list, table2: list) -> bool:
     return True
 
 
+# NOTE same comparison as check_equality, vectorized over columnar results
+def check_equality_columnar(table1: Columns, table2: Columns, ordered: bool = True) -> bool:
+    keys1 = row_keys(table1)
+    keys2 = row_keys(table2)
+    if keys1 is None or keys2 is None:
+        # Text, nulls or huge integers: python equality on the rows
+        return check_equality(columns_to_rows(table1), columns_to_rows(table2), ordered)
+    if not ordered:
+        if len(keys1) != len(keys2) or keys1.shape[1:] != keys2.shape[1:]:
+            return False
+        # Same order for both whatever the order they came in
+        if keys1.shape[1] > 0:
+            keys1 = keys1[np.lexsort(keys1.T[::-1])]
+            keys2 = keys2[np.lexsort(keys2.T[::-1])]
+
+    row_count = min(len(keys1), len(keys2))
+    if row_count == 0:
+        return True
+    if keys1.shape[1] != keys2.shape[1]:
+        return False
+
+    return bool(np.array_equal(keys1[:row_count], keys2[:row_count]))
+
+
 def json_to_str(json_obj: dict | list) -> str:
     return json.dumps(json_obj)
 
@@ -163,6 +201,16 @@ def remove_limit_clause(sql_query: str) -> str:
     return cleaned_query.strip()  # .strip() ensures no leading/trailing space is left
 
 
+def has_top_level_order_by(sql_query: str) -> bool:
+    # ORDER BY of the outer query, the row order is then part of the result.
+    # The ones of subqueries and windows (in parentheses) don't count
+    query = re.sub(r"--[^\n]*|/\*.*?\*/", " ", sql_query, flags=re.DOTALL)
+    query = re.sub(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"", "''", query)
+    while re.search(r"\([^()]*\)", query):
+        query = re.sub(r"\([^()]*\)", " ", query)
+    return re.search(r"\bORDER\s+BY\b", query, flags=re.IGNORECASE) is not None
+
+
 def create_graph(
     output_path: str,
     categories: list[str],
@@ -193,65 +241,107 @@ def read_dir_files(path: str) -> list[str]:
     return os.listdir(path)
 
 
-def run_rate_limited_tasks(cb: Callable, cb_args: list[tuple]):
-    max_rpm = Config.MAX_RPM
-    threads: list[threading.Thread] = []
+DATABASE_FILE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
 
-    for args in cb_args:
-        threads.append(threading.Thread(target=cb, args=args))
 
-    # To not hit the LLM Api rate limit we add a delay between requests (the +1 is just to make sure)
-    assert max_rpm > 0 or max_rpm == -1, f"max rpm set to {max_rpm}, must be (-1 or >0)"
-    if max_rpm == -1:
-        thread_delay_seconds = 0
-    else:
-        thread_delay_seconds: float = (60 + 1) / max_rpm
+def is_database_pattern(path: str) -> bool:
+    # A directory or a glob of databases instead of a single database file
+    return os.path.isdir(path) or any(c in path for c in "*?[")
+
 
-    for i, t in enumerate(threads):
-        log(f"Starting task [{i + 1}/{len(threads)}]")
-        t.start()
+def list_database_files(path: str) -> list[str]:
+    if os.path.isdir(path):
+        paths = [
+            os.path.join(path, f)
+            for f in read_dir_files(path)
+            if f.endswith(DATABASE_FILE_EXTENSIONS)
+        ]
+    else:
+        paths = glob.glob(path)
+    return sorted(p for p in paths if os.path.isfile(p))
 
-        if thread_delay_seconds > 0:
-            time.sleep(thread_delay_seconds)
 
-    [t.join() for t in threads]
+def backoff_delay(error_count: int, base_seconds: float, max_seconds: float) -> float:
+    # Exponential backoff with jitter: half the delay is fixed, the other half is random
+    # so the tasks failing together (rate limit...) don't come back together
+    delay = min(max_seconds, base_seconds * 2 ** (error_count - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
 
 
-def run_rate_limited_tasks_with_retry(
-    cb: Callable,
+async def run_async_tasks_with_retry(
+    cb: Callable[..., Awaitable[tuple[T, AiApiError | None]]],
     cb_args: list[tuple],
     error_cb: Callable[[int, int], bool] | None,
-    error_queue: queue.Queue[tuple[AiApiError, tuple]],
     retry_limit: int,
-):
+    max_concurrency: int,
+    rate_limiter: RateLimiter | None = None,
+    backoff_seconds: float = 1.0,
+    max_backoff_seconds: float = 60.0,
+) -> list[tuple[T, AiApiError | None] | Exception]:
+    # cb returns (result, api error). A failed task error_cb allows goes back to the
+    # queue after its backoff while the other tasks keep running, every task has its
+    # own error count: error_cb(code, count) and retry_limit apply to the task alone.
+    # Last result of every task, in the order of cb_args
+    assert max_concurrency > 0, f"max_concurrency set to {max_concurrency}, must be > 0"
+
     # If no error cb is specified we only rely on the retry_limit
     if error_cb is None:
         error_cb = lambda x, y: True  # noqa: E731
 
-    error_log: dict[int, int] = {}
-    retry_args = cb_args
-    loop_count: int = 0
-    while len(retry_args) > 0:
-        if loop_count > 0:
-            log(
-                f"Retry attempt {loop_count} for failed tasks ({len(retry_args)} failed)"
-            )
-        loop_count += 1
-        run_rate_limited_tasks(cb=cb, cb_args=retry_args)
-
-        # We empty the previous args
-        retry_args = []
-        while not error_queue.empty():
-            (api_error, args) = error_queue.get()
+    loop = asyncio.get_running_loop()
+    results: list[tuple[T, AiApiError | None] | Exception] = [None] * len(cb_args)  # type: ignore[list-item]
+    error_counts: list[int] = [0] * len(cb_args)
+    # Task indexes, None tells a worker to stop
+    pending: asyncio.Queue[int | None] = asyncio.Queue()
+    for i in range(len(cb_args)):
+        pending.put_nowait(i)
+    worker_count = min(max_concurrency, len(cb_args))
+    unfinished = len(cb_args)
+
+    def finish() -> None:
+        nonlocal unfinished
+        unfinished -= 1
+        if unfinished == 0:
+            for _ in range(worker_count):
+                pending.put_nowait(None)
+
+    async def worker() -> None:
+        while True:
+            i = await pending.get()
+            if i is None:
+                return
+            if rate_limiter is not None:
+                await rate_limiter.wait()
+            if error_counts[i] > 0:
+                log(f"Retry attempt {error_counts[i]} of task [{i + 1}/{len(cb_args)}]")
+            else:
+                log(f"Starting task [{i + 1}/{len(cb_args)}]")
+            try:
+                results[i] = output = await cb(*cb_args[i])
+            except Exception as err:
+                log(f"[ERR] Task [{i + 1}/{len(cb_args)}] raised {err!r}")
+                results[i] = err
+                finish()
+                continue
+
+            api_error = output[1]
+            if api_error is None:
+                finish()
+                continue
             log(str(api_error.code))
             log(api_error.message)
-            # Log the error for error_cb strategy
-            error_log.setdefault(api_error.code, 0)
-            error_log[api_error.code] += 1
-            error_count = error_log[api_error.code]
-
-            if error_count < retry_limit and error_cb(api_error.code, error_count):
-                retry_args.append(args)
+            error_counts[i] += 1
+            if error_counts[i] < retry_limit and error_cb(api_error.code, error_counts[i]):
+                loop.call_later(
+                    backoff_delay(error_counts[i], backoff_seconds, max_backoff_seconds),
+                    pending.put_nowait,
+                    i,
+                )
+            else:
+                finish()
+
+    await asyncio.gather(*(worker() for _ in range(worker_count)))
+    return results
 
 
 if __name__ == "__main__":
@@ -0,0 +1,191 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+
+from src.lib.DbConnector import DbConnector
+from src.lib.SqliteConnector import SqliteConnector
+from src.lib.utils import log
+from src.profiling.Models import DatabaseMetadata, TableDescriptionOutput
+
+
+def schema_hash(db: DbConnector) -> str:
+    # Databases with the same tables, columns and foreign keys share a hash whatever their rows
+    schema = [
+        {
+            "table": tablename,
+            "columns": [
+                (c["column_name"], c["column_type"], c["allows_null"], c["is_pk"])
+                for c in db.table_columns(tablename)
+            ],
+            "foreign_keys": db.foreign_keys(tablename),
+        }
+        for tablename in sorted(db.list_tables())
+    ]
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode()).hexdigest()
+
+
+catalog_creation_strs = [
+    """
+CREATE TABLE database (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE,
+    schema_hash TEXT,
+    table_count INT
+)
+""",
+    """
+CREATE TABLE db_table (
+    id INTEGER PRIMARY KEY,
+    database_id INT REFERENCES database(id),
+    name TEXT,
+    row_count INT,
+    description TEXT,
+    UNIQUE (database_id, name)
+)
+""",
+    """
+CREATE TABLE db_column (
+    id INTEGER PRIMARY KEY,
+    table_id INT REFERENCES db_table(id),
+    name TEXT,
+    declared_type TEXT,
+    is_pk INT,
+    null_count INT,
+    non_null_count INT,
+    distinct_count INT,
+    min_value,
+    max_value,
+    description TEXT,
+    -- ColumnMetadata json: histogram, top values, numeric stats...
+    profile TEXT,
+    UNIQUE (table_id, name)
+)
+""",
+    """
+CREATE TABLE relationship (
+    database_id INT REFERENCES database(id),
+    table_name TEXT,
+    columns TEXT,
+    ref_table TEXT,
+    ref_columns TEXT,
+    declared INT,
+    containment REAL
+)
+""",
+    # Lookups by schema, by table|column name across databases
+    "CREATE INDEX database_schema_hash ON database (schema_hash)",
+    "CREATE INDEX db_table_name ON db_table (name)",
+    "CREATE INDEX db_column_name ON db_column (name)",
+    "CREATE INDEX relationship_database ON relationship (database_id, table_name)",
+]
+
+
+class Catalog:
+    """
+    One sqlite database holding the profiles and descriptions of many databases.
+
+    Rewritten on every run, rows get their ids from the catalog itself. A
+    database goes in with its tables, columns and relationships in a single
+    transaction: either all of them land or none, and the counts only grow
+    with the databases that landed.
+    """
+
+    def __init__(self, filepath: str) -> None:
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+
+        self.db: SqliteConnector = SqliteConnector(filepath, do_logging=False)
+        for creation_str in catalog_creation_strs:
+            assert self.db.execute(creation_str), f"[ASSERT] catalog creation: {creation_str}"
+        self.database_count: int = 0
+        self.table_count: int = 0
+        self.column_count: int = 0
+
+    def add_database(
+        self,
+        path: str,
+        db_schema_hash: str,
+        db_metadata: DatabaseMetadata,
+        descriptions: dict[str, TableDescriptionOutput] | None = None,
+    ) -> bool:
+        # descriptions: LLM summary by tablename, shared by the databases of a same schema.
+        # False when the database couldn't be added, the catalog is left as it was
+        descriptions = descriptions or {}
+        database_id = self.database_count
+        column_id = self.column_count
+        tables, columns, relationships = [], [], []
+
+        for i, table in enumerate(db_metadata.tables):
+            table_id = self.table_count + i
+
+            description = descriptions.get(table.name)
+            column_descriptions = {}
+            if description is not None and description.success:
+                column_descriptions = {c.name: c.description for c in description.data.columns}
+            tables.append(
+                (
+                    table_id,
+                    database_id,
+                    table.name,
+                    table.row_count,
+                    description.data.table
+                    if description is not None and description.success
+                    else None,
+                )
+            )
+
+            for c in table.columns:
+                columns.append(
+                    (
+                        column_id,
+                        table_id,
+                        c.name,
+                        c.declared_type,
+                        c.is_pk,
+                        c.null_count,
+                        c.non_null_count,
+                        c.distinct_count,
+                        c.min_value,
+                        c.max_value,
+                        column_descriptions.get(c.name),
+                        c.model_dump_json(),
+                    )
+                )
+                column_id += 1
+
+            for r in table.foreign_keys:
+                relationships.append(
+                    (
+                        database_id,
+                        r.table,
+                        ",".join(r.columns),
+                        r.ref_table,
+                        ",".join(r.ref_columns),
+                        r.declared,
+                        r.containment,
+                    )
+                )
+
+        # One transaction, a failed database leaves no partial rows behind
+        success = self.db.insert_all(
+            [
+                (
+                    "INSERT INTO database VALUES (?, ?, ?, ?)",
+                    [(database_id, path, db_schema_hash, len(db_metadata.tables))],
+                ),
+                ("INSERT INTO db_table VALUES (?, ?, ?, ?, ?)", tables),
+                ("INSERT INTO db_column VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", columns),
+                ("INSERT INTO relationship VALUES (?, ?, ?, ?, ?, ?, ?)", relationships),
+            ]
+        )
+
+        if not success:
+            log(f"[ERR] Couldn't add {path} to the catalog")
+            return False
+        self.database_count += 1
+        self.table_count += len(db_metadata.tables)
+        self.column_count = column_id
+        return True
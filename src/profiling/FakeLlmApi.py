@@ -0,0 +1,163 @@
+from __future__ import annotations
+import asyncio
+import random
+import threading
+import time
+from collections import Counter
+from typing import AsyncIterator, Type
+
+from src.lib.Errors import AiApiError
+from src.lib.utils import log
+from src.profiling.GenAi import GenAiApi
+from src.profiling.Models import (
+    FieldDescription,
+    NamedTableDescription,
+    TableDescription,
+    TablesDescription,
+)
+from src.profiling.PromptEncoding import count_tokens, decode_table_metadata
+
+# # of chunks of a streamed response
+STREAM_CHUNKS = 8
+
+
+class FakeLlm(GenAiApi):
+    """
+    Offline stand-in of a model provider, no network nor api key.
+
+    Describes the tables of the prompt from their metadata (names and declared
+    types) with schema valid json, after a simulated latency. A share of the
+    calls fail with one of `error_codes`, respond with truncated json or
+    describe a column that isn't in the table, to exercise the retries.
+
+    Deterministic: the latency and the faults of a call only depend on the seed,
+    the prompt and how many times the prompt was asked, not on the order of the
+    concurrent calls.
+    """
+
+    def __init__(
+        self,
+        latency_seconds: float = 0.5,
+        latency_jitter: float = 0.5,
+        error_rate: float = 0.0,
+        error_codes: tuple[int, ...] = (429, 503),
+        malformed_rate: float = 0.0,
+        hallucination_rate: float = 0.0,
+        seed: int = 0,
+        model_name: str = "fake",
+    ) -> None:
+        assert 0 <= latency_jitter <= 1, f"latency_jitter set to {latency_jitter}, must be in [0, 1]"
+        assert len(error_codes) > 0 or error_rate == 0, "error_rate > 0 requires error_codes"
+        self.latency_seconds: float = latency_seconds
+        # Share of the latency drawn at random, 0 for a constant latency
+        self.latency_jitter: float = latency_jitter
+        self.error_rate: float = error_rate
+        self.error_codes: tuple[int, ...] = error_codes
+        self.malformed_rate: float = malformed_rate
+        self.hallucination_rate: float = hallucination_rate
+        self.seed: int = seed
+        # Several fakes of a pool stand for several models
+        self.model_name: str = model_name
+        self.calls: int = 0
+        self.attempts: Counter[str] = Counter()
+        self.lock: threading.Lock = threading.Lock()
+
+    def get_model_name(self) -> str:
+        return self.model_name
+
+    def _generate_text(self, prompt: str) -> str | None:
+        return None
+
+    def retry_strategy(self, status_code: int, count: int) -> bool:
+        if count < 1:
+            log(f"[WARN] error count incorrect {count} code={status_code}")
+            return False
+        return status_code in (418, 429, 500, 503)
+
+    def _call(self, prompt: str, response_schema: Type) -> tuple[float, str | AiApiError]:
+        # (latency, response) of the next call of the prompt
+        with self.lock:
+            self.calls += 1
+            self.attempts[prompt] += 1
+            attempt = self.attempts[prompt]
+        rng = random.Random(f"{self.seed}|{attempt}|{prompt}")
+        latency = self.latency_seconds * (1 - self.latency_jitter * rng.random())
+
+        draw = rng.random()
+        if draw < self.error_rate:
+            code = rng.choice(self.error_codes)
+            return latency, AiApiError(
+                code=code, message=repr("Simulated failure"), details=f"attempt {attempt}"
+            )
+        draw -= self.error_rate
+
+        response = describe_prompt(prompt, response_schema)
+        if draw < self.malformed_rate:
+            return latency, response[: len(response) // 2]
+        draw -= self.malformed_rate
+
+        if draw < self.hallucination_rate:
+            return latency, describe_prompt(prompt, response_schema, hallucinate=True)
+        return latency, response
+
+    def _report_counted_usage(self, prompt: str, response: str | AiApiError) -> None:
+        if isinstance(response, str):
+            self.report_usage(count_tokens(prompt), count_tokens(response))
+
+    def _generate_json(self, prompt: str, response_schema: Type) -> str | AiApiError:
+        latency, response = self._call(prompt, response_schema)
+        time.sleep(latency)
+        self._report_counted_usage(prompt, response)
+        return response
+
+    async def _agenerate_json(self, prompt: str, response_schema: Type) -> str | AiApiError:
+        latency, response = self._call(prompt, response_schema)
+        await asyncio.sleep(latency)
+        self._report_counted_usage(prompt, response)
+        return response
+
+    async def _agenerate_json_stream(
+        self, prompt: str, response_schema: Type
+    ) -> AsyncIterator[str | AiApiError]:
+        # The latency is spread over STREAM_CHUNKS chunks, dropping the stream saves the rest
+        latency, response = self._call(prompt, response_schema)
+        if isinstance(response, AiApiError):
+            await asyncio.sleep(latency)
+            yield response
+            return
+        chunk_size = -(-len(response) // STREAM_CHUNKS)
+        for i in range(0, len(response), chunk_size):
+            await asyncio.sleep(latency / STREAM_CHUNKS)
+            yield response[i : i + chunk_size]
+        self._report_counted_usage(prompt, response)
+
+
+def describe_prompt(prompt: str, response_schema: Type, hallucinate: bool = False) -> str:
+    # Descriptions built from the metadata of the prompt, hallucinate renames the
+    # first column of every table
+    descriptions = []
+    for tablename, columns in decode_table_metadata(prompt):
+        fields = [
+            FieldDescription(
+                name=name,
+                description=f"The **{declared_type}** column {name} of the {tablename} table.",
+            )
+            for name, declared_type in columns
+        ]
+        if hallucinate and len(fields) > 0:
+            fields[0].name += "_hallucinated"
+        descriptions.append(
+            NamedTableDescription(
+                name=tablename,
+                columns=fields,
+                table=f"The **{tablename}** table, {len(columns)} columns.",
+            )
+        )
+
+    if response_schema is TablesDescription:
+        return TablesDescription(tables=descriptions).model_dump_json()
+    if len(descriptions) == 0:
+        return TableDescription.empty().model_dump_json()
+    # The fields of the schema (TableDescription, ColumnsDescription, TableSummary...)
+    # out of the description of the table
+    return response_schema.model_validate(descriptions[0].model_dump()).model_dump_json()
@@ -1,10 +1,14 @@
 from __future__ import annotations
-from typing import Type
+import os
+from contextlib import aclosing
+from typing import AsyncIterator, Type
 from google import genai
+from google.genai import types
 from google.genai.errors import APIError
 from dotenv import load_dotenv
 
 from src.profiling.GenAi import GenAiApi
+from src.profiling.LlmPool import LlmPool
 from src.lib.Errors import AiApiError
 from src.lib.utils import log, chaos_monkey
 
@@ -13,13 +17,36 @@ from src.lib.utils import log, chaos_monkey
 
 GEMINI_API_KEY=<api_key>
 
+Optional, for --llm gemini-pool (a Gemini per key and model, the quotas add up):
+
+GEMINI_API_KEYS=<api_key>,<api_key>,...
+GEMINI_MODELS=gemini-2.5-flash,gemini-2.5-flash-lite,...
+
 """
 
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+# ($ per 1M prompt tokens, $ per 1M output tokens), thinking tokens are billed as output
+MODEL_PRICES: dict[str, tuple[float, float]] = {
+    "gemini-2.5-pro": (1.25, 10.0),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+}
+
+
 class Gemini(GenAiApi):
-    def __init__(self, model_name: str = "gemini-2.5-flash") -> None:
+    def __init__(
+        self,
+        model_name: str = DEFAULT_MODEL,
+        failure_rate: float = 0.0,
+        api_key: str | None = None,
+    ) -> None:
+        # api_key: GEMINI_API_KEY of the environment when None
         load_dotenv()
-        self.client: genai.Client = genai.Client()
+        self.client: genai.Client = genai.Client(api_key=api_key)
         self.model_name: str = model_name
+        # Share of the calls failing on purpose with a 418, to test the retries
+        self.failure_rate: float = failure_rate
 
     def _generate_text(self, prompt: str) -> str | None:
         response = self.client.models.generate_content(
@@ -28,7 +55,7 @@ class Gemini(GenAiApi):
         return response.text
 
     def _generate_json(self, prompt: str, response_schema: Type) -> str | AiApiError:
-        if chaos_monkey(0.1):
+        if chaos_monkey(self.failure_rate):
             return AiApiError(code=418, message=repr("Crash test"), details="Controlled failure")
         try:
             response = self.client.models.generate_content(
@@ -39,10 +66,29 @@ class Gemini(GenAiApi):
                     "response_schema": response_schema,
                 },
             )
+            self._report_response_usage(response)
             return str(response.text)
         except APIError as e:
             return AiApiError(code=e.code, message=repr(e.message), details=repr(e.details))
-            
+
+    async def _agenerate_json(self, prompt: str, response_schema: Type) -> str | AiApiError:
+        # Same request through the async client, no thread per pending request
+        if chaos_monkey(self.failure_rate):
+            return AiApiError(code=418, message=repr("Crash test"), details="Controlled failure")
+        try:
+            response = await self.client.aio.models.generate_content(
+                model=self.model_name,
+                contents=prompt,
+                config={
+                    "response_mime_type": "application/json",
+                    "response_schema": response_schema,
+                },
+            )
+            self._report_response_usage(response)
+            return str(response.text)
+        except APIError as e:
+            return AiApiError(code=e.code, message=repr(e.message), details=repr(e.details))
+
 
     def _summarize_db_table(self, tablename: str, db_metadata: dict[str, dict]) -> str:
         if tablename not in db_metadata.keys():
@@ -50,6 +96,43 @@ class Gemini(GenAiApi):
 
         return ""
     
+    async def _agenerate_json_stream(
+        self, prompt: str, response_schema: Type
+    ) -> AsyncIterator[str | AiApiError]:
+        if chaos_monkey(self.failure_rate):
+            yield AiApiError(code=418, message=repr("Crash test"), details="Controlled failure")
+            return
+        try:
+            stream = await self.client.aio.models.generate_content_stream(
+                model=self.model_name,
+                contents=prompt,
+                config={
+                    "response_mime_type": "application/json",
+                    "response_schema": response_schema,
+                },
+            )
+            # Closed with the consumer's stream, which drops the http response
+            async with aclosing(stream):
+                async for chunk in stream:
+                    # The usage of the last chunk covers the whole response
+                    self._report_response_usage(chunk)
+                    if chunk.text:
+                        yield chunk.text
+        except APIError as e:
+            yield AiApiError(code=e.code, message=repr(e.message), details=repr(e.details))
+
+    def _report_response_usage(self, response: types.GenerateContentResponse) -> None:
+        usage = response.usage_metadata
+        if usage is None or usage.prompt_token_count is None:
+            return
+        total = usage.total_token_count or usage.prompt_token_count
+        self.report_usage(usage.prompt_token_count, total - usage.prompt_token_count, total)
+
+    def price_per_million_tokens(self) -> tuple[float, float]:
+        if self.model_name not in MODEL_PRICES:
+            log(f"[WARN] No price for gemini model {self.model_name}, cost estimated at 0")
+        return MODEL_PRICES.get(self.model_name, (0.0, 0.0))
+
     def get_model_name(self) -> str:
         return self.model_name
     
@@ -64,8 +147,29 @@ class Gemini(GenAiApi):
             
             case 418:
                 return True
+
+            # Rate limited|overloaded, asked again after a backoff
+            case 429 | 500 | 503:
+                return True
             
             case _:
                 log(f"[WARN] No strategy for gemini error code {status_code}")
                 return False
-        
\ No newline at end of file
+        
+
+
+def _env_list(name: str) -> list[str]:
+    return [v.strip() for v in os.environ.get(name, "").split(",") if v.strip() != ""]
+
+
+def gemini_pool(failure_rate: float = 0.0) -> LlmPool:
+    # A member per (key, model) of the .env: the quotas are per key and model
+    load_dotenv()
+    keys = _env_list("GEMINI_API_KEYS") or _env_list("GEMINI_API_KEY")
+    models = _env_list("GEMINI_MODELS") or [DEFAULT_MODEL]
+    if len(keys) == 0:
+        raise ValueError("No gemini api key, set GEMINI_API_KEYS in the .env")
+    log(f"[LOG] Gemini pool of {len(keys)} keys x {len(models)} models")
+    return LlmPool(
+        [Gemini(model, failure_rate, api_key=key) for key in keys for model in models]
+    )
@@ -1,12 +1,58 @@
 from __future__ import annotations
+import asyncio
+import time
 from abc import ABC, abstractmethod
-from typing import Type
+from contextlib import aclosing
+from contextvars import ContextVar
+from enum import Enum
+from typing import AsyncIterator, Callable, Type
 from pydantic import ValidationError
 
-from src.profiling.Models import TableDescription, TableMetadata, TableDescriptionOutput
+from src.profiling.Models import (
+    ColumnMetadata,
+    ColumnsDescription,
+    FieldDescription,
+    TableDescription,
+    TableMetadata,
+    TableDescriptionOutput,
+    TablesDescription,
+    TableSummary,
+)
+from src.profiling.LlmCache import LlmCache
+from src.profiling.JsonStream import JsonStreamChecker
+from src.profiling.LlmUsage import LlmCall, LlmUsage
+from src.profiling.PromptEncoding import compact_table_metadata, count_tokens
 from src.lib.Errors import AiApiError
+from src.lib.RateLimiter import RateLimiter
+from src.lib.utils import log
+
+# Max # of streamed requests of a prompt dropped for an off-format response
+STREAM_ATTEMPTS = 3
+# Max # of requests of a column group of a wide table not describing exactly its columns
+CHUNK_ATTEMPTS = 3
+
+
+class LlmProvider(Enum):
+    GEMINI = "gemini"
+    # A Gemini per api key and model of the .env, see gemini_pool
+    GEMINI_POOL = "gemini-pool"
+    # Offline stand-in, see src/profiling/FakeLlmApi.py
+    FAKE = "fake"
+
 
 class GenAiApi(ABC):
+    # Responses of previous runs, see set_cache
+    cache: LlmCache | None = None
+    # Max # of tokens of the table metadata in a prompt, None for no limit
+    prompt_token_budget: int | None = None
+    # Calls of the current llm summary, None to not record them
+    usage: LlmUsage | None = None
+    # Requests|tokens per minute of the async calls, None for no limit
+    rate_limiter: RateLimiter | None = None
+    # Async summaries read the response as it is generated and drop it once it goes
+    # off-format, see JsonStreamChecker
+    stream: bool = False
+
     @abstractmethod
     def get_model_name(self) -> str:
         pass
@@ -22,76 +68,506 @@ class GenAiApi(ABC):
     def _generate_json(self, prompt: str, response_schema: Type) -> str | AiApiError:
         pass
 
+    async def _agenerate_json(self, prompt: str, response_schema: Type) -> str | AiApiError:
+        # Apis without an async client answer from a thread of the default executor
+        return await asyncio.to_thread(self._generate_json, prompt, response_schema)
+
+    async def _agenerate_json_stream(
+        self, prompt: str, response_schema: Type
+    ) -> AsyncIterator[str | AiApiError]:
+        # Chunks of the response, an error ends it. Apis without streaming send one chunk
+        yield await self._agenerate_json(prompt, response_schema)
+
+    def provider_count(self) -> int:
+        # # of providers sharing the requests, each takes LLM_CONCURRENCY of them at once
+        return 1
+
+    def price_per_million_tokens(self) -> tuple[float, float]:
+        # ($ per 1M prompt tokens, $ per 1M output tokens) for the cost estimate
+        return 0.0, 0.0
+
+    def report_usage(
+        self, prompt_tokens: int, output_tokens: int, total_tokens: int | None = None
+    ) -> None:
+        # Called by the providers from _generate_json with the usage the api returned,
+        # the tokens are otherwise counted from the prompt and the response
+        call = _current_call.get()
+        if call is None:
+            return
+        call.prompt_tokens = prompt_tokens
+        call.output_tokens = output_tokens
+        call.total_tokens = total_tokens if total_tokens is not None else prompt_tokens + output_tokens
+        call.estimated = False
+
+    def _start_call(self, prompt: str, tables: list[str] | None) -> LlmCall:
+        call = LlmCall(
+            model=self.get_model_name(),
+            tables=tables or [],
+            prompt_tokens=count_tokens(prompt),
+            estimated=True,
+        )
+        _current_call.set(call)
+        return call
+
+    def _finish_call(
+        self, call: LlmCall, start: float, response: str | AiApiError | None
+    ) -> None:
+        # response: None when _generate_json raised
+        _current_call.set(None)
+        call.latency_seconds = time.perf_counter() - start
+        if isinstance(response, AiApiError):
+            call.error_code = response.code
+        elif response is None:
+            call.error_code = -1
+        if call.estimated:
+            # A failed request isn't billed
+            if not isinstance(response, str):
+                call.prompt_tokens = 0
+            call.output_tokens = count_tokens(response) if isinstance(response, str) else 0
+            call.total_tokens = call.prompt_tokens + call.output_tokens
+        if self.usage is not None:
+            self.usage.record(call)
+
+    def set_cache(self, cache: LlmCache | None) -> None:
+        self.cache = cache
+
+    def cache_model_names(self) -> list[str]:
+        # Models whose cached responses answer this api
+        return [self.get_model_name()]
+
+    def _cached_response(self, prompt: str, response_schema: Type) -> str | None:
+        # Response of any of cache_model_names, None without cache.
+        # Resets the answering model of the coming request
+        _answering_model.set(None)
+        if self.cache is None:
+            return None
+        for model_name in self.cache_model_names():
+            cached = self.cache.get(LlmCache.key(model_name, prompt, response_schema))
+            if cached is not None:
+                return cached
+        return None
+
+    def _cache_response(
+        self,
+        prompt: str,
+        response: str | AiApiError,
+        response_schema: Type,
+        checker: Callable[[], JsonStreamChecker] | None = None,
+    ) -> None:
+        # Errors and off-format responses (schema, or names the checker rejects)
+        # are asked again on the next run. Keyed on the model that answered
+        if (
+            self.cache is not None
+            and not isinstance(response, AiApiError)
+            and _matches_schema(response, response_schema)
+            and (checker is None or checker().feed(response))
+        ):
+            model_name = _answering_model.get() or self.get_model_name()
+            self.cache.put(LlmCache.key(model_name, prompt, response_schema), model_name, response)
+
+    def generate_json(
+        self, prompt: str, response_schema: Type, tables: list[str] | None = None
+    ) -> str | AiApiError:
+        # _generate_json behind the response cache, tables: the tables the call is recorded for
+        cached = self._cached_response(prompt, response_schema)
+        if cached is not None:
+            return cached
+        call, start, response = self._start_call(prompt, tables), time.perf_counter(), None
+        try:
+            response = self._generate_json(prompt, response_schema)
+        finally:
+            self._finish_call(call, start, response)
+        self._cache_response(prompt, response, response_schema)
+        return response
+
+    async def agenerate_json(
+        self,
+        prompt: str,
+        response_schema: Type,
+        tables: list[str] | None = None,
+        checker: Callable[[], JsonStreamChecker] | None = None,
+    ) -> str | AiApiError:
+        # _agenerate_json behind the response cache and the rate limiter.
+        # checker: validation of the streamed response when streaming, a response
+        # it rejects is dropped and asked again right away, up to STREAM_ATTEMPTS times
+        cached = self._cached_response(prompt, response_schema)
+        if cached is not None:
+            return cached
+
+        attempts = STREAM_ATTEMPTS if self.stream and checker is not None else 1
+        for attempt in range(attempts):
+            response, error = await self._acall(
+                prompt, response_schema, tables, checker if self.stream else None
+            )
+            if error is None:
+                break
+            log(f"[WARN] Dropped off-format response [{attempt + 1}/{attempts}]: {error}")
+        self._cache_response(prompt, response, response_schema, checker)
+        return response
+
+    async def _acall(
+        self,
+        prompt: str,
+        response_schema: Type,
+        tables: list[str] | None,
+        checker: Callable[[], JsonStreamChecker] | None,
+    ) -> tuple[str | AiApiError, str | None]:
+        # (response, why the stream was dropped) of one request to the model
+        prompt_tokens = count_tokens(prompt)
+        if self.rate_limiter is not None:
+            await self.rate_limiter.wait(prompt_tokens)
+        # Concurrent requests run in their own asyncio task, so in their own context
+        call, start, response, error = self._start_call(prompt, tables), time.perf_counter(), None, None
+        try:
+            if checker is None:
+                response = await self._agenerate_json(prompt, response_schema)
+            else:
+                response, error = await self._astream_json(prompt, response_schema, checker())
+                call.aborted = error is not None
+        finally:
+            self._finish_call(call, start, response)
+            if self.rate_limiter is not None:
+                # The output and the miscounted prompt tokens count too
+                self.rate_limiter.spend(call.total_tokens - prompt_tokens)
+        return response, error
+
+    async def _astream_json(
+        self, prompt: str, response_schema: Type, checker: JsonStreamChecker
+    ) -> tuple[str | AiApiError, str | None]:
+        # Closing the stream early stops the generation
+        chunks: list[str] = []
+        async with aclosing(self._agenerate_json_stream(prompt, response_schema)) as stream:
+            async for chunk in stream:
+                if isinstance(chunk, AiApiError):
+                    return chunk, None
+                chunks.append(chunk)
+                if not checker.feed(chunk):
+                    return "".join(chunks), checker.error
+        return "".join(chunks), None
+
+    def table_prompt(self, table_metadata: TableMetadata | str) -> str:
+        return table_summarization_prompt_init(table_metadata, self.prompt_token_budget)
+
+    def cached_table_summary(
+        self, table_metadata: TableMetadata | str
+    ) -> TableDescriptionOutput | None:
+        # Summary of a previous run for the same prompt, without calling the model
+        if self.cache is None:
+            return None
+        cached = self._cached_response(self.table_prompt(table_metadata), TableDescription)
+        if cached is None:
+            return None
+        return TableDescriptionOutput(
+            success=True, error=None, data=TableDescription.model_validate_json(cached)
+        )
+
     def summarize_table_metadata(
         self, table_metadata: TableMetadata | str
     ) -> tuple[TableDescriptionOutput, AiApiError | None]:
-        prompt = table_summarization_prompt_init(table_metadata)
+        prompt = self.table_prompt(table_metadata)
+        return table_output(
+            self.generate_json(prompt, TableDescription, _tablenames([table_metadata]))
+        )
 
-        response = self._generate_json(prompt, TableDescription)
+    async def asummarize_table_metadata(
+        self, table_metadata: TableMetadata | str
+    ) -> tuple[TableDescriptionOutput, AiApiError | None]:
+        prompt = self.table_prompt(table_metadata)
+        checker = None
+        if isinstance(table_metadata, TableMetadata):
+            checker = lambda: description_checker([table_metadata])  # noqa: E731
+        return table_output(
+            await self.agenerate_json(
+                prompt, TableDescription, _tablenames([table_metadata]), checker
+            )
+        )
 
-        if isinstance(response, AiApiError):
-            return TableDescriptionOutput(
-                success=False,
-                error="Api error",
-                data=TableDescription.empty()
-            ), response
+    def summarize_tables(
+        self, tables: list[TableMetadata]
+    ) -> tuple[dict[str, TableDescriptionOutput], AiApiError | None]:
+        # One request for several tables, only the tables the model fully described
+        # are returned: the caller asks again for the others
+        prompt = tables_summarization_prompt_init(tables, self.prompt_token_budget)
+        return tables_outputs(
+            tables, self.generate_json(prompt, TablesDescription, _tablenames(tables))
+        )
 
+    async def asummarize_tables(
+        self, tables: list[TableMetadata]
+    ) -> tuple[dict[str, TableDescriptionOutput], AiApiError | None]:
+        prompt = tables_summarization_prompt_init(tables, self.prompt_token_budget)
+        return tables_outputs(
+            tables,
+            await self.agenerate_json(
+                prompt, TablesDescription, _tablenames(tables), lambda: description_checker(tables)
+            ),
+        )
+
+    async def asummarize_columns(
+        self, table: TableMetadata, columns: list[ColumnMetadata], part: tuple[int, int]
+    ) -> tuple[list[FieldDescription] | None, AiApiError | None]:
+        # Descriptions of a group of columns of a wide table, part: (group #, # of groups).
+        # An off-format group is asked again on its own, None after CHUNK_ATTEMPTS requests
+        chunk = table.model_copy(update={"columns": columns})
+        prompt = columns_summarization_prompt_init(
+            chunk, len(table.columns), part, self.prompt_token_budget
+        )
+        for attempt in range(CHUNK_ATTEMPTS):
+            response = await self.agenerate_json(
+                prompt, ColumnsDescription, [table.name], lambda: description_checker([chunk])
+            )
+            if isinstance(response, AiApiError):
+                return None, response
+            try:
+                parse_result = ColumnsDescription.model_validate_json(response)
+                if describes_columns(chunk, parse_result):
+                    return parse_result.columns, None
+            except ValidationError:
+                pass
+            log(
+                f"[WARN] Off-format description of the columns {part[0]}/{part[1]} "
+                f"of {table.name} [{attempt + 1}/{CHUNK_ATTEMPTS}]"
+            )
+        return None, None
+
+    async def asummarize_table_overview(
+        self, table: TableMetadata, columns: list[FieldDescription]
+    ) -> tuple[str | None, AiApiError | None]:
+        # Description of a wide table from the descriptions of its columns
+        prompt = table_overview_prompt_init(table, columns)
+        response = await self.agenerate_json(prompt, TableSummary, [table.name])
+        if isinstance(response, AiApiError):
+            return None, response
         try:
-            parse_result = TableDescription.model_validate_json(response)
+            return TableSummary.model_validate_json(response).table, None
         except ValidationError:
-            parse_result = None
+            return None, None
+
+
+def table_output(
+    response: str | AiApiError,
+) -> tuple[TableDescriptionOutput, AiApiError | None]:
+    if isinstance(response, AiApiError):
+        return TableDescriptionOutput(
+            success=False,
+            error="Api error",
+            data=TableDescription.empty()
+        ), response
+
+    try:
+        parse_result = TableDescription.model_validate_json(response)
+    except ValidationError:
+        parse_result = None
+
+    if parse_result is None:
+        return TableDescriptionOutput(
+            success=False,
+            error=f"Model didn't respond with valid json: {response}",
+            data=TableDescription.empty(),
+        ), None
+
+    return TableDescriptionOutput(success=True, error=None, data=parse_result), None
+
+
+def tables_outputs(
+    tables: list[TableMetadata], response: str | AiApiError
+) -> tuple[dict[str, TableDescriptionOutput], AiApiError | None]:
+    if isinstance(response, AiApiError):
+        return {}, response
 
-        # parse_result = str_to_json(response)
+    try:
+        parse_result = TablesDescription.model_validate_json(response)
+    except ValidationError:
+        return {}, None
 
-        if parse_result is None:
-            return TableDescriptionOutput(
-                success=False,
-                error=f"Model didn't respond with valid json: {response}",
-                data=TableDescription.empty(),
-            ), None
+    by_name = {t.name: t for t in tables}
+    outputs: dict[str, TableDescriptionOutput] = {}
+    for description in parse_result.tables:
+        table = by_name.get(description.name)
+        if table is None or not describes_columns(table, description):
+            continue
+        outputs[table.name] = TableDescriptionOutput(
+            success=True,
+            error=None,
+            data=TableDescription(columns=description.columns, table=description.table),
+        )
+    return outputs, None
 
-        return TableDescriptionOutput(success=True, error=None, data=parse_result), None
-    
 
+# Call of the request in progress, see report_usage
+_current_call: ContextVar[LlmCall | None] = ContextVar("current_llm_call", default=None)
+# Model of the response of the request in progress when it isn't the api's own (LlmPool),
+# the cache key of the response
+_answering_model: ContextVar[str | None] = ContextVar("answering_model", default=None)
 
-def table_summarization_prompt_init(table_metadata: str | TableMetadata):
+
+def set_answering_model(model_name: str) -> None:
+    _answering_model.set(model_name)
+
+
+def _tablenames(tables: list[TableMetadata] | list[TableMetadata | str]) -> list[str]:
+    # Metadata given as text has no name
+    return [t.name for t in tables if isinstance(t, TableMetadata)]
+
+
+def create_llm(provider: LlmProvider, failure_rate: float = 0.0) -> GenAiApi:
+    # failure_rate: share of the calls failing on purpose, to test the retries
+    # Imported here, the providers import this module
+    from src.profiling.GeminiApi import Gemini, gemini_pool
+    from src.profiling.FakeLlmApi import FakeLlm
+
+    match provider:
+        case LlmProvider.GEMINI:
+            return Gemini(failure_rate=failure_rate)
+        case LlmProvider.GEMINI_POOL:
+            return gemini_pool(failure_rate=failure_rate)
+        case LlmProvider.FAKE:
+            return FakeLlm(error_rate=failure_rate)
+
+
+def description_checker(tables: list[TableMetadata]) -> JsonStreamChecker:
+    # Fails on the first column|table name that isn't in the prompt, for a
+    # TableDescription of one table or a TablesDescription of several
+    columns = {t.name: {c.name for c in t.columns} for t in tables}
+    all_columns = set().union(*columns.values())
+    # Index in "tables" -> (tablename once read, column names read so far)
+    described: dict[int, tuple[str | None, list[str]]] = {}
+
+    def on_string(path: list[str | int], value: str) -> str | None:
+        match path:
+            case ["columns", int(), "name"]:
+                if value not in all_columns:
+                    return f"Unknown column {value!r}"
+            case ["tables", int(i), "columns", int(), "name"]:
+                tablename, names = described.setdefault(i, (None, []))
+                if value not in (all_columns if tablename is None else columns[tablename]):
+                    return f"Unknown column {value!r}"
+                names.append(value)
+            case ["tables", int(i), "name"]:
+                if value not in columns:
+                    return f"Unknown table {value!r}"
+                # The columns may come before the name
+                _, names = described.get(i, (None, []))
+                unknown = [n for n in names if n not in columns[value]]
+                if len(unknown) > 0:
+                    return f"Unknown columns {unknown} of {value!r}"
+                described[i] = (value, names)
+        return None
+
+    return JsonStreamChecker(on_string)
+
+
+def describes_columns(
+    table: TableMetadata, description: TableDescription | ColumnsDescription
+) -> bool:
+    # Every column described once, no hallucinated one
+    names = [c.name for c in description.columns]
+    return len(names) == len(table.columns) and set(names) == {c.name for c in table.columns}
+
+
+
+def _matches_schema(response: str, response_schema: Type) -> bool:
+    if not hasattr(response_schema, "model_validate_json"):
+        return True
+    try:
+        response_schema.model_validate_json(response)
+        return True
+    except ValidationError:
+        return False
+
+
+METADATA_LEGEND = "(range is min .. max, values are samples or the most frequent values with their count)"
+
+COLUMNS_OUTPUT_FORMAT = '"columns": [{"name": "<column_name>", "description": "<description>"}, ...], "table": "<description>"'
+
+EXAMPLE_OUTPUT = (
+    '"columns": ['
+    '{"name": "EmployeeID", "description": "An **INTEGER** foreign key to the Employee table identifying the employee of each sales record, the \'who\' of the transaction."}, '
+    '{"name": "Quarterly_Revenue", "description": "A **DECIMAL** sales amount generated by the employee during a quarter, the performance metric of the table."}], '
+    '"table": "The **Employee_Sales** fact table links an employee to their quarterly revenue. EmployeeID repeats across rows, one row per period, to track performance trends."'
+)
+
+
+def table_summarization_prompt_init(
+    table_metadata: str | TableMetadata, token_budget: int | None = None
+):
+    # token_budget: max # of tokens of the table metadata, see src/profiling/PromptEncoding.py
+    metadata = (
+        table_metadata
+        if isinstance(table_metadata, str)
+        else compact_table_metadata(table_metadata, token_budget)
+    )
     return f"""
 Given the following sql table meta data. Give me a short description of each column of the table and then a short descrition of the table.
 You MUST respect the given output format which should be ONLY valid json
 **Table meta data**
-{table_metadata if isinstance(table_metadata, str) else table_metadata.model_dump_json()}
+{METADATA_LEGEND}
+{metadata}
+
+**Output format**
+{{{COLUMNS_OUTPUT_FORMAT}}}
+
+**Example ouput**
+{{{EXAMPLE_OUTPUT}}}"""
+
+
+def tables_summarization_prompt_init(
+    tables: list[TableMetadata], token_budget: int | None = None
+):
+    # token_budget applies to each table
+    metadata = "\n\n".join(compact_table_metadata(t, token_budget) for t in tables)
+    return f"""
+Given the following meta data of {len(tables)} sql tables. For every table, give me a short description of each column of the table and then a short descrition of the table.
+You MUST respect the given output format which should be ONLY valid json, with one entry per table named exactly as given
+**Tables meta data**
+{METADATA_LEGEND}
+{metadata}
 
 **Output format**
-{{
-    "columns": [
-        {{
-            "name": "<column_name>",
-            "description": "<description>"
-        }},
-        {{
-            "name":"<column_name>",
-            "description": "<description>"
-        }},
-        ...
-    ],
-    "table": "<description>"
-}}
+{{"tables": [{{"name": "<table_name>", {COLUMNS_OUTPUT_FORMAT}}}, ...]}}
 
 **Example ouput**
+{{"tables": [{{"name": "Employee_Sales", {EXAMPLE_OUTPUT}}}]}}"""
+
+
+def columns_summarization_prompt_init(
+    chunk: TableMetadata, column_count: int, part: tuple[int, int], token_budget: int | None = None
+):
+    # chunk: the table with only the columns of the group
+    metadata = compact_table_metadata(chunk, token_budget)
+    return f"""
+Given the following meta data of {len(chunk.columns)} of the {column_count} columns of an sql table (group {part[0]}/{part[1]}). Give me a short description of each of these columns.
+You MUST respect the given output format which should be ONLY valid json, with one entry per given column named exactly as given
+**Columns meta data**
+{METADATA_LEGEND}
+{metadata}
+
+**Output format**
+{{"columns": [{{"name": "<column_name>", "description": "<description>"}}, ...]}}"""
+
+
+# Max # of chars of a column description in the prompt of a table overview
+OVERVIEW_DESCRIPTION_CHARS = 80
 
-{{
-    "columns": [
-        {{
-            "name": "EmployeeID",
-            "description: "An **INTEGER** column that serves as the **primary key** and a foreign key to the main Employee table (not shown). Its function is to uniquely identify the employee associated with each sales record, establishing the 'who' in the transaction data."
-        }},
-        {{
-            "name": "Quarterly_Revenue",
-            "description": "A **DECIMAL** column that records the financial value, or **sales amount**, generated during a specific quarter. Its purpose is to track the performance metric, representing the 'what' and 'how much' of the employee's sales contribution."
-        }}
-    ],
-    "table": "The **Employee_Sales** table functions as a **fact table** used for sales analysis. Its structure links a specific employee (via **EmployeeID**) to a quantitative performance metric (**Quarterly_Revenue**). Since EmployeeID is not unique across all rows, the table is designed to capture **time-series or periodic metrics** (like quarterly data) for each employee, making it ideal for tracking performance trends and aggregations."
-}}"""
+
+def table_overview_prompt_init(table: TableMetadata, columns: list[FieldDescription]):
+    lines = []
+    for c in columns:
+        description = " ".join(c.description.split()).replace("|", "/")
+        if len(description) > OVERVIEW_DESCRIPTION_CHARS:
+            description = description[: OVERVIEW_DESCRIPTION_CHARS - 1] + "…"
+        lines.append(f"{c.name} | {description}")
+    column_lines = "\n".join(lines)
+    return f"""
+Given the following sql table and the descriptions of its columns. Give me a short description of the table.
+You MUST respect the given output format which should be ONLY valid json
+**Table**
+Table {table.name}: {table.row_count} rows
+Columns (name | description):
+{column_lines}
+
+**Output format**
+{{"table": "<description>"}}"""
 
 
 table_desc_creation_str = """
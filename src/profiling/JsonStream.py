@@ -0,0 +1,188 @@
+from __future__ import annotations
+import json
+import re
+from typing import Callable
+
+# ------------------------------------------------------
+# Incremental json validation of a streamed llm response
+#
+# The checker reads the response chunk by chunk and fails as soon as the text
+# can't be the start of a json document anymore, or as soon as a string value
+# is rejected by on_string, so the stream can be dropped before its end:
+#
+#   checker = JsonStreamChecker(on_string)
+#   for chunk in stream:
+#       if not checker.feed(chunk):
+#           break  # checker.error tells why
+#
+# on_string(path, value) gets every complete string value with its path from
+# the root, e.g. ["columns", 3, "name"], and returns an error message or None.
+
+NUMBER_PATTERN = re.compile(r"-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?")
+LITERALS = ("true", "false", "null")
+WHITESPACE = " \t\r\n"
+
+
+class JsonStreamChecker:
+    def __init__(
+        self, on_string: Callable[[list[str | int], str], str | None] | None = None
+    ) -> None:
+        self.on_string = on_string
+        # Open objects|arrays: [is_object, current key or index]
+        self.stack: list[list] = []
+        # What comes next: value, value_or_end, key, key_or_end, colon, comma_or_end, end
+        self.expect: str = "value"
+        # Scalar being read: (kind, chars) with kind string, key, number or literal
+        self.token_kind: str | None = None
+        self.token: list[str] = []
+        self.escape: bool = False
+        self.unicode_left: int = 0
+        self.error: str | None = None
+        # # of chars read, for the error messages
+        self.position: int = 0
+
+    def feed(self, chunk: str) -> bool:
+        # False once the text read so far is no valid json prefix
+        for c in chunk:
+            if self.error is not None:
+                return False
+            self._char(c)
+            self.position += 1
+        return self.error is None
+
+    def path(self) -> list[str | int]:
+        return [frame[1] for frame in self.stack]
+
+    def _fail(self, message: str) -> None:
+        self.error = f"{message} at char {self.position}"
+
+    def _char(self, c: str) -> None:
+        if self.token_kind in ("string", "key"):
+            self._string_char(c)
+            return
+        if self.token_kind == "number":
+            if c in "0123456789+-.eE":
+                self.token.append(c)
+                return
+            self._end_number()
+            if self.error is not None:
+                return
+        elif self.token_kind == "literal":
+            if c.isalpha():
+                self.token.append(c)
+                if not any(literal.startswith("".join(self.token)) for literal in LITERALS):
+                    self._fail(f"Invalid literal {''.join(self.token)!r}")
+                return
+            if "".join(self.token) not in LITERALS:
+                self._fail(f"Invalid literal {''.join(self.token)!r}")
+                return
+            self.token_kind = None
+            self._end_value()
+
+        if c in WHITESPACE:
+            return
+
+        match self.expect:
+            case "value" | "value_or_end":
+                if c == "]" and self.expect == "value_or_end":
+                    self._close(is_object=False)
+                elif c == "{":
+                    self.stack.append([True, None])
+                    self.expect = "key_or_end"
+                elif c == "[":
+                    self.stack.append([False, 0])
+                    self.expect = "value_or_end"
+                elif c == '"':
+                    self._start("string")
+                elif c == "-" or c.isdigit():
+                    self._start("number", c)
+                elif c in "tfn":
+                    self._start("literal", c)
+                else:
+                    self._fail(f"Unexpected {c!r} instead of a value")
+            case "key" | "key_or_end":
+                if c == "}" and self.expect == "key_or_end":
+                    self._close(is_object=True)
+                elif c == '"':
+                    self._start("key")
+                else:
+                    self._fail(f"Unexpected {c!r} instead of a key")
+            case "colon":
+                if c == ":":
+                    self.expect = "value"
+                else:
+                    self._fail(f"Unexpected {c!r} instead of ':'")
+            case "comma_or_end":
+                is_object = self.stack[-1][0]
+                if c == ",":
+                    if is_object:
+                        self.expect = "key"
+                    else:
+                        self.stack[-1][1] += 1
+                        self.expect = "value"
+                elif c == ("}" if is_object else "]"):
+                    self._close(is_object)
+                else:
+                    self._fail(f"Unexpected {c!r} after a value")
+            case _:
+                self._fail(f"Unexpected {c!r} after the end of the document")
+
+    def _start(self, kind: str, c: str | None = None) -> None:
+        self.token_kind = kind
+        self.token = [] if c is None else [c]
+
+    def _string_char(self, c: str) -> None:
+        if self.unicode_left > 0:
+            if c not in "0123456789abcdefABCDEF":
+                self._fail(f"Invalid unicode escape {c!r}")
+                return
+            self.unicode_left -= 1
+        elif self.escape:
+            if c not in '"\\/bfnrtu':
+                self._fail(f"Invalid escape {c!r}")
+                return
+            self.escape = False
+            self.unicode_left = 4 if c == "u" else 0
+        elif c == "\\":
+            self.escape = True
+        elif c == '"':
+            self._end_string()
+            return
+        elif ord(c) < 0x20:
+            self._fail("Control character in a string")
+            return
+        self.token.append(c)
+
+    def _end_string(self) -> None:
+        try:
+            value = json.loads('"' + "".join(self.token) + '"')
+        except json.JSONDecodeError as err:
+            self._fail(f"Invalid string: {err}")
+            return
+        kind, self.token_kind = self.token_kind, None
+        if kind == "key":
+            self.stack[-1][1] = value
+            self.expect = "colon"
+            return
+        if self.on_string is not None:
+            error = self.on_string(self.path(), value)
+            if error is not None:
+                self._fail(error)
+                return
+        self._end_value()
+
+    def _end_number(self) -> None:
+        number = "".join(self.token)
+        self.token_kind = None
+        if NUMBER_PATTERN.fullmatch(number) is None:
+            self._fail(f"Invalid number {number!r}")
+            return
+        self._end_value()
+
+    def _close(self, is_object: bool) -> None:
+        assert self.stack[-1][0] == is_object
+        self.stack.pop()
+        self._end_value()
+
+    def _end_value(self) -> None:
+        self.expect = "end" if len(self.stack) == 0 else "comma_or_end"
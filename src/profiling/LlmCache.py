@@ -0,0 +1,108 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Type
+
+from src.lib.utils import create_dir_if_not_exists, log
+
+
+def response_schema_key(response_schema: Type) -> str:
+    # Pydantic models hash through their json schema, a renamed|added field is another key
+    if hasattr(response_schema, "model_json_schema"):
+        return json.dumps(response_schema.model_json_schema(), sort_keys=True)
+    return repr(response_schema)
+
+
+class LlmCache:
+    """
+    On disk cache of LLM responses, one json file per response.
+
+    Content addressed: the key is a hash of the model name, the prompt and the
+    response schema so any change to one of them is a miss. Entries expire
+    after `ttl_seconds` (None never expires), the least recently used ones are
+    evicted once the cache is bigger than `max_bytes`.
+
+    Shared by the threads of the llm summary.
+    """
+
+    def __init__(self, folder: str, max_bytes: int, ttl_seconds: float | None = None) -> None:
+        self.folder: str = folder
+        self.max_bytes: int = max_bytes
+        self.ttl_seconds: float | None = ttl_seconds
+        self.lock: threading.Lock = threading.Lock()
+        create_dir_if_not_exists(folder)
+        self.size: int = sum(os.path.getsize(f) for f in self._files())
+
+    @staticmethod
+    def key(model_name: str, prompt: str, response_schema: Type) -> str:
+        content = json.dumps([model_name, prompt, response_schema_key(response_schema)])
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def _filepath(self, key: str) -> str:
+        return f"{self.folder}/{key}.json"
+
+    def _files(self) -> list[str]:
+        return [
+            f"{self.folder}/{f}" for f in os.listdir(self.folder) if f.endswith(".json")
+        ]
+
+    def _remove(self, filepath: str) -> None:
+        try:
+            size = os.path.getsize(filepath)
+            os.remove(filepath)
+            self.size -= size
+        except FileNotFoundError:
+            pass
+
+    def get(self, key: str) -> str | None:
+        filepath = self._filepath(key)
+        with self.lock:
+            try:
+                with open(filepath, "r") as f:
+                    entry = json.load(f)
+            except FileNotFoundError:
+                return None
+            except (json.JSONDecodeError, UnicodeDecodeError) as err:
+                log(f"[WARN] Ignoring corrupted llm cache entry {key}: {err}")
+                self._remove(filepath)
+                return None
+
+            # Valid json missing a field (written by hand, older format...) is a miss too
+            created = entry.get("created") if isinstance(entry, dict) else None
+            response = entry.get("response") if isinstance(entry, dict) else None
+            if not isinstance(created, (int, float)) or not isinstance(response, str):
+                log(f"[WARN] Ignoring incomplete llm cache entry {key}")
+                self._remove(filepath)
+                return None
+
+            if self.ttl_seconds is not None and time.time() - created > self.ttl_seconds:
+                self._remove(filepath)
+                return None
+
+            # The access time drives the eviction, not every filesystem updates atime
+            os.utime(filepath)
+            return response
+
+    def put(self, key: str, model_name: str, response: str) -> None:
+        filepath = self._filepath(key)
+        content = json.dumps({"model": model_name, "created": time.time(), "response": response})
+        with self.lock:
+            self._remove(filepath)
+            # Written aside then renamed, a crash never leaves half an entry
+            with open(filepath + ".tmp", "w") as f:
+                f.write(content)
+            os.replace(filepath + ".tmp", filepath)
+            self.size += os.path.getsize(filepath)
+            self._evict()
+
+    def _evict(self) -> None:
+        if self.size <= self.max_bytes:
+            return
+        # Least recently used first
+        for filepath in sorted(self._files(), key=os.path.getmtime):
+            if self.size <= self.max_bytes:
+                break
+            self._remove(filepath)
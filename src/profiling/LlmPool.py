@@ -0,0 +1,229 @@
+from __future__ import annotations
+import asyncio
+import time
+from typing import Callable, Type
+
+from src.lib.Errors import AiApiError
+from src.lib.RateLimiter import RateLimiter
+from src.lib.utils import backoff_delay, log
+from src.profiling.GenAi import GenAiApi, set_answering_model
+from src.profiling.JsonStream import JsonStreamChecker
+from src.profiling.LlmUsage import LlmUsage
+
+# Errors of the member rather than of the request, the request goes to another member
+FAILOVER_CODES = (418, 429, 500, 503)
+# The key|model of the member is rejected, it gets no more requests
+DISABLING_CODES = (401, 403, 404)
+
+
+class PoolMember:
+    """A provider of the pool and its health"""
+
+    def __init__(self, llm: GenAiApi, label: str) -> None:
+        self.llm: GenAiApi = llm
+        # Model name and position, several members can share a model
+        self.label: str = label
+        self.in_flight: int = 0
+        self.calls: int = 0
+        self.errors: int = 0
+        # Failures since the last success, the longer the cooldown
+        self.failures: int = 0
+        self.cooldown_until: float = 0.0
+        self.disabled: bool = False
+
+
+class LlmPool(GenAiApi):
+    """
+    Spreads the requests over several providers, e.g. a Gemini per api key and
+    model (see gemini_pool), so the throughput grows with the quotas.
+
+    Every member has its own rate limiter, a copy of the one set on the pool:
+    the limits are per key. A request goes to the healthy member with the least
+    requests in flight. A member failing with one of FAILOVER_CODES cools down
+    for an exponential backoff while the request is sent right away to another
+    member, one with DISABLING_CODES is left out for the run. The request fails
+    once every member was tried.
+
+    The members record their calls under their own model name. A response is
+    cached under the model that answered it, a prompt cached for any model of
+    the pool is answered from the cache. The prompts are the pool's.
+    """
+
+    def __init__(
+        self,
+        members: list[GenAiApi],
+        cooldown_seconds: float = 5.0,
+        max_cooldown_seconds: float = 120.0,
+    ) -> None:
+        assert len(members) > 0, "A pool needs at least one provider"
+        self.members: list[PoolMember] = [
+            PoolMember(llm, f"{llm.get_model_name()}#{i + 1}") for i, llm in enumerate(members)
+        ]
+        self.cooldown_seconds: float = cooldown_seconds
+        self.max_cooldown_seconds: float = max_cooldown_seconds
+        self._usage: LlmUsage | None = None
+        self._rate_limiter: RateLimiter | None = None
+
+    # ---- Shared with the members
+
+    @property
+    def usage(self) -> LlmUsage | None:
+        return self._usage
+
+    @usage.setter
+    def usage(self, usage: LlmUsage | None) -> None:
+        self._usage = usage
+        for member in self.members:
+            member.llm.usage = usage
+
+    @property
+    def rate_limiter(self) -> RateLimiter | None:
+        return self._rate_limiter
+
+    @rate_limiter.setter
+    def rate_limiter(self, rate_limiter: RateLimiter | None) -> None:
+        self._rate_limiter = rate_limiter
+        for member in self.members:
+            member.llm.rate_limiter = None if rate_limiter is None else rate_limiter.copy()
+
+    def get_model_name(self) -> str:
+        return f"pool[{','.join(self.cache_model_names())}]"
+
+    def cache_model_names(self) -> list[str]:
+        # Models of the members, once each
+        return list(dict.fromkeys(m.llm.get_model_name() for m in self.members))
+
+    def provider_count(self) -> int:
+        return len(self.members)
+
+    def retry_strategy(self, status_code: int, count: int) -> bool:
+        return any(m.llm.retry_strategy(status_code, count) for m in self.members)
+
+    def price_per_million_tokens(self) -> tuple[float, float]:
+        # Prices of the members weighted by the tokens of their recorded calls
+        prices = {m.llm.get_model_name(): m.llm.price_per_million_tokens() for m in self.members}
+        calls = self.usage.calls if self.usage is not None else []
+        prompt_tokens = sum(c.prompt_tokens for c in calls)
+        output_tokens = sum(c.output_tokens for c in calls)
+        if prompt_tokens + output_tokens == 0:
+            return (
+                sum(p[0] for p in prices.values()) / len(prices),
+                sum(p[1] for p in prices.values()) / len(prices),
+            )
+        input_cost = sum(c.prompt_tokens * prices.get(c.model, (0.0, 0.0))[0] for c in calls)
+        output_cost = sum(c.output_tokens * prices.get(c.model, (0.0, 0.0))[1] for c in calls)
+        return (
+            input_cost / prompt_tokens if prompt_tokens > 0 else 0.0,
+            output_cost / output_tokens if output_tokens > 0 else 0.0,
+        )
+
+    def health(self) -> list[dict]:
+        return [
+            {
+                "member": m.label,
+                "calls": m.calls,
+                "errors": m.errors,
+                "disabled": m.disabled,
+                "cooling_down": m.cooldown_until > time.monotonic(),
+            }
+            for m in self.members
+        ]
+
+    # ---- Choice of the member
+
+    def _pick(self, tried: set[int]) -> int | None:
+        # Healthy member with the least requests in flight, the one recovering first
+        # when all cool down, None once every member was tried|disabled
+        candidates = [
+            i for i, m in enumerate(self.members) if i not in tried and not m.disabled
+        ]
+        if len(candidates) == 0:
+            return None
+        now = time.monotonic()
+        healthy = [i for i in candidates if self.members[i].cooldown_until <= now]
+        if len(healthy) == 0:
+            return min(candidates, key=lambda i: self.members[i].cooldown_until)
+        return min(healthy, key=lambda i: (self.members[i].in_flight, self.members[i].calls))
+
+    def _report(self, i: int, response: str | AiApiError | None) -> bool:
+        # Updates the health of the member, True when the request should go to another one
+        member = self.members[i]
+        member.calls += 1
+        code = response.code if isinstance(response, AiApiError) else -1 if response is None else None
+        if code is None:
+            member.failures = 0
+            return False
+        member.errors += 1
+        if code in DISABLING_CODES:
+            member.disabled = True
+            log(f"[ERR] {member.label} left out of the pool after error {code}")
+            return True
+        if code in FAILOVER_CODES or code == -1:
+            member.failures += 1
+            cooldown = backoff_delay(member.failures, self.cooldown_seconds, self.max_cooldown_seconds)
+            member.cooldown_until = time.monotonic() + cooldown
+            log(f"[WARN] {member.label} cooling down {cooldown:.1f}s after error {code}")
+            return True
+        return False
+
+    def _no_member_error(self) -> AiApiError:
+        return AiApiError(
+            code=503, message=repr("No provider available in the pool"), details=repr(self.health())
+        )
+
+    # ---- Requests
+
+    def _generate_text(self, prompt: str) -> str | None:
+        i = self._pick(set())
+        return None if i is None else self.members[i].llm._generate_text(prompt)
+
+    def _generate_json(self, prompt: str, response_schema: Type) -> str | AiApiError:
+        tried: set[int] = set()
+        response: str | AiApiError = self._no_member_error()
+        while (i := self._pick(tried)) is not None:
+            tried.add(i)
+            member = self.members[i]
+            member.in_flight += 1
+            result = None
+            try:
+                result = response = member.llm._generate_json(prompt, response_schema)
+            finally:
+                member.in_flight -= 1
+                failover = self._report(i, result)
+            if not failover:
+                set_answering_model(member.llm.get_model_name())
+                break
+        return response
+
+    async def _acall(
+        self,
+        prompt: str,
+        response_schema: Type,
+        tables: list[str] | None,
+        checker: Callable[[], JsonStreamChecker] | None,
+    ) -> tuple[str | AiApiError, str | None]:
+        # The member waits on its own rate limiter and records the call
+        tried: set[int] = set()
+        result: tuple[str | AiApiError, str | None] = (self._no_member_error(), None)
+        while (i := self._pick(tried)) is not None:
+            member = self.members[i]
+            wait = member.cooldown_until - time.monotonic()
+            if wait > 0:
+                # Every member cools down: the scheduler backs off a failed request,
+                # a new one waits for the first member to recover
+                if len(tried) > 0:
+                    break
+                await asyncio.sleep(wait)
+            tried.add(i)
+            member.in_flight += 1
+            response = None
+            try:
+                result = await member.llm._acall(prompt, response_schema, tables, checker)
+                response = result[0]
+            finally:
+                member.in_flight -= 1
+                failover = self._report(i, response)
+            if not failover:
+                set_answering_model(member.llm.get_model_name())
+                break
+        return result
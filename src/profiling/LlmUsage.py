@@ -0,0 +1,89 @@
+from __future__ import annotations
+import threading
+
+from pydantic import BaseModel
+
+
+class LlmCall(BaseModel):
+    """Tokens and latency of one request sent to the model"""
+
+    model: str
+    # Tables described by the request, several for a batch
+    tables: list[str]
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    total_tokens: int = 0
+    latency_seconds: float = 0.0
+    error_code: int | None = None
+    # Streamed response dropped once off-format, see GenAiApi.stream
+    aborted: bool = False
+    # The provider didn't report its usage, the tokens are counted from the texts
+    estimated: bool = False
+
+
+class LlmUsage:
+    """
+    Calls of the llm summary of one database, shared by the concurrent requests.
+
+    A table asked several times (api errors, batches split...) has one call per
+    request, every call after the first one is a retry. The tokens of a batched
+    request are split evenly between its tables.
+    """
+
+    def __init__(self) -> None:
+        self.calls: list[LlmCall] = []
+        self.lock: threading.Lock = threading.Lock()
+
+    def record(self, call: LlmCall) -> None:
+        with self.lock:
+            self.calls.append(call)
+
+    def summary(
+        self, wall_seconds: float, price_per_million_tokens: tuple[float, float]
+    ) -> dict:
+        # price_per_million_tokens: ($ per 1M prompt tokens, $ per 1M output tokens)
+        input_price, output_price = price_per_million_tokens
+
+        def cost(prompt_tokens: float, output_tokens: float) -> float:
+            return (prompt_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+        tables: dict[str, dict] = {}
+        for call in self.calls:
+            share = 1 / max(len(call.tables), 1)
+            for tablename in call.tables:
+                table = tables.setdefault(
+                    tablename,
+                    {"calls": 0, "retries": 0, "failed_calls": 0, "prompt_tokens": 0.0,
+                     "output_tokens": 0.0, "latency_seconds": 0.0},
+                )
+                table["retries"] += table["calls"] > 0
+                table["calls"] += 1
+                table["failed_calls"] += call.error_code is not None
+                table["prompt_tokens"] += call.prompt_tokens * share
+                table["output_tokens"] += call.output_tokens * share
+                table["latency_seconds"] += call.latency_seconds
+        for table in tables.values():
+            table["cost_usd"] = cost(table["prompt_tokens"], table["output_tokens"])
+
+        prompt_tokens = sum(c.prompt_tokens for c in self.calls)
+        output_tokens = sum(c.output_tokens for c in self.calls)
+        total_tokens = sum(c.total_tokens for c in self.calls)
+        latencies = sorted(c.latency_seconds for c in self.calls)
+        return {
+            "models": sorted({c.model for c in self.calls}),
+            "calls": len(self.calls),
+            "failed_calls": sum(c.error_code is not None for c in self.calls),
+            "retries": sum(t["retries"] for t in tables.values()),
+            "aborted_calls": sum(c.aborted for c in self.calls),
+            "estimated_calls": sum(c.estimated for c in self.calls),
+            "prompt_tokens": prompt_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": total_tokens,
+            "wall_seconds": wall_seconds,
+            "tokens_per_second": total_tokens / wall_seconds if wall_seconds > 0 else None,
+            "mean_latency_seconds": sum(latencies) / len(latencies) if len(latencies) > 0 else None,
+            "max_latency_seconds": latencies[-1] if len(latencies) > 0 else None,
+            "price_per_million_tokens": {"prompt": input_price, "output": output_price},
+            "cost_usd": cost(prompt_tokens, output_tokens),
+            "tables": tables,
+        }
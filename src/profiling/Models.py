@@ -20,11 +20,65 @@ class DatabaseMetadata(BaseModel):
                 return table
         return None
 
+    def relationship_graph(self) -> dict[str, list[Relationship]]:
+        # {tablename: relationships from or to the table}, joins go both ways
+        graph: dict[str, list[Relationship]] = {t.name: [] for t in self.tables}
+        for table in self.tables:
+            for relationship in table.foreign_keys:
+                graph[relationship.table].append(relationship)
+                if relationship.ref_table != relationship.table:
+                    graph.setdefault(relationship.ref_table, []).append(relationship)
+        return graph
+
+    def join_path(self, from_table: str, to_table: str) -> list[Relationship] | None:
+        # Shortest list of joins between the two tables (breadth first search)
+        graph = self.relationship_graph()
+        previous: dict[str, tuple[str, Relationship] | None] = {from_table: None}
+        queue = [from_table]
+        while len(queue) > 0 and to_table not in previous:
+            tablename = queue.pop(0)
+            for relationship in graph.get(tablename, []):
+                other = (
+                    relationship.ref_table
+                    if relationship.table == tablename
+                    else relationship.table
+                )
+                if other not in previous:
+                    previous[other] = (tablename, relationship)
+                    queue.append(other)
+
+        if to_table not in previous:
+            return None
+        path = []
+        step = previous[to_table]
+        while step is not None:
+            tablename, relationship = step
+            path.append(relationship)
+            step = previous[tablename]
+        return path[::-1]
+
+
+class Relationship(BaseModel):
+    """table.columns references ref_table.ref_columns"""
+
+    table: str
+    columns: list[str]
+    ref_table: str
+    ref_columns: list[str]
+    # Declared foreign key or inferred from the overlap of the values
+    declared: bool
+    # Estimated share of the values found in the referenced columns, None when declared
+    containment: float | None = None
+
 
 class TableMetadata(BaseModel):
     name: str
     columns: list[ColumnMetadata]
     row_count: int
+    # # of column stats read from an index instead of scanning|sorting the table
+    scans_avoided: int = 0
+    # Declared and inferred foreign keys of the table
+    foreign_keys: list[Relationship] = Field(default_factory=list)
 
     def find_column_by_name(self, name: str) -> ColumnMetadata | None:
         for col in self.columns:
@@ -52,10 +106,52 @@ class ColumnMetadata(BaseModel):
     null_count: int
     non_null_count: int
     distinct_count: int
-    min_value: int | None
-    max_value: int | None
+    # In sqlite order: numbers < text < blobs
+    min_value: Any
+    max_value: Any
     length: LengthMetaData
     samples: list[Any]
+    # From the table indexes: leads an index | has a single column unique index | is part of an index
+    is_indexed: bool = False
+    is_unique: bool = False
+    is_covered: bool = False
+    # {sqlite storage class: # of values}, several classes for mixed columns
+    storage_classes: dict[str, int] = Field(default_factory=dict)
+    # Over the integer and real values only, None without any
+    numeric: NumericStats | None = None
+    # Most frequent values, most frequent first
+    top_values: list[FrequentValue] = Field(default_factory=list)
+    # Equi-depth buckets of the non null values in sqlite order
+    histogram: list[HistogramBucket] = Field(default_factory=list)
+    # Estimated fields (--approx, sketches of big tables): {field: 95% error bound or None}
+    # e.g. {"distinct_count": 120.5, "length.max": None, "top_values": 12}
+    estimates: dict[str, float | None] = Field(default_factory=dict)
+    # MinHash signature of the values of key like columns, used to infer foreign keys.
+    # Not exported, it means nothing to a reader
+    minhash: list[int] | None = Field(default=None, exclude=True)
+
+
+class NumericStats(BaseModel):
+    count: int
+    mean: float
+    stddev: float | None
+    min: float
+    max: float
+    zero_count: int
+    negative_count: int
+    # {"p5": v, "p25": v, "p50": v, "p75": v, "p95": v}
+    quantiles: dict[str, float]
+
+
+class FrequentValue(BaseModel):
+    value: Any
+    count: int
+
+
+class HistogramBucket(BaseModel):
+    lower: Any
+    upper: Any
+    count: int
 
 
 class LengthMetaData(BaseModel):
@@ -101,6 +197,32 @@ class TableDescription(BaseModel):
         )
 
 
+class NamedTableDescription(TableDescription):
+    """A structured description of an SQL table named in a batch"""
+
+    name: str = Field(description="Name of the SQL table, exactly as given")
+
+
+class TablesDescription(BaseModel):
+    """Structured descriptions of several SQL tables, one entry per table"""
+
+    tables: list[NamedTableDescription] = Field(description="One description per table")
+
+
+class ColumnsDescription(BaseModel):
+    """Structured descriptions of a group of columns of a wide SQL table"""
+
+    columns: list[FieldDescription] = Field(
+        description="A list of the given fields decription"
+    )
+
+
+class TableSummary(BaseModel):
+    """A structured description of an SQL table from the descriptions of its fields"""
+
+    table: str = Field(description="SQL table description")
+
+
 class ModelOutput(BaseModel, Generic[T]):
     success: bool
     error: str | None
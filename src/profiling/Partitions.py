@@ -0,0 +1,134 @@
+from __future__ import annotations
+import hashlib
+import json
+import math
+import os
+import pickle
+import shutil
+from typing import Any
+
+from src.lib.DbConnector import DbConnector
+from src.lib.utils import create_dir_if_not_exists, log
+from src.profiling.Sketches import ColumnSketches, RowReservoir, extremum
+
+# ------------------------------------------------------
+# Partitioned profiling
+#
+# A big table is split in rowid ranges profiled independently, every stat of a
+# partition can be merged with the others: counts and length sums add up,
+# min/max compare, sketches merge. Distinct counts don't, they come from an
+# index or the merged HyperLogLog.
+
+
+def table_partitions(
+    db: DbConnector, tablename: str, partition_rows: int
+) -> list[tuple[int, int]]:
+    # (first, last) rowid of each range, no range when the table is small enough
+    if partition_rows <= 0:
+        return []
+    if db.table_size_estimate(tablename) <= partition_rows:
+        return []
+    rowids = db.rowid_range(tablename)
+    if rowids is None:
+        return []
+
+    first, last = rowids
+    count = math.ceil((last - first + 1) / partition_rows)
+    width = math.ceil((last - first + 1) / count)
+    return [(lo, min(lo + width - 1, last)) for lo in range(first, last + 1, width)]
+
+
+class PartialProfile:
+    """Mergeable stats of a rowid range of a table"""
+
+    def __init__(
+        self,
+        row_count: int,
+        stats: dict[str, dict[str, Any]],
+        sketches: list[ColumnSketches],
+        reservoir: RowReservoir,
+    ) -> None:
+        self.row_count: int = row_count
+        # Same as DbConnector.fused_column_stats without the distinct counts,
+        # empty for approx profiles which read everything from the sketches
+        self.stats: dict[str, dict[str, Any]] = stats
+        self.sketches: list[ColumnSketches] = sketches
+        self.reservoir: RowReservoir = reservoir
+
+    def merge(self, other: PartialProfile) -> None:
+        for column_name, stats in self.stats.items():
+            o = other.stats[column_name]
+            length_sum = _length_sum(stats) + _length_sum(o)
+
+            stats["null_count"] += o["null_count"]
+            stats["non_null_count"] += o["non_null_count"]
+            stats["min_value"] = extremum(min, stats["min_value"], o["min_value"])
+            stats["max_value"] = extremum(max, stats["max_value"], o["max_value"])
+            stats["min_length"] = extremum(min, stats["min_length"], o["min_length"])
+            stats["max_length"] = extremum(max, stats["max_length"], o["max_length"])
+            # An average isn't mergeable, it's weighted back into a sum
+            stats["avg_length"] = (
+                length_sum / stats["non_null_count"] if stats["non_null_count"] > 0 else None
+            )
+
+        for sketches, other_sketches in zip(self.sketches, other.sketches):
+            sketches.merge(other_sketches)
+        self.reservoir.merge(other.reservoir)
+        self.row_count += other.row_count
+
+
+def _length_sum(stats: dict[str, Any]) -> float:
+    if stats["avg_length"] is None:
+        return 0.0
+    return stats["avg_length"] * stats["non_null_count"]
+
+
+class PartitionCheckpoints:
+    """
+    Finished partitions of the tables being profiled, one pickle file each.
+
+    Pickled as the sketches hold numpy arrays and values of any storage class.
+    Checkpoints are only valid for the database, data version and profiling
+    options (partition size included) they were computed with.
+    """
+
+    def __init__(
+        self, folder: str, conn_string: str, data_version: str, options: dict[str, Any]
+    ) -> None:
+        self.folder: str = folder
+        key = {
+            "db": os.path.abspath(conn_string),
+            "data_version": data_version,
+            "options": options,
+        }
+        self.key: str = hashlib.sha256(
+            json.dumps(key, sort_keys=True, default=str).encode()
+        ).hexdigest()[:16]
+
+    def _table_folder(self, tablename: str) -> str:
+        return f"{self.folder}/{tablename}"
+
+    def _filepath(self, tablename: str, partition: tuple[int, int]) -> str:
+        lo, hi = partition
+        return f"{self._table_folder(tablename)}/{self.key}_{lo}_{hi}.pkl"
+
+    def get(self, tablename: str, partition: tuple[int, int]) -> PartialProfile | None:
+        try:
+            with open(self._filepath(tablename, partition), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError) as err:
+            log(f"[WARN] Ignoring corrupted checkpoint of {tablename} {partition}: {err}")
+            return None
+
+    def put(self, tablename: str, partition: tuple[int, int], partial: PartialProfile) -> None:
+        create_dir_if_not_exists(self._table_folder(tablename))
+        filepath = self._filepath(tablename, partition)
+        # Written aside then renamed, a crash never leaves half a checkpoint
+        with open(filepath + ".tmp", "wb") as f:
+            pickle.dump(partial, f)
+        os.replace(filepath + ".tmp", filepath)
+
+    def clear(self, tablename: str) -> None:
+        shutil.rmtree(self._table_folder(tablename), ignore_errors=True)
@@ -0,0 +1,79 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+from typing import Any
+
+from pydantic import BaseModel, Field, ValidationError
+
+from src.lib.DbConnector import DbConnector
+from src.lib.utils import create_dir_if_not_exists, log, write_json
+from src.profiling.Models import TableMetadata
+
+
+class CachedTableProfile(BaseModel):
+    fingerprint: str
+    metadata: TableMetadata
+    # ColumnMetadata.minhash isn't part of the metadata dump
+    signatures: dict[str, list[int]] = Field(default_factory=dict)
+
+
+class ProfileCache:
+    """
+    On disk cache of table profiles, one json file per table.
+
+    A profile is reused while the fingerprint of its table is unchanged:
+    schema (PRAGMA table_info), row count, database data version and the
+    profiling options.
+    """
+
+    def __init__(self, folder: str) -> None:
+        self.folder: str = folder
+        create_dir_if_not_exists(folder)
+
+    def _filepath(self, tablename: str) -> str:
+        return f"{self.folder}/{tablename}.json"
+
+    @staticmethod
+    def table_fingerprint(
+        db: DbConnector, tablename: str, data_version: str, options: dict[str, Any]
+    ) -> str:
+        key = {
+            "db": os.path.abspath(db.conn_string),
+            "data_version": data_version,
+            "table": tablename,
+            "columns": db.table_columns(tablename),
+            "row_count": db.table_row_count(tablename),
+            "options": options,
+        }
+        return hashlib.sha256(
+            json.dumps(key, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def get(self, tablename: str, fingerprint: str) -> TableMetadata | None:
+        try:
+            with open(self._filepath(tablename), "r") as json_file:
+                cached = CachedTableProfile.model_validate_json(json_file.read())
+        except FileNotFoundError:
+            return None
+        except ValidationError as err:
+            log(f"[WARN] Ignoring corrupted profile cache for {tablename}: {err}")
+            return None
+
+        if cached.fingerprint != fingerprint:
+            return None
+        for column in cached.metadata.columns:
+            column.minhash = cached.signatures.get(column.name)
+        return cached.metadata
+
+    def put(self, tablename: str, fingerprint: str, metadata: TableMetadata) -> bool:
+        return write_json(
+            self._filepath(tablename),
+            CachedTableProfile(
+                fingerprint=fingerprint,
+                metadata=metadata,
+                signatures={
+                    c.name: c.minhash for c in metadata.columns if c.minhash is not None
+                },
+            ).model_dump(),
+        )
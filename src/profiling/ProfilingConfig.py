@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 from src.lib.Config import Config, OutputFormat
+from src.lib.DbConnector import DbBackend
+from src.profiling.GenAi import LlmProvider
 import argparse
 
 
@@ -9,6 +11,23 @@ class ProfilingConfig(Config):
     DO_EXTRACTION: bool
     DO_LLM_SUMMARY: bool
     SAVE_METADATA: bool
+    DB_BACKEND: DbBackend
+    WORKERS: int
+    APPROX: bool
+    USE_CACHE: bool
+    PARTITION_ROWS: int
+    USE_LLM_CACHE: bool
+    LLM_CACHE_TTL_DAYS: int
+    LLM_CACHE_MAX_MB: int
+    PROMPT_TOKEN_BUDGET: int
+    BATCH_TABLES: int
+    BATCH_TOKEN_BUDGET: int
+    LLM_CONCURRENCY: int
+    MAX_TPM: int
+    LLM_PROVIDER: LlmProvider
+    LLM_FAILURE_RATE: float
+    LLM_STREAM: bool
+    COLUMN_CHUNK_SIZE: int
 
     @classmethod
     def init(cls, config: ProfilingConfig):
@@ -17,6 +36,23 @@ class ProfilingConfig(Config):
         cls.DO_EXTRACTION = config.DO_EXTRACTION
         cls.DO_LLM_SUMMARY = config.DO_LLM_SUMMARY
         cls.SAVE_METADATA = config.SAVE_METADATA
+        cls.DB_BACKEND = config.DB_BACKEND
+        cls.WORKERS = config.WORKERS
+        cls.APPROX = config.APPROX
+        cls.USE_CACHE = config.USE_CACHE
+        cls.PARTITION_ROWS = config.PARTITION_ROWS
+        cls.USE_LLM_CACHE = config.USE_LLM_CACHE
+        cls.LLM_CACHE_TTL_DAYS = config.LLM_CACHE_TTL_DAYS
+        cls.LLM_CACHE_MAX_MB = config.LLM_CACHE_MAX_MB
+        cls.PROMPT_TOKEN_BUDGET = config.PROMPT_TOKEN_BUDGET
+        cls.BATCH_TABLES = config.BATCH_TABLES
+        cls.BATCH_TOKEN_BUDGET = config.BATCH_TOKEN_BUDGET
+        cls.LLM_CONCURRENCY = config.LLM_CONCURRENCY
+        cls.MAX_TPM = config.MAX_TPM
+        cls.LLM_PROVIDER = config.LLM_PROVIDER
+        cls.LLM_FAILURE_RATE = config.LLM_FAILURE_RATE
+        cls.LLM_STREAM = config.LLM_STREAM
+        cls.COLUMN_CHUNK_SIZE = config.COLUMN_CHUNK_SIZE
 
     @staticmethod
     def create_from_parser() -> ProfilingConfig:
@@ -26,7 +62,18 @@ class ProfilingConfig(Config):
 
         # ----------------------------------------------
         # Tweak input
-        parser.add_argument("db_conn_string", type=str, help="Path to the sqlite db file")
+        parser.add_argument(
+            "db_conn_string",
+            type=str,
+            help="Path to the sqlite db file, or a directory|glob of db files profiled into one catalog",
+        )
+        parser.add_argument(
+            "-b",
+            "--backend",
+            type=ProfilingConfig.arg_backend_validate,
+            default="sqlite",
+            help="Engine running the profiling queries sqlite(default), duckdb (requires the duckdb package)",
+        )
 
         # ----------------------------------------------
         # Tweak execution
@@ -42,6 +89,63 @@ class ProfilingConfig(Config):
             help="Maximum # of requests per minute sent to the LLM api (to disable rate limit set to -1)",
         )
 
+        parser.add_argument(
+            "--max-tpm",
+            type=Config.arg_max_rpm_validate,
+            default=-1,
+            help="Maximum # of tokens per minute sent to|received from the LLM api (default=-1, no limit)",
+        )
+
+        parser.add_argument(
+            "-w",
+            "--workers",
+            type=ProfilingConfig.arg_positive_int_validate,
+            default=1,
+            help="# of processes profiling tables in parallel (default=1)",
+        )
+
+        parser.add_argument(
+            "--approx",
+            action="store_true",
+            default=False,
+            help="Estimate distinct counts, nulls and lengths in one streaming pass (for huge tables)",
+        )
+
+        parser.add_argument(
+            "--partition-rows",
+            type=ProfilingConfig.arg_non_negative_int_validate,
+            default=1_000_000,
+            help="Tables bigger than this are profiled by rowid ranges of this many rows, in parallel and resumable (default=1000000, 0 to disable)",
+        )
+
+        parser.add_argument(
+            "--llm-concurrency",
+            type=ProfilingConfig.arg_positive_int_validate,
+            default=8,
+            help="Max # of llm requests awaiting their response at once, per provider of a pool (default=8)",
+        )
+
+        parser.add_argument(
+            "--llm",
+            type=ProfilingConfig.arg_llm_provider_validate,
+            default="gemini",
+            help="Model provider gemini(default), gemini-pool (every key|model of the .env GEMINI_API_KEYS|GEMINI_MODELS), fake (offline, to tune the concurrency|retries)",
+        )
+
+        parser.add_argument(
+            "--llm-stream",
+            action="store_true",
+            default=False,
+            help="Validate the llm responses as they are generated, an off-format one is dropped and asked again right away",
+        )
+
+        parser.add_argument(
+            "--llm-failure-rate",
+            type=ProfilingConfig.arg_rate_validate,
+            default=0.0,
+            help="[DEV] Share of the llm calls failing on purpose, to test the retries (default=0)",
+        )
+
         parser.add_argument(
             "-y",
             "--yes",
@@ -89,6 +193,62 @@ class ProfilingConfig(Config):
             help="[DEV] Skip the llm querying",
         )
 
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            default=False,
+            help="Profile every table again instead of reusing the profiles of unchanged tables",
+        )
+
+        parser.add_argument(
+            "--no-llm-cache",
+            action="store_true",
+            default=False,
+            help="Ask the llm again instead of reusing the responses to identical prompts",
+        )
+
+        parser.add_argument(
+            "--llm-cache-ttl-days",
+            type=ProfilingConfig.arg_non_negative_int_validate,
+            default=30,
+            help="Cached llm responses older than this are asked again (default=30, 0 never expires)",
+        )
+
+        parser.add_argument(
+            "--llm-cache-max-mb",
+            type=ProfilingConfig.arg_non_negative_int_validate,
+            default=256,
+            help="Least recently used llm responses are evicted past this size (default=256)",
+        )
+
+        parser.add_argument(
+            "--prompt-token-budget",
+            type=ProfilingConfig.arg_non_negative_int_validate,
+            default=2000,
+            help="Max # of tokens of the table metadata in a prompt, less samples|stats are sent past it (default=2000, 0 for no limit)",
+        )
+
+        parser.add_argument(
+            "--batch-tables",
+            type=ProfilingConfig.arg_positive_int_validate,
+            default=1,
+            help="Max # of tables summarized by one llm request (default=1, one request per table)",
+        )
+
+        parser.add_argument(
+            "--batch-token-budget",
+            type=ProfilingConfig.arg_positive_int_validate,
+            default=8000,
+            help="Max # of tokens of the tables metadata in a batched request (default=8000)",
+        )
+
+        parser.add_argument(
+            "--column-chunk-size",
+            type=ProfilingConfig.arg_non_negative_int_validate,
+            default=100,
+            help="Tables with more columns are summarized by groups of this many columns requested concurrently, then a request for the table description (default=100, 0 to disable)",
+        )
+
         parser.add_argument("--dry-run", action="store_true", default=False)
 
         args = parser.parse_args()
@@ -103,7 +263,24 @@ class ProfilingConfig(Config):
             DO_LLM_SUMMARY=not args.no_llm,
             DRY_RUN=args.dry_run,
             SAVE_METADATA=args.save_metadata,
-            SKIP_INTERACTIONS=args.yes
+            SKIP_INTERACTIONS=args.yes,
+            DB_BACKEND=args.backend,
+            WORKERS=args.workers,
+            APPROX=args.approx,
+            USE_CACHE=not args.no_cache,
+            PARTITION_ROWS=args.partition_rows,
+            USE_LLM_CACHE=not args.no_llm_cache,
+            LLM_CACHE_TTL_DAYS=args.llm_cache_ttl_days,
+            LLM_CACHE_MAX_MB=args.llm_cache_max_mb,
+            PROMPT_TOKEN_BUDGET=args.prompt_token_budget,
+            BATCH_TABLES=args.batch_tables,
+            BATCH_TOKEN_BUDGET=args.batch_token_budget,
+            LLM_CONCURRENCY=args.llm_concurrency,
+            MAX_TPM=args.max_tpm,
+            LLM_PROVIDER=args.llm,
+            LLM_FAILURE_RATE=args.llm_failure_rate,
+            LLM_STREAM=args.llm_stream,
+            COLUMN_CHUNK_SIZE=args.column_chunk_size,
         )
     
     @staticmethod
@@ -116,4 +293,52 @@ class ProfilingConfig(Config):
             case _:
                 raise argparse.ArgumentTypeError(
                     "Supported output types are 'sqlite' and 'json'"
-                )
\ No newline at end of file
+                )
+
+    @staticmethod
+    def arg_backend_validate(v) -> DbBackend:
+        try:
+            return DbBackend(v)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                "Supported backends are 'sqlite' and 'duckdb'"
+            )
+
+    @staticmethod
+    def arg_llm_provider_validate(v) -> LlmProvider:
+        try:
+            return LlmProvider(v)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                "Supported llm providers are 'gemini', 'gemini-pool' and 'fake'"
+            )
+
+    @staticmethod
+    def arg_rate_validate(v) -> float:
+        try:
+            v = float(v)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"'{v}' is not a valid number")
+        if not 0 <= v <= 1:
+            raise argparse.ArgumentTypeError(f"'{v}' must be in [0, 1]")
+        return v
+
+    @staticmethod
+    def arg_non_negative_int_validate(v) -> int:
+        try:
+            v = int(v)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"'{v}' is not a valid integer")
+        if v < 0:
+            raise argparse.ArgumentTypeError(f"'{v}' must be >= 0")
+        return v
+
+    @staticmethod
+    def arg_positive_int_validate(v) -> int:
+        try:
+            v = int(v)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"'{v}' is not a valid integer")
+        if v < 1:
+            raise argparse.ArgumentTypeError(f"'{v}' must be >= 1")
+        return v
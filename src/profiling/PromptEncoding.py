@@ -0,0 +1,178 @@
+from __future__ import annotations
+import re
+from typing import Any
+
+from src.profiling.Models import ColumnMetadata, TableMetadata
+
+# ------------------------------------------------------
+# Compact table metadata for the prompts
+#
+# The json dump of a profile repeats every key name for every column and holds
+# stats only a machine reads (histograms, sketches...). The model gets one line
+# per column instead, the columns of a text table:
+#
+#   TrackId | INTEGER | pk unique not null | 0 | 3503 | 1 .. 3503 | 1, 6, 7
+#
+# Under a token budget the values get fewer and shorter, then the stats go,
+# the column names and types always stay.
+
+# Rough BPE-like count: short words are a token, longer ones a token per 4 chars,
+# every punctuation sign a token. Close enough to budget prompts without a tokenizer
+TOKEN_PATTERN = re.compile(r"\w{1,4}|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    return len(TOKEN_PATTERN.findall(text))
+
+
+# (# of values per column, max chars per value, with stats) from the most to the least detailed
+ENCODING_LEVELS: list[tuple[int, int, bool]] = [
+    (5, 40, True),
+    (3, 24, True),
+    (1, 16, True),
+    (0, 0, True),
+    (0, 0, False),
+]
+
+
+def _value(v: Any, max_chars: int) -> str:
+    if isinstance(v, bytes):
+        return f"<blob {len(v)}B>"
+    s = f"{v:.6g}" if isinstance(v, float) else " ".join(str(v).split()).replace("|", "/")
+    return s if len(s) <= max_chars else s[: max_chars - 1] + "…"
+
+
+def _keys(table: TableMetadata, column: ColumnMetadata) -> str:
+    keys = []
+    if column.is_pk:
+        keys.append("pk")
+    if column.is_unique:
+        keys.append("unique")
+    for fk in table.foreign_keys:
+        if column.name in fk.columns:
+            keys.append("fk")
+            break
+    if not column.allows_null:
+        keys.append("not null")
+    return " ".join(keys)
+
+
+def _values(column: ColumnMetadata, count: int, max_chars: int) -> str:
+    if count == 0:
+        return ""
+    # Frequent values tell more than samples about a repetitive column
+    repeated = [v for v in column.top_values if v.count > 1]
+    if len(repeated) > 0 and column.distinct_count < column.non_null_count / 2:
+        return "top: " + ", ".join(
+            f"{_value(v.value, max_chars)} ({v.count})" for v in repeated[:count]
+        )
+    return ", ".join(_value(v, max_chars) for v in column.samples[:count])
+
+
+def _column_line(
+    table: TableMetadata, column: ColumnMetadata, values: int, max_chars: int, with_stats: bool
+) -> str:
+    fields = [column.name, column.declared_type or "?", _keys(table, column)]
+    if with_stats:
+        value_chars = max(max_chars, 16)
+        value_range = ""
+        if column.min_value is not None:
+            value_range = (
+                f"{_value(column.min_value, value_chars)} .. {_value(column.max_value, value_chars)}"
+            )
+        if column.numeric is not None and not column.is_pk:
+            value_range += f" avg {column.numeric.mean:.4g}"
+        elif column.length.max is not None and "text" in column.storage_classes:
+            value_range += f" len {column.length.min}-{column.length.max}"
+        fields += [
+            str(column.null_count),
+            str(column.distinct_count),
+            value_range.strip(),
+        ]
+    if values > 0:
+        fields.append(_values(column, values, max_chars))
+    return " | ".join(fields)
+
+
+def encode_table_metadata(
+    table: TableMetadata, values: int = 5, max_chars: int = 40, with_stats: bool = True
+) -> str:
+    header = ["name", "type", "keys"]
+    if with_stats:
+        header += ["nulls", "distinct", "range"]
+    if values > 0:
+        header.append("values")
+
+    lines = [f"Table {table.name}: {table.row_count} rows"]
+    if len(table.foreign_keys) > 0:
+        lines.append(
+            "Foreign keys: "
+            + "; ".join(
+                f"{','.join(fk.columns)} -> {fk.ref_table}.{','.join(fk.ref_columns)}"
+                + ("" if fk.declared else " (inferred)")
+                for fk in table.foreign_keys
+            )
+        )
+    lines.append(f"Columns ({' | '.join(header)}):")
+    lines += [
+        _column_line(table, column, values, max_chars, with_stats) for column in table.columns
+    ]
+    return "\n".join(lines)
+
+
+TABLE_HEADER_PATTERN = re.compile(r"^Table (.+?): \d+ rows\n", re.M)
+
+
+def decode_table_metadata(text: str) -> list[tuple[str, list[tuple[str, str]]]]:
+    # (tablename, [(column name, declared type)]) of the tables encoded in a prompt,
+    # the blocks of encode_table_metadata are separated by a blank line
+    tables = []
+    for block in text.split("\n\n"):
+        match = TABLE_HEADER_PATTERN.search(block)
+        if match is None:
+            continue
+        lines = block[match.end() :].split("\n")
+        header = [i for i, line in enumerate(lines) if line.startswith("Columns (")]
+        if len(header) != 1:
+            continue
+        columns = []
+        for line in lines[header[0] + 1 :]:
+            fields = line.split(" | ")
+            columns.append((fields[0], fields[1] if len(fields) > 1 else "?"))
+        tables.append((match.group(1), columns))
+    return tables
+
+
+def compact_table_metadata(table: TableMetadata, token_budget: int | None = None) -> str:
+    # Most detailed encoding fitting the budget, the least detailed one when none fits
+    encoded = ""
+    for values, max_chars, with_stats in ENCODING_LEVELS:
+        encoded = encode_table_metadata(table, values, max_chars, with_stats)
+        if token_budget is None or count_tokens(encoded) <= token_budget:
+            break
+    return encoded
+
+
+def pack_table_batches(
+    tables: list[TableMetadata],
+    max_tables: int,
+    batch_token_budget: int,
+    token_budget: int | None = None,
+) -> list[list[TableMetadata]]:
+    # Consecutive tables summarized by one request while their metadata fits the
+    # batch budget, a table bigger than the budget is a batch of its own
+    batches: list[list[TableMetadata]] = []
+    batch: list[TableMetadata] = []
+    batch_tokens = 0
+    for table in tables:
+        tokens = count_tokens(compact_table_metadata(table, token_budget))
+        if len(batch) > 0 and (
+            len(batch) >= max_tables or batch_tokens + tokens > batch_token_budget
+        ):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(table)
+        batch_tokens += tokens
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
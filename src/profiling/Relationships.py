@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+from src.lib.DbConnector import DbConnector
+from src.profiling.Models import ColumnMetadata, Relationship, TableMetadata
+from src.profiling.Sketches import MinHash
+
+# ------------------------------------------------------
+# Foreign key discovery
+#
+# Declared foreign keys come from the database catalog. Undeclared ones are
+# inferred by comparing MinHash signatures of the columns, so we never join
+# every pair of columns: a column references another one when (almost) all its
+# values are found in it, the referenced column is a declared key and the
+# names agree.
+
+# Share of the values that must be found in the referenced column
+CONTAINMENT_THRESHOLD: float = 0.9
+
+
+def type_affinity(declared_type: str) -> str:
+    # https://www.sqlite.org/datatype3.html#determination_of_column_affinity
+    t = declared_type.upper()
+    if "INT" in t:
+        return "INTEGER"
+    if "CHAR" in t or "CLOB" in t or "TEXT" in t:
+        return "TEXT"
+    if "BLOB" in t or t == "":
+        return "BLOB"
+    if "REAL" in t or "FLOA" in t or "DOUB" in t:
+        return "REAL"
+    return "NUMERIC"
+
+
+def key_candidate_columns(columns: list[dict]) -> list[str]:
+    # Only integer and text columns hold keys, floats|blobs never reference anything
+    return [
+        c["column_name"]
+        for c in columns
+        if type_affinity(c["column_type"]) in ("INTEGER", "TEXT")
+    ]
+
+
+def signature_candidate_columns(
+    columns: list[dict],
+    index_flags: dict[str, dict[str, bool]],
+    declared: list[Relationship],
+) -> list[str]:
+    # Key candidates infer_relationships can use: a key can be referenced, any other
+    # column can reference one unless it already is a declared foreign key
+    single_pk = sum(c["is_pk"] for c in columns) == 1
+    is_key = {
+        c["column_name"]: (c["is_pk"] and single_pk)
+        or index_flags.get(c["column_name"], {}).get("is_unique", False)
+        for c in columns
+    }
+    declared_columns = {r.columns[0] for r in declared if len(r.columns) == 1}
+    return [
+        n for n in key_candidate_columns(columns) if is_key[n] or n not in declared_columns
+    ]
+
+
+def declared_relationships(db: DbConnector, tablename: str) -> list[Relationship]:
+    return [
+        Relationship(
+            table=tablename,
+            columns=fk["columns"],
+            ref_table=fk["ref_table"],
+            ref_columns=fk["ref_columns"],
+            declared=True,
+        )
+        for fk in db.foreign_keys(tablename)
+    ]
+
+
+def _is_key(table: TableMetadata, column: ColumnMetadata) -> bool:
+    # Declared unique: single column primary key or leading a unique index.
+    # Values that merely happen to be distinct don't make a key
+    single_pk = column.is_pk and sum(c.is_pk for c in table.columns) == 1
+    return column.is_unique or single_pk
+
+
+def _names_match(column: str, ref_table: str, ref_column: str) -> bool:
+    # AlbumId -> Album.AlbumId | Album.Id
+    column = column.lower()
+    return column == ref_column.lower() or column == (ref_table + ref_column).lower()
+
+
+def infer_relationships(
+    tables: list[TableMetadata], threshold: float = CONTAINMENT_THRESHOLD
+) -> list[Relationship]:
+    # Undeclared single column foreign keys, one referenced column at most per column
+    parents = [
+        (table, column, MinHash.from_signature(column.minhash))
+        for table in tables
+        for column in table.columns
+        if column.minhash is not None and _is_key(table, column)
+    ]
+
+    relationships = []
+    for table in tables:
+        declared = {tuple(r.columns) for r in table.foreign_keys if r.declared}
+        for column in table.columns:
+            if column.minhash is None or column.non_null_count == 0:
+                continue
+            if (column.name,) in declared:
+                continue
+            # A primary key identifies its own rows
+            if column.is_pk and sum(c.is_pk for c in table.columns) == 1:
+                continue
+
+            minhash = MinHash.from_signature(column.minhash)
+            affinity = type_affinity(column.declared_type)
+            best: tuple[float, TableMetadata, ColumnMetadata] | None = None
+            for ref_table, ref_column, ref_minhash in parents:
+                if ref_table.name == table.name and ref_column.name == column.name:
+                    continue
+                if type_affinity(ref_column.declared_type) != affinity:
+                    continue
+                if column.distinct_count > ref_column.distinct_count:
+                    continue
+                # Small surrogate integer keys overlap by chance, and so do text values
+                # copied from a row (an invoice holds the address of its customer):
+                # the names must agree
+                if not _names_match(column.name, ref_table.name, ref_column.name):
+                    continue
+
+                containment = minhash.containment(
+                    ref_minhash, column.distinct_count, ref_column.distinct_count
+                )
+                if containment >= threshold and (best is None or containment > best[0]):
+                    best = (containment, ref_table, ref_column)
+
+            if best is not None:
+                containment, ref_table, ref_column = best
+                relationships.append(
+                    Relationship(
+                        table=table.name,
+                        columns=[column.name],
+                        ref_table=ref_table.name,
+                        ref_columns=[ref_column.name],
+                        declared=False,
+                        containment=round(containment, 4),
+                    )
+                )
+    return relationships
@@ -0,0 +1,149 @@
+from __future__ import annotations
+import re
+import sqlite3
+from pathlib import Path
+
+from src.profiling.Models import TableDescriptionOutput
+
+# ------------------------------------------------------
+# Retrieval of the tables|columns relevant to a question
+#
+# The sqlite export of the llm summary also holds a full text index of the
+# table and column descriptions, so the agent reads the few relevant tables
+# instead of the whole schema:
+#
+#   index = SchemaIndex("out/ty_gemini.llm.sqlite")
+#   index.search_tables("Which artist has the most tracks?", limit=5)
+#   index.search_columns("customers postal code", limit=20)
+#
+# Names are indexed with their words split (BillingPostalCode -> Billing
+# Postal Code) and stemmed with the descriptions, matches on a name weigh
+# more than matches on a description.
+
+# fts5 with porter stemming: "tracks" matches "track"
+schema_search_creation_str = """
+CREATE VIRTUAL TABLE IF NOT EXISTS schema_search USING fts5(
+    name,
+    description,
+    context,
+    table_name UNINDEXED,
+    column_name UNINDEXED,
+    tokenize = 'porter unicode61'
+)
+"""
+
+# One row per column, the descriptions without scanning field_description
+column_lookup_creation_str = """
+CREATE TABLE IF NOT EXISTS column_lookup (
+    table_name TEXT,
+    column_name TEXT,
+    description TEXT,
+    PRIMARY KEY (table_name, column_name)
+) WITHOUT ROWID
+"""
+
+# bm25 weights of name, description, context
+SEARCH_WEIGHTS = (10.0, 2.0, 1.0)
+
+STOP_WORDS = {
+    "a", "all", "an", "and", "any", "are", "as", "at", "be", "by", "does", "each",
+    "for", "from", "give", "has", "have", "how", "in", "is", "it", "list", "me",
+    "most", "much", "many", "of", "on", "or", "per", "show", "that", "the", "their",
+    "there", "to", "was", "what", "where", "which", "who", "with",
+}
+
+
+def identifier_words(name: str) -> str:
+    # InvoiceLine -> Invoice Line, unit_price -> unit price
+    return " ".join(re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", name).replace("_", " ").split())
+
+
+def schema_index_rows(
+    model_outputs: dict[str, TableDescriptionOutput],
+) -> tuple[list[tuple], list[tuple]]:
+    # (column_lookup rows, schema_search rows), a search row per table and per column.
+    # The context of a table is its column names, the one of a column its table name.
+    # A column described twice keeps its first description (one row per column)
+    lookup_rows: list[tuple] = []
+    search_rows: list[tuple] = []
+    for tablename, model_output in model_outputs.items():
+        columns = []
+        for c in model_output.data.columns:
+            if all(c.name != kept.name for kept in columns):
+                columns.append(c)
+        search_rows.append(
+            (
+                f"{tablename} {identifier_words(tablename)}",
+                model_output.data.table if model_output.success else "",
+                " ".join(identifier_words(c.name) for c in columns),
+                tablename,
+                None,
+            )
+        )
+        for c in columns:
+            lookup_rows.append((tablename, c.name, c.description))
+            search_rows.append(
+                (
+                    f"{c.name} {identifier_words(c.name)}",
+                    c.description,
+                    identifier_words(tablename),
+                    tablename,
+                    c.name,
+                )
+            )
+    return lookup_rows, search_rows
+
+
+def search_query(question: str) -> str | None:
+    # fts5 query matching any of the words of the question, None without any word
+    words = []
+    for word in re.findall(r"\w+", question.lower()):
+        if len(word) > 1 and word not in STOP_WORDS and word not in words:
+            words.append(word)
+    if len(words) == 0:
+        return None
+    return " OR ".join(f'"{w}"' for w in words)
+
+
+class SchemaIndex:
+    """
+    Read only access to the search index of an exported llm summary, see
+    export_model_outputs. Keeps its connection open between the searches.
+    """
+
+    def __init__(self, filepath: str) -> None:
+        uri = Path(filepath).resolve().as_uri() + "?mode=ro"
+        self.conn: sqlite3.Connection = sqlite3.connect(uri, uri=True)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _search(self, question: str, columns: bool, limit: int) -> list[tuple]:
+        query = search_query(question)
+        if query is None:
+            return []
+        return self.conn.execute(
+            f"""
+            SELECT table_name, column_name, bm25(schema_search, ?, ?, ?) AS score
+            FROM schema_search
+            WHERE schema_search MATCH ? AND column_name IS {"NOT " if columns else ""}NULL
+            ORDER BY score
+            LIMIT ?
+            """,
+            (*SEARCH_WEIGHTS, query, limit),
+        ).fetchall()
+
+    def search_tables(self, question: str, limit: int = 5) -> list[tuple[str, float]]:
+        # (tablename, score) of the most relevant tables first, the higher the score the better
+        return [(t, -score) for t, _, score in self._search(question, False, limit)]
+
+    def search_columns(self, question: str, limit: int = 20) -> list[tuple[str, str, float]]:
+        # (tablename, column name, score) of the most relevant columns first
+        return [(t, c, -score) for t, c, score in self._search(question, True, limit)]
+
+    def column_description(self, tablename: str, column_name: str) -> str | None:
+        row = self.conn.execute(
+            "SELECT description FROM column_lookup WHERE table_name = ? AND column_name = ?",
+            (tablename, column_name),
+        ).fetchone()
+        return None if row is None else row[0]
@@ -0,0 +1,457 @@
+from __future__ import annotations
+import hashlib
+import heapq
+import math
+import struct
+from collections import Counter
+from typing import Any
+
+import numpy as np
+
+# ------------------------------------------------------
+# Stable value hashing
+#
+# python's hash() is salted per process, sketches built by different
+# processes must agree on the hash of a value so we use our own.
+
+_UINT64_MASK = 0xFFFFFFFFFFFFFFFF
+_INT64_MIN = -(2**63)
+_INT64_MAX = 2**63 - 1
+
+
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    # uint64 arithmetic wraps around, which is what the mixer expects
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _splitmix64_int(x: int) -> int:
+    # Same as _splitmix64 for a single python int
+    x = (x + 0x9E3779B97F4A7C15) & _UINT64_MASK
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _UINT64_MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _UINT64_MASK
+    return x ^ (x >> 31)
+
+
+def _hash_value(v: Any) -> int:
+    # sqlite compares 1 and 1.0 as equal, so do we
+    if isinstance(v, float) and v.is_integer() and _INT64_MIN <= v <= _INT64_MAX:
+        v = int(v)
+
+    if isinstance(v, int) and _INT64_MIN <= v <= _INT64_MAX:
+        return _splitmix64_int(v & _UINT64_MASK)
+    if isinstance(v, float):
+        data, person = struct.pack("<d", v), b"real"
+    elif isinstance(v, bytes):
+        data, person = v, b"blob"
+    else:
+        data, person = str(v).encode("utf-8", "surrogatepass"), b"text"
+
+    return int.from_bytes(
+        hashlib.blake2b(data, digest_size=8, person=person).digest(), "little"
+    )
+
+
+def hash_values(values: list | tuple) -> np.ndarray:
+    # 64 bits hash of each non null value, integer columns are hashed vectorized
+    values = [v for v in values if v is not None]
+    if len(values) > 0 and all(type(v) is int for v in values):
+        try:
+            ints = np.array(values, dtype=np.int64)
+            return _splitmix64(ints.view(np.uint64))
+        except OverflowError:
+            pass
+
+    return np.fromiter(map(_hash_value, values), dtype=np.uint64, count=len(values))
+
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    # Smear the highest set bit to the right then count the bits
+    for shift in (1, 2, 4, 8, 16, 32):
+        x = x | (x >> np.uint64(shift))
+    return np.bitwise_count(x).astype(np.uint8)
+
+
+# ------------------------------------------------------
+# Sketches
+
+
+class HyperLogLog:
+    """Distinct count estimate in 2^precision bytes whatever the # of values"""
+
+    def __init__(self, precision: int = 14) -> None:
+        assert 4 <= precision <= 18, f"precision set to {precision}"
+        self.precision: int = precision
+        self.registers: np.ndarray = np.zeros(1 << precision, dtype=np.uint8)
+
+    @property
+    def relative_error(self) -> float:
+        # Standard error of the estimate
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add_hashes(self, hashes: np.ndarray) -> None:
+        if len(hashes) == 0:
+            return
+        p = self.precision
+        index = (hashes >> np.uint64(64 - p)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - p)) - 1)
+        rank = np.uint8(64 - p + 1) - _bit_length(rest)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: HyperLogLog) -> None:
+        assert self.precision == other.precision
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> float:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int32))))
+
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros > 0:
+            # Small range correction (linear counting)
+            return m * math.log(m / zeros)
+        return raw
+
+
+class MinHash:
+    """Jaccard similarity of two sets of values from num_perm minimum hashes"""
+
+    # Same seeds in every process so signatures of different tables compare
+    SEED: int = 42
+
+    def __init__(self, num_perm: int = 128) -> None:
+        rng = np.random.default_rng(self.SEED)
+        self.seeds: np.ndarray = rng.integers(
+            0, _UINT64_MASK, size=num_perm, dtype=np.uint64, endpoint=True
+        )
+        self.values: np.ndarray = np.full(num_perm, _UINT64_MASK, dtype=np.uint64)
+
+    @staticmethod
+    def from_signature(signature: list[int]) -> MinHash:
+        minhash = MinHash(len(signature))
+        minhash.values = np.array(signature, dtype=np.uint64)
+        return minhash
+
+    def signature(self) -> list[int]:
+        return [int(v) for v in self.values]
+
+    @property
+    def is_empty(self) -> bool:
+        return bool(np.all(self.values == np.uint64(_UINT64_MASK)))
+
+    def add_hashes(self, hashes: np.ndarray, block_size: int = 4096) -> None:
+        hashes = np.unique(hashes)
+        # (num_perm, block_size) matrix at a time to bound memory
+        for start in range(0, len(hashes), block_size):
+            block = hashes[start : start + block_size]
+            mixed = _splitmix64(block[None, :] ^ self.seeds[:, None])
+            np.minimum(self.values, mixed.min(axis=1), out=self.values)
+
+    def merge(self, other: MinHash) -> None:
+        assert len(self.values) == len(other.values)
+        np.minimum(self.values, other.values, out=self.values)
+
+    def jaccard(self, other: MinHash) -> float:
+        assert len(self.values) == len(other.values)
+        return float(np.mean(self.values == other.values))
+
+    def containment(self, other: MinHash, size: int, other_size: int) -> float:
+        # Estimated share of this set found in the other: |A n B| / |A|
+        if size == 0 or self.is_empty or other.is_empty:
+            return 0.0
+        j = self.jaccard(other)
+        intersection = j * (size + other_size) / (1 + j)
+        return min(1.0, intersection / size)
+
+
+class TopK:
+    """
+    Most frequent values in `capacity` counters (Misra-Gries).
+
+    A reported count is at most `error` below the true count, counts are exact
+    while the column has no more than `capacity` distinct values.
+    """
+
+    def __init__(self, capacity: int = 64) -> None:
+        assert capacity > 0, f"capacity set to {capacity}"
+        self.capacity: int = capacity
+        self.counters: dict[Any, int] = {}
+        self.error: int = 0
+
+    def add(self, values: list | tuple) -> None:
+        counts = Counter(v for v in values if v is not None)
+        self.merge_counts(counts)
+
+    def merge(self, other: TopK) -> None:
+        self.merge_counts(other.counters)
+        self.error += other.error
+
+    def merge_counts(self, counts: dict[Any, int]) -> None:
+        for value, count in counts.items():
+            self.counters[value] = self.counters.get(value, 0) + count
+        if len(self.counters) <= self.capacity:
+            return
+
+        # Decrement every counter by the (capacity + 1)th largest, drop the ones reaching 0
+        cut = sorted(self.counters.values(), reverse=True)[self.capacity]
+        self.counters = {v: c - cut for v, c in self.counters.items() if c > cut}
+        self.error += cut
+
+    def top(self, k: int) -> list[tuple[Any, int]]:
+        # Ties broken by value so the result doesn't depend on the insertion order
+        ordered = sorted(self.counters.items(), key=lambda vc: (-vc[1], sqlite_sort_key(vc[0])))
+        return ordered[:k]
+
+
+def sqlite_sort_key(v: Any) -> tuple[int, Any]:
+    # sqlite orders numbers < text < blobs
+    if isinstance(v, (int, float)):
+        return (0, v)
+    if isinstance(v, str):
+        return (1, v)
+    return (2, bytes(v))
+
+
+def equi_depth_histogram(
+    values: list, buckets: int, population_size: int
+) -> list[tuple[Any, Any, int]]:
+    # (lower, upper, # of values) buckets holding the same share of the sorted
+    # values, counts scaled from the sample to the population
+    values = sorted((v for v in values if v is not None), key=sqlite_sort_key)
+    if len(values) == 0 or buckets <= 0:
+        return []
+
+    buckets = min(buckets, len(values))
+    histogram = []
+    for i in range(buckets):
+        start = i * len(values) // buckets
+        end = (i + 1) * len(values) // buckets
+        count = round((end - start) / len(values) * population_size)
+        histogram.append((values[start], values[end - 1], count))
+    return histogram
+
+
+class RowReservoir:
+    """Uniform sample of `capacity` rows out of a stream (algorithm R)"""
+
+    def __init__(self, capacity: int, seed: int = 0) -> None:
+        assert capacity > 0, f"capacity set to {capacity}"
+        self.capacity: int = capacity
+        self.rows: list[tuple] = []
+        self.seen: int = 0
+        # Seeded so two runs on the same data give the same profile
+        self._rng: np.random.Generator = np.random.default_rng(seed)
+
+    @property
+    def is_exhaustive(self) -> bool:
+        # The whole stream fit in the sample
+        return self.seen <= self.capacity
+
+    def add(self, rows: list[tuple]) -> None:
+        fill = max(0, min(len(rows), self.capacity - len(self.rows)))
+        self.rows.extend(rows[:fill])
+
+        if fill < len(rows):
+            # Row i of the stream replaces a random slot with probability capacity / (i + 1)
+            positions = np.arange(self.seen + fill, self.seen + len(rows))
+            draws = self._rng.integers(0, positions + 1)
+            for k in np.nonzero(draws < self.capacity)[0]:
+                self.rows[draws[k]] = rows[fill + k]
+
+        self.seen += len(rows)
+
+    def merge(self, other: RowReservoir) -> None:
+        # Uniform sample of both streams, the # of rows kept from each
+        # follows a hypergeometric law
+        size = min(self.capacity, len(self.rows) + len(other.rows))
+        if size == len(self.rows) + len(other.rows):
+            self.rows = self.rows + other.rows
+        else:
+            from_self = int(self._rng.hypergeometric(self.seen, other.seen, size))
+            from_self = max(size - len(other.rows), min(from_self, len(self.rows)))
+            keep_self = np.sort(self._rng.choice(len(self.rows), from_self, replace=False))
+            keep_other = np.sort(
+                self._rng.choice(len(other.rows), size - from_self, replace=False)
+            )
+            self.rows = [self.rows[i] for i in keep_self] + [other.rows[i] for i in keep_other]
+        self.seen += other.seen
+
+
+class NumericMoments:
+    """Count, mean, variance, extrema and signs of a stream of numbers (mergeable)"""
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.mean: float = 0.0
+        # Sum of the squared differences to the mean
+        self.m2: float = 0.0
+        self.min: float | None = None
+        self.max: float | None = None
+        self.zero_count: int = 0
+        self.negative_count: int = 0
+
+    @property
+    def stddev(self) -> float | None:
+        # Sample standard deviation
+        if self.count < 2:
+            return None
+        return math.sqrt(self.m2 / (self.count - 1))
+
+    def add(self, values: np.ndarray) -> None:
+        if len(values) == 0:
+            return
+        chunk = NumericMoments()
+        chunk.count = len(values)
+        chunk.mean = float(np.mean(values))
+        chunk.m2 = float(np.sum(np.square(values - chunk.mean)))
+        chunk.min = float(np.min(values))
+        chunk.max = float(np.max(values))
+        chunk.zero_count = int(np.count_nonzero(values == 0))
+        chunk.negative_count = int(np.count_nonzero(values < 0))
+        self.merge(chunk)
+
+    def merge(self, other: NumericMoments) -> None:
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.__dict__.update(other.__dict__)
+            return
+
+        # Chan et al. parallel variance
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)  # type: ignore[type-var]
+        self.max = max(self.max, other.max)  # type: ignore[type-var]
+        self.zero_count += other.zero_count
+        self.negative_count += other.negative_count
+
+
+def storage_class(v: Any) -> str:
+    # sqlite typeof() of a fetched value, other backends give their own python types
+    if type(v) is int:
+        return "integer"
+    if type(v) is float:
+        return "real"
+    if isinstance(v, str):
+        return "text"
+    if isinstance(v, (bytes, bytearray, memoryview)):
+        return "blob"
+    return type(v).__name__.lower()
+
+
+def numeric_values(values: list | tuple, classes: Counter[str]) -> np.ndarray:
+    # integer and real values as float64, the other storage classes are skipped
+    if classes.keys() <= {"integer", "real"}:
+        # Only numbers: converted in C
+        return np.array(values, dtype=np.float64)
+    return np.fromiter(
+        (v for v in values if type(v) is int or type(v) is float), dtype=np.float64
+    )
+
+
+class ColumnSketches:
+    """Fixed size sketches of a column fed chunk by chunk by the profiling scan"""
+
+    def __init__(
+        self, distinct: bool, minhash: bool, top_k_capacity: int = 64, smallest_k: int = 0
+    ) -> None:
+        self.hll: HyperLogLog | None = HyperLogLog() if distinct else None
+        self.minhash: MinHash | None = MinHash() if minhash else None
+        self.top_k: TopK = TopK(top_k_capacity)
+        # smallest_k smallest values in sqlite order, the top values of a unique column
+        self.smallest_k: int = smallest_k
+        self.smallest: list = []
+        self.moments: NumericMoments = NumericMoments()
+        # {storage class: # of values}, nulls excluded
+        self.storage_classes: Counter[str] = Counter()
+        # In sqlite order across storage classes
+        self.min_value: Any = None
+        self.max_value: Any = None
+
+    def add(self, values: list | tuple) -> None:
+        if self.hll is not None or self.minhash is not None:
+            # Hashed once for both sketches
+            hashes = hash_values(values)
+            if self.hll is not None:
+                self.hll.add_hashes(hashes)
+            if self.minhash is not None:
+                self.minhash.add_hashes(hashes)
+        self.top_k.add(values)
+
+        classes = Counter(map(storage_class, values))
+        if classes.pop("nonetype", 0) > 0:
+            values = [v for v in values if v is not None]
+        self.storage_classes.update(classes)
+        if self.smallest_k > 0:
+            self.smallest = heapq.nsmallest(
+                self.smallest_k, [*self.smallest, *values], key=sqlite_sort_key
+            )
+
+        self.moments.add(numeric_values(values, classes))
+
+        # Extrema of each storage class (builtin min/max) then across classes in sqlite order
+        candidates = []
+        for python_types in ((int, float), (str,), (bytes,)):
+            typed = [v for v in values if type(v) in python_types]
+            if len(typed) > 0:
+                candidates += [min(typed), max(typed)]
+        if len(candidates) > 0:
+            self.min_value = extremum(min, self.min_value, min(candidates, key=sqlite_sort_key))
+            self.max_value = extremum(max, self.max_value, max(candidates, key=sqlite_sort_key))
+
+    def merge(self, other: ColumnSketches) -> None:
+        if self.hll is not None and other.hll is not None:
+            self.hll.merge(other.hll)
+        if self.minhash is not None and other.minhash is not None:
+            self.minhash.merge(other.minhash)
+        self.top_k.merge(other.top_k)
+        self.moments.merge(other.moments)
+        self.storage_classes.update(other.storage_classes)
+        if self.smallest_k > 0:
+            self.smallest = heapq.nsmallest(
+                self.smallest_k, [*self.smallest, *other.smallest], key=sqlite_sort_key
+            )
+        self.min_value = extremum(min, self.min_value, other.min_value)
+        self.max_value = extremum(max, self.max_value, other.max_value)
+
+
+def extremum(fn, a: Any, b: Any) -> Any:
+    # min|max in sqlite order, None when no value
+    if a is None or b is None:
+        return a if b is None else b
+    return fn(a, b, key=sqlite_sort_key)
+
+
+# ------------------------------------------------------
+# Error bounds (95% confidence half width)
+
+Z_95 = 1.96
+
+
+def finite_population_correction(sample_size: int, population_size: int) -> float:
+    if population_size <= 1 or sample_size >= population_size:
+        return 0.0
+    return math.sqrt((population_size - sample_size) / (population_size - 1))
+
+
+def proportion_bound(successes: int, sample_size: int, population_size: int) -> float:
+    # Bound on successes/sample_size * population_size
+    if sample_size == 0:
+        return float(population_size)
+    p = successes / sample_size
+    fpc = finite_population_correction(sample_size, population_size)
+    return population_size * Z_95 * math.sqrt(p * (1 - p) / sample_size) * fpc
+
+
+def mean_bound(values: list[float], population_size: int) -> float | None:
+    if len(values) < 2:
+        return None
+    std = float(np.std(values, ddof=1))
+    fpc = finite_population_correction(len(values), population_size)
+    return Z_95 * std / math.sqrt(len(values)) * fpc
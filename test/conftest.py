@@ -1,6 +1,18 @@
+from typing import Type
+
 from src.lib.Config import OutputFormat
+from src.lib.Errors import AiApiError
+from src.profiling.GenAi import GenAiApi, LlmProvider
+from src.profiling.Models import (
+    FieldDescription,
+    NamedTableDescription,
+    TableDescription,
+    TablesDescription,
+)
 from src.profiling.ProfilingConfig import ProfilingConfig
+from src.profiling.PromptEncoding import decode_table_metadata
 from src.lib.SqliteConnector import SqliteConnector
+from src.lib.DbConnector import DbBackend
 import pytest
 
 
@@ -18,7 +30,24 @@ def db():
         DO_LLM_SUMMARY=False,
         SAVE_METADATA=False,
         DRY_RUN=True,
-        SKIP_INTERACTIONS=True
+        SKIP_INTERACTIONS=True,
+        DB_BACKEND=DbBackend.SQLITE,
+        WORKERS=1,
+        APPROX=False,
+        USE_CACHE=False,
+        PARTITION_ROWS=0,
+        USE_LLM_CACHE=False,
+        LLM_CACHE_TTL_DAYS=30,
+        LLM_CACHE_MAX_MB=256,
+        PROMPT_TOKEN_BUDGET=2000,
+        BATCH_TABLES=1,
+        BATCH_TOKEN_BUDGET=8000,
+        LLM_CONCURRENCY=8,
+        MAX_TPM=-1,
+        LLM_PROVIDER=LlmProvider.FAKE,
+        LLM_FAILURE_RATE=0.0,
+        LLM_STREAM=False,
+        COLUMN_CHUNK_SIZE=100,
     )
     ProfilingConfig.init(test_profiling_config)
 
@@ -26,3 +55,54 @@ def db():
     yield db
 
     print("Cleaning up...")
+
+
+class EchoLlm(GenAiApi):
+    """
+    Describes the tables of the prompt by their names, counts the calls.
+    The tables of `forget` are left out of the batched responses.
+    """
+
+    def __init__(self, forget: set[str] | None = None) -> None:
+        self.calls: int = 0
+        self.forget: set[str] = forget or set()
+
+    def get_model_name(self) -> str:
+        return "echo"
+
+    def _generate_text(self, prompt: str) -> str | None:
+        return None
+
+    def retry_strategy(self, status_code: int, count: int) -> bool:
+        return False
+
+    def _generate_json(self, prompt: str, response_schema: Type) -> str | AiApiError:
+        self.calls += 1
+        descriptions = [
+            NamedTableDescription(
+                name=name,
+                columns=[FieldDescription(name=c, description=c.lower()) for c in columns],
+                table=f"{name.lower()}s",
+            )
+            for name, columns in prompt_tables(prompt)
+        ]
+        if response_schema is TablesDescription:
+            return TablesDescription(
+                tables=[d for d in descriptions if d.name not in self.forget]
+            ).model_dump_json()
+        return TableDescription(
+            columns=descriptions[0].columns, table=descriptions[0].table
+        ).model_dump_json()
+
+
+def prompt_tables(prompt: str) -> list[tuple[str, list[str]]]:
+    # (tablename, column names) of the compact metadata in the prompt
+    tables = [(t, [c for c, _ in columns]) for t, columns in decode_table_metadata(prompt)]
+    assert len(tables) > 0, prompt
+    return tables
+
+
+@pytest.fixture
+def echo_llm() -> type[EchoLlm]:
+    # The class, tests build it with their options or subclass it
+    return EchoLlm
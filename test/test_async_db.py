@@ -0,0 +1,78 @@
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+from src.lib.AsyncSqliteConnector import AsyncSqliteConnector
+from src.lib.SqliteConnector import FetchType
+
+DB_CONN_STRING = "db/Chinook.db"
+ENDLESS_QUERY = (
+    "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) "
+    "SELECT COUNT(*) FROM c"
+)
+
+
+def test_async_select_matches_sync(db):
+    queries = [f'SELECT COUNT(*) FROM "{t}"' for t in db.list_tables()]
+
+    async def run():
+        async with AsyncSqliteConnector(DB_CONN_STRING, pool_size=3) as adb:
+            return await asyncio.gather(
+                *[adb.select(q, FetchType.ONE) for q in queries]
+            )
+
+    results = asyncio.run(run())
+
+    assert results == [db.select(q, FetchType.ONE) for q in queries]
+
+
+def test_async_select_cancel_interrupts_query():
+    async def run():
+        async with AsyncSqliteConnector(
+            DB_CONN_STRING, pool_size=1, do_logging=False
+        ) as adb:
+            with pytest.raises(TimeoutError):
+                await asyncio.wait_for(adb.select(ENDLESS_QUERY), timeout=0.2)
+
+            # The only pooled connection must be usable again
+            return await asyncio.wait_for(
+                adb.select("SELECT COUNT(*) FROM Artist", FetchType.ONE), timeout=5
+            )
+
+    assert asyncio.run(run()) == (275,)
+
+
+
+def test_cancelled_job_aborts_without_interrupt():
+    adb = AsyncSqliteConnector(DB_CONN_STRING, pool_size=1, do_logging=False)
+    conn = sqlite3.connect(DB_CONN_STRING, check_same_thread=False)
+
+    def endless(conn: sqlite3.Connection) -> list:
+        return conn.execute(ENDLESS_QUERY).fetchall()
+
+    # Cancelled once the job started, conn.interrupt() may have come too early
+    cancelled = threading.Event()
+    threading.Timer(0.1, cancelled.set).start()
+    assert adb._guarded(conn, endless, cancelled) == (False, None)
+    # Cancelled before it started, the query never runs
+    assert adb._guarded(conn, endless, cancelled) == (False, None)
+
+    assert conn.execute("SELECT COUNT(*) FROM Artist").fetchone() == (275,)
+    conn.close()
+
+
+def test_job_finishing_after_close_closes_its_connection():
+    async def run() -> sqlite3.Connection:
+        adb = AsyncSqliteConnector(DB_CONN_STRING, pool_size=1, do_logging=False)
+        assert await adb.select("SELECT COUNT(*) FROM Artist", FetchType.ONE) == (275,)
+        await adb.close()
+
+        conn = sqlite3.connect(DB_CONN_STRING, check_same_thread=False)
+        adb._release(asyncio.get_running_loop(), conn)
+        return conn
+
+    conn = asyncio.run(run())
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
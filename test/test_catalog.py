@@ -0,0 +1,99 @@
+import shutil
+import sqlite3
+from typing import Type
+
+import profiler
+from src.lib.Config import Config
+from src.lib.Errors import AiApiError
+from src.profiling.Catalog import Catalog
+from src.profiling.ProfilingConfig import ProfilingConfig
+
+
+def test_multi_database_catalog(db, echo_llm, tmp_path, monkeypatch):
+    tenants = tmp_path / "tenants"
+    tenants.mkdir()
+    for name in ("a.db", "b.db", "c.db"):
+        shutil.copy("db/Chinook.db", tenants / name)
+    conn = sqlite3.connect(tenants / "c.db")
+    conn.execute("CREATE TABLE Extra (id INTEGER PRIMARY KEY)")
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(ProfilingConfig, "DB_CONN_STRING", str(tenants))
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path / "out"))
+    monkeypatch.setattr(ProfilingConfig, "DRY_RUN", False)
+    monkeypatch.setattr(ProfilingConfig, "DO_EXTRACTION", True)
+    monkeypatch.setattr(ProfilingConfig, "DO_LLM_SUMMARY", True)
+    monkeypatch.setattr(ProfilingConfig, "WORKERS", 2)
+    # Every table of a schema in one request
+    monkeypatch.setattr(ProfilingConfig, "BATCH_TABLES", 20)
+    monkeypatch.setattr(Config, "MAX_RPM", -1)
+
+    llm = echo_llm()
+    profiler.run_multi_database(llm)
+
+    # a.db and b.db share their summaries
+    assert llm.calls == 2
+
+    catalog = sqlite3.connect(tmp_path / "out" / profiler.CATALOG_FILENAME)
+    databases = catalog.execute("SELECT path, schema_hash FROM database ORDER BY path").fetchall()
+    assert [p.rsplit("/", 1)[1] for p, _ in databases] == ["a.db", "b.db", "c.db"]
+    assert databases[0][1] == databases[1][1] != databases[2][1]
+
+    descriptions = catalog.execute(
+        "SELECT d.path, t.description FROM db_table t JOIN database d ON d.id = t.database_id "
+        "WHERE t.name = 'Artist' ORDER BY d.path"
+    ).fetchall()
+    assert [d for _, d in descriptions] == ["artists", "artists", "artists"]
+
+    assert catalog.execute("SELECT COUNT(*) FROM db_column").fetchone()[0] == 64 * 3 + 1
+    plan = catalog.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM db_column WHERE name = 'ArtistId'"
+    ).fetchall()
+    assert "db_column_name" in str(plan)
+
+
+def test_batched_summary_splits_failed_batches(db, echo_llm, tmp_path, monkeypatch):
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path))
+    monkeypatch.setattr(ProfilingConfig, "DO_EXTRACTION", True)
+    monkeypatch.setattr(ProfilingConfig, "BATCH_TABLES", 20)
+    monkeypatch.setattr(Config, "MAX_RPM", -1)
+    db_metadata = profiler.run_metadata_extraction()
+
+    # Genre is left out of the batch, it gets a request of its own
+    llm = echo_llm(forget={"Genre"})
+    outputs = profiler.run_metadata_llm_summary(db_metadata, "batch", llm)
+    assert outputs is not None
+    assert llm.calls == 2
+    assert all(o.success for o in outputs.values())
+    assert outputs["Genre"].data.table == "genres"
+
+    # A table whose request keeps raising is given up on
+    class RaisingLlm(echo_llm):
+        def _generate_json(self, prompt: str, response_schema: Type) -> str | AiApiError:
+            if "Table Genre:" in prompt:
+                self.calls += 1
+                raise RuntimeError("boom")
+            return super()._generate_json(prompt, response_schema)
+
+    llm = RaisingLlm()
+    outputs = profiler.run_metadata_llm_summary(db_metadata, "batch", llm)
+    assert outputs is not None
+    assert not outputs["Genre"].success
+    assert sum(o.success for o in outputs.values()) == len(db_metadata.tables) - 1
+
+
+def test_catalog_database_is_one_transaction(db, tmp_path):
+    db_metadata = profiler.run_metadata_extraction()
+    catalog = Catalog(str(tmp_path / "catalog.db"))
+    assert catalog.add_database("a.db", "hash", db_metadata)
+    # The database row clashes on its path, none of its tables|columns land either
+    assert not catalog.add_database("a.db", "hash", db_metadata)
+    assert (catalog.database_count, catalog.table_count) == (1, len(db_metadata.tables))
+
+    conn = sqlite3.connect(tmp_path / "catalog.db")
+    assert conn.execute("SELECT COUNT(*) FROM database").fetchone() == (1,)
+    assert conn.execute("SELECT COUNT(*) FROM db_table").fetchone() == (len(db_metadata.tables),)
+    assert conn.execute("SELECT COUNT(*) FROM db_column").fetchone() == (
+        sum(len(t.columns) for t in db_metadata.tables),
+    )
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from src.lib.columnar import ColumnarFormat, row_count
+from src.lib.utils import check_equality, check_equality_columnar, has_top_level_order_by
+
+QUERY_PAIRS = [
+    (
+        "SELECT AlbumId, ArtistId, Title FROM Album LIMIT 3;",
+        "SELECT Title, AlbumId, ArtistId FROM Album LIMIT 5;",
+    ),
+    (
+        "SELECT TrackId, UnitPrice FROM Track",
+        "SELECT UnitPrice, TrackId FROM Track ORDER BY TrackId DESC",
+    ),
+    (
+        "SELECT CustomerId, Company FROM Customer",
+        "SELECT Company, CustomerId FROM Customer",
+    ),
+]
+
+
+def test_select_columns_numpy(db):
+    columns = db.select_columns(
+        "SELECT CustomerId, Company, SupportRepId FROM Customer", ColumnarFormat.NUMPY
+    )
+
+    assert list(columns.keys()) == ["CustomerId", "Company", "SupportRepId"]
+    assert row_count(columns) == 59
+    assert columns["CustomerId"].dtype == np.int64
+    # Nullable column stays python objects
+    assert columns["Company"].dtype == object
+    assert columns["Company"][0] is not None and columns["Company"][1] is None
+
+
+def test_select_columns_arrow(db):
+    pytest.importorskip("pyarrow")
+    columns = db.select_columns(
+        "SELECT CustomerId, Company FROM Customer", ColumnarFormat.ARROW
+    )
+
+    assert columns["Company"].null_count == 49
+
+
+@pytest.mark.parametrize("columnar_format", [ColumnarFormat.NUMPY, ColumnarFormat.AUTO])
+def test_check_equality_columnar_matches_rows(db, columnar_format):
+    for q1, q2 in QUERY_PAIRS:
+        expected = check_equality(db.select(q1), db.select(q2))
+        result = check_equality_columnar(
+            db.select_columns(q1, columnar_format),
+            db.select_columns(q2, columnar_format),
+        )
+        assert result == expected, f"{q1} / {q2}"
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_unordered_equality_compares_multisets(db, columnar):
+    q = "SELECT GenreId, COUNT(*) FROM Track GROUP BY GenreId"
+    select = db.select_columns if columnar else db.select
+    equal = check_equality_columnar if columnar else check_equality
+
+    shuffled = select(q + " ORDER BY COUNT(*)")
+    assert equal(select(q), shuffled, ordered=False)
+    assert not equal(select(q), shuffled)
+    # Same rows but one of them twice
+    assert not equal(
+        select("SELECT 1 UNION ALL SELECT 1 UNION ALL SELECT 2"),
+        select("SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 2"),
+        ordered=False,
+    )
+
+
+def test_has_top_level_order_by():
+    assert has_top_level_order_by("SELECT * FROM t ORDER BY a LIMIT 3")
+    assert has_top_level_order_by("select * from t\norder   by a")
+    assert not has_top_level_order_by("SELECT * FROM (SELECT * FROM t ORDER BY a) LIMIT 3")
+    assert not has_top_level_order_by("SELECT ROW_NUMBER() OVER (ORDER BY a) FROM t")
+    assert not has_top_level_order_by("SELECT 'ORDER BY' FROM t -- order by a")
+
+
+def test_columnar_equality_is_exact(db):
+    def equal(q1: str, q2: str) -> bool:
+        return check_equality_columnar(
+            db.select_columns(q1, ColumnarFormat.NUMPY), db.select_columns(q2, ColumnarFormat.NUMPY)
+        )
+
+    # Integers past 2**53 don't round to the same float
+    assert not equal("SELECT 9007199254740993", "SELECT 9007199254740992")
+    assert equal("SELECT 1, 2.5", "SELECT 1.0, 2.5")
+    # Python objects aren't compared by hash, hash(-1) == hash(-2)
+    assert not equal("SELECT -1 UNION ALL SELECT 'a'", "SELECT -2 UNION ALL SELECT 'a'")
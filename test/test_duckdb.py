@@ -0,0 +1,53 @@
+import pytest
+
+from profiler import table_profile
+from src.lib.DbConnector import FetchType
+
+duckdb = pytest.importorskip("duckdb")
+
+from src.lib.DuckDbConnector import DuckDbConnector, DuckDbMode  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def duck_db(tmp_path_factory):
+    converted_path = str(tmp_path_factory.mktemp("duckdb") / "Chinook.duckdb")
+    yield DuckDbConnector(
+        "db/Chinook.db",
+        do_logging=False,
+        mode=DuckDbMode.CONVERT,
+        converted_path=converted_path,
+    )
+
+
+def test_duckdb_catalog_matches_sqlite(db, duck_db):
+    assert duck_db.list_tables() == db.list_tables()
+    assert duck_db.table_columns("Customer") == db.table_columns("Customer")
+
+
+def test_duckdb_profiling_stats_match_sqlite(db, duck_db):
+    for c in db.table_columns("Invoice"):
+        column_name = c["column_name"]
+        for stat in ("count_nulls_and_nonnulls", "distinct_count", "length_stats_sql"):
+            assert getattr(duck_db, stat)("Invoice", column_name) == getattr(db, stat)(
+                "Invoice", column_name
+            ), f"{stat}({column_name})"
+
+
+def test_duckdb_values_are_sqlite_like(db, duck_db):
+    q = "SELECT InvoiceDate, Total FROM Invoice WHERE InvoiceId = 1"
+    assert duck_db.select(q, FetchType.ONE) == db.select(q, FetchType.ONE)
+
+
+def test_duckdb_value_stats_match_sqlite(db, duck_db):
+    for tablename in ("Invoice", "Track"):
+        expected = table_profile(db, tablename, sample_size=0)
+        profile = table_profile(duck_db, tablename, sample_size=0)
+        for e, c in zip(expected.columns, profile.columns):
+            assert (c.storage_classes, c.top_values, c.histogram) == (
+                e.storage_classes,
+                e.top_values,
+                e.histogram,
+            ), c.name
+            if e.numeric is not None:
+                assert c.numeric is not None
+                assert c.numeric.mean == pytest.approx(e.numeric.mean), c.name
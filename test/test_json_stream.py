@@ -0,0 +1,70 @@
+import json
+import random
+
+import profiler
+from src.profiling.GenAi import description_checker
+from src.profiling.JsonStream import JsonStreamChecker
+from src.profiling.Models import NamedTableDescription, TablesDescription
+
+
+def feed_chunks(checker: JsonStreamChecker, text: str, rng: random.Random) -> bool:
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 6)
+        if not checker.feed(text[i : i + size]):
+            return False
+        i += size
+    return True
+
+
+def test_json_stream_checker():
+    rng = random.Random(0)
+    document = {"a": [1, -2.5e3, True, None, 'q"\\é\n'], "b": {}, "c": [[], [{"d": 0}]]}
+    for _ in range(20):
+        assert feed_chunks(JsonStreamChecker(), json.dumps(document), rng)
+
+    # Fails at the first char that can't start|continue a json document
+    for text, position in (
+        ('{"a": 1,}', 8),
+        ('{"a" 1}', 5),
+        ("[1 2]", 3),
+        ('{"a": tru}', 9),
+        ('{"a": 1}}', 8),
+        ("```json", 0),
+        ('{"a": 01}', 8),
+    ):
+        checker = JsonStreamChecker()
+        assert not checker.feed(text), text
+        assert checker.error is not None and checker.error.endswith(f"char {position}"), (
+            text,
+            checker.error,
+        )
+
+
+def test_description_checker(db):
+    tables = profiler.run_metadata_extraction().tables
+    artist, album = (next(t for t in tables if t.name == n) for n in ("Artist", "Album"))
+
+    def description(table, names: list[str]) -> dict:
+        return {
+            "columns": [{"name": n, "description": "d"} for n in names],
+            "table": "t",
+            "name": table.name,
+        }
+
+    good = {"tables": [description(artist, ["ArtistId", "Name"]), description(album, ["Title"])]}
+    TablesDescription.model_validate(good)
+    assert description_checker([artist, album]).feed(json.dumps(good))
+
+    # An unknown column stops the stream before the rest of the response
+    text = json.dumps({"columns": [{"name": "Nickname", "description": "d"}], "table": "t"})
+    checker = description_checker([artist])
+    assert not checker.feed(text)
+    assert "Nickname" in checker.error and checker.position < len(text) - 20
+
+    # A column of another table of the batch is caught once the table name is read
+    bad = {"tables": [description(artist, ["ArtistId", "Title"]), description(album, ["Title"])]}
+    NamedTableDescription.model_validate(bad["tables"][0])
+    checker = description_checker([artist, album])
+    assert not checker.feed(json.dumps(bad))
+    assert "Title" in checker.error
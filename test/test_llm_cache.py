@@ -0,0 +1,61 @@
+import os
+import time
+
+import profiler
+from src.profiling.LlmCache import LlmCache
+from src.profiling.Models import TableDescription
+
+
+def test_llm_cache_reuses_responses(db, echo_llm, tmp_path):
+    llm = echo_llm()
+    llm.set_cache(LlmCache(str(tmp_path), max_bytes=1024 * 1024))
+    artist = next(t for t in profiler.run_metadata_extraction().tables if t.name == "Artist")
+
+    assert llm.cached_table_summary(artist) is None
+    first, error = llm.summarize_table_metadata(artist)
+    assert error is None and first.success
+    second, _ = llm.summarize_table_metadata(artist)
+    assert second == first
+    assert llm.cached_table_summary(artist) == first
+    assert llm.calls == 1
+
+    # Another model|prompt is another key
+    llm.get_model_name = lambda: "echo-2"
+    llm.summarize_table_metadata(artist)
+    assert llm.calls == 2
+
+
+def test_llm_cache_eviction(tmp_path):
+    cache = LlmCache(str(tmp_path), max_bytes=1024 * 1024, ttl_seconds=60)
+    keys = [LlmCache.key("m", f"prompt {i}", TableDescription) for i in range(5)]
+    for i, key in enumerate(keys):
+        cache.put(key, "m", "x" * 100)
+        # Distinct access times
+        os.utime(cache._filepath(key), (i, i))
+    entry_size = cache.size // len(keys)
+    assert cache.get(keys[1]) is not None
+
+    # Least recently used entries go first
+    cache.max_bytes = 3 * entry_size + entry_size // 2
+    cache.put(LlmCache.key("m", "one more", TableDescription), "m", "x" * 100)
+    assert cache.size <= cache.max_bytes
+    assert [cache.get(k) is not None for k in keys] == [False, True, False, False, True]
+
+    # Expired entries are misses, the size is recomputed from the files
+    cache.ttl_seconds = 0
+    time.sleep(0.01)
+    assert cache.get(keys[1]) is None
+    assert LlmCache(str(tmp_path), max_bytes=cache.max_bytes).size == cache.size
+
+
+def test_llm_cache_incomplete_entries_are_misses(db, tmp_path):
+    contents = ['{"response": "x"}', '{"created": 1}', "[1, 2]"]
+    keys = [LlmCache.key("m", f"prompt {i}", TableDescription) for i in range(len(contents))]
+    for key, content in zip(keys, contents):
+        with open(f"{tmp_path}/{key}.json", "w") as f:
+            f.write(content)
+
+    cache = LlmCache(str(tmp_path), max_bytes=1024 * 1024)
+    assert [cache.get(key) for key in keys] == [None, None, None]
+    # Removed with their size
+    assert cache.size == 0 and os.listdir(tmp_path) == []
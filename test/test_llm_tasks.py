@@ -0,0 +1,304 @@
+import asyncio
+import random
+import sqlite3
+import time
+from typing import Type
+
+import profiler
+from profiler import table_profile
+from src.lib.Config import Config
+from src.lib.Errors import AiApiError
+from src.lib.RateLimiter import RateLimiter
+from src.lib.utils import backoff_delay, read_json, run_async_tasks_with_retry
+from src.profiling.FakeLlmApi import FakeLlm
+from src.profiling.GenAi import GenAiApi
+from src.profiling.LlmCache import LlmCache
+from src.profiling.LlmPool import LlmPool
+from src.profiling.Models import TableDescription
+from src.profiling.ProfilingConfig import ProfilingConfig
+
+
+def test_async_tasks_are_bounded(db):
+    running = 0
+    max_running = 0
+
+    async def task(i: int) -> tuple[int, AiApiError | None]:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.001 * (i % 3))
+        running -= 1
+        if i == 7:
+            raise ValueError(i)
+        return i * i, None
+
+    results = asyncio.run(
+        run_async_tasks_with_retry(task, [(i,) for i in range(50)], None, retry_limit=1, max_concurrency=4)
+    )
+    assert max_running == 4
+    # In the order of the tasks whatever their completion order
+    assert [r for i, r in enumerate(results) if i != 7] == [(i * i, None) for i in range(50) if i != 7]
+    assert isinstance(results[7], ValueError)
+
+
+def test_summary_requests_are_concurrent(db, echo_llm, tmp_path, monkeypatch):
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path))
+    monkeypatch.setattr(ProfilingConfig, "DO_EXTRACTION", True)
+    monkeypatch.setattr(ProfilingConfig, "LLM_CONCURRENCY", 3)
+    monkeypatch.setattr(Config, "MAX_RPM", -1)
+    db_metadata = profiler.run_metadata_extraction()
+
+    class SlowLlm(echo_llm):
+        def __init__(self) -> None:
+            super().__init__()
+            self.running = 0
+            self.max_running = 0
+
+        async def _agenerate_json(self, prompt: str, response_schema: Type) -> str | AiApiError:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            await asyncio.sleep(0.01)
+            self.running -= 1
+            return self._generate_json(prompt, response_schema)
+
+    llm = SlowLlm()
+    outputs = profiler.run_metadata_llm_summary(db_metadata, "async", llm)
+    assert outputs is not None
+    assert all(o.success for o in outputs.values())
+    assert llm.calls == len(db_metadata.tables)
+    assert llm.max_running == 3
+
+
+def test_retries_are_per_task(db):
+    attempts = [0] * 10
+
+    async def task(i: int) -> tuple[int, AiApiError | None]:
+        attempts[i] += 1
+        # Task 3 always fails, task 5 fails twice
+        if i == 3 or (i == 5 and attempts[i] <= 2):
+            return -1, AiApiError(code=503, message="overloaded", details="")
+        return i, None
+
+    results = asyncio.run(
+        run_async_tasks_with_retry(
+            task,
+            [(i,) for i in range(10)],
+            error_cb=lambda code, count: code == 503,
+            retry_limit=3,
+            max_concurrency=4,
+            backoff_seconds=0.01,
+        )
+    )
+    # Task 3 used up its own budget, not the one of task 5
+    assert attempts == [1, 1, 1, 3, 1, 3, 1, 1, 1, 1]
+    assert [r[0] for r in results] == [0, 1, 2, -1, 4, 5, 6, 7, 8, 9]
+    assert results[3][1] is not None and results[5][1] is None
+
+
+def test_backoff_delay():
+    random.seed(0)
+    for count, expected in ((1, 1.0), (2, 2.0), (3, 4.0), (10, 30.0)):
+        delay = backoff_delay(count, base_seconds=1.0, max_seconds=30.0)
+        assert expected / 2 <= delay <= expected
+
+
+def test_fake_llm_is_deterministic(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path))
+    monkeypatch.setattr(ProfilingConfig, "DO_EXTRACTION", True)
+    monkeypatch.setattr(Config, "MAX_RPM", -1)
+    monkeypatch.setattr(profiler, "RETRY_BACKOFF_SECONDS", 0.001)
+    db_metadata = profiler.run_metadata_extraction()
+
+    llm = FakeLlm(latency_seconds=0)
+    outputs = profiler.run_metadata_llm_summary(db_metadata, "fake", llm)
+    assert outputs is not None and all(o.success for o in outputs.values())
+    assert outputs["Track"].data.columns[0].description == "The **INTEGER** column TrackId of the Track table."
+
+    def flaky_run() -> tuple[int, dict]:
+        llm = FakeLlm(latency_seconds=0.002, error_rate=0.4, malformed_rate=0.1, seed=1)
+        outputs = profiler.run_metadata_llm_summary(db_metadata, "fake", llm)
+        assert outputs is not None
+        return llm.calls, {k: v.model_dump() for k, v in outputs.items()}
+
+    calls, outputs = flaky_run()
+    assert calls > len(db_metadata.tables)
+    assert not all(o["success"] for o in outputs.values())
+    # Same seed, same faults whatever the order of the concurrent calls
+    assert flaky_run() == (calls, outputs)
+
+
+def test_llm_usage_summary(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path))
+    monkeypatch.setattr(ProfilingConfig, "DO_EXTRACTION", True)
+    monkeypatch.setattr(Config, "MAX_RPM", -1)
+    monkeypatch.setattr(profiler, "RETRY_BACKOFF_SECONDS", 0.001)
+    db_metadata = profiler.run_metadata_extraction()
+
+    llm = FakeLlm(latency_seconds=0.002, error_rate=0.3, seed=2)
+    llm.price_per_million_tokens = lambda: (1.0, 2.0)
+    profiler.run_metadata_llm_summary(db_metadata, "usage", llm)
+
+    usage = read_json(f"{tmp_path}/usage.llm.usage.json")
+    assert usage["calls"] == llm.calls
+    assert usage["retries"] == llm.calls - len(db_metadata.tables)
+    # The api errors report no usage, they aren't billed
+    assert usage["failed_calls"] == usage["estimated_calls"] > 0
+    assert usage["total_tokens"] == usage["prompt_tokens"] + usage["output_tokens"] > 0
+    assert usage["cost_usd"] == (usage["prompt_tokens"] + 2 * usage["output_tokens"]) / 1e6
+    tables = usage["tables"]
+    assert set(tables) == {t.name for t in db_metadata.tables}
+    assert sum(t["calls"] for t in tables.values()) == llm.calls
+    assert sum(t["prompt_tokens"] for t in tables.values()) == usage["prompt_tokens"]
+
+
+def test_rate_limiter_tokens_per_minute(monkeypatch):
+    monkeypatch.setattr(RateLimiter, "WINDOW_SECONDS", 0.2)
+
+    async def run() -> list[float]:
+        limiter = RateLimiter(max_rpm=-1, max_tpm=100)
+        start = time.monotonic()
+        starts = []
+        for _ in range(3):
+            await limiter.wait(40)
+            starts.append(time.monotonic() - start)
+            # The output books tokens too
+            limiter.spend(10)
+        return starts
+
+    starts = asyncio.run(run())
+    # 2 requests of 50 tokens fit in the window, the third waits for the first to leave it
+    assert starts[1] < 0.1 and starts[2] >= 0.19
+
+
+def test_streamed_summary_drops_off_format_responses(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path))
+    monkeypatch.setattr(ProfilingConfig, "DO_EXTRACTION", True)
+    monkeypatch.setattr(Config, "MAX_RPM", -1)
+    db_metadata = profiler.run_metadata_extraction()
+
+    def run(stream: bool) -> tuple[dict, dict]:
+        llm = FakeLlm(latency_seconds=0.04, latency_jitter=0, hallucination_rate=0.5, seed=4)
+        llm.stream = stream
+        outputs = profiler.run_metadata_llm_summary(db_metadata, "stream", llm)
+        assert outputs is not None
+        return outputs, read_json(f"{tmp_path}/stream.llm.usage.json")
+
+    outputs, usage = run(stream=False)
+    assert not all(o.success for o in outputs.values())
+
+    # The hallucinated column comes first, the stream is dropped right after it
+    outputs, usage = run(stream=True)
+    assert all(o.success for o in outputs.values())
+    assert usage["aborted_calls"] > 0
+    assert usage["calls"] == len(db_metadata.tables) + usage["aborted_calls"]
+    # A dropped stream takes a fraction of a full call, the longest call
+    aborted = [t for t in usage["tables"].values() if t["retries"] > 0]
+    full_call = usage["max_latency_seconds"]
+    assert all(t["latency_seconds"] < full_call * (1 + t["retries"] / 2) for t in aborted)
+
+
+def test_wide_table_summary_by_column_groups(db, tmp_path, monkeypatch):
+    conn_string = str(tmp_path / "wide.db")
+    conn = sqlite3.connect(conn_string)
+    names = [f"Measure{i}" for i in range(250)]
+    conn.execute(f"CREATE TABLE Wide (Id INTEGER PRIMARY KEY, {', '.join(f'{n} REAL' for n in names)})")
+    conn.executemany(
+        f"INSERT INTO Wide VALUES ({', '.join('?' * 251)})",
+        [(r, *(r * i / 7 for i in range(250))) for r in range(20)],
+    )
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path))
+    monkeypatch.setattr(ProfilingConfig, "DO_EXTRACTION", True)
+    monkeypatch.setattr(ProfilingConfig, "COLUMN_CHUNK_SIZE", 60)
+    monkeypatch.setattr(Config, "MAX_RPM", -1)
+    db_metadata = profiler.run_metadata_extraction(conn_string, str(tmp_path))
+
+    # A third of the requests of a group describe a column that doesn't exist,
+    # only these groups are asked again
+    llm = FakeLlm(latency_seconds=0.002, hallucination_rate=0.3, seed=4)
+    outputs = profiler.run_metadata_llm_summary(db_metadata, "wide", llm)
+    assert outputs is not None and outputs["Wide"].success
+    assert [c.name for c in outputs["Wide"].data.columns] == ["Id", *names]
+    assert outputs["Wide"].data.table == "The **Wide** table, 251 columns."
+    # 5 groups and the table description, plus the groups asked again
+    assert 5 + 1 < llm.calls < 2 * 5 + 1
+
+
+def test_llm_pool_fails_over(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path))
+    monkeypatch.setattr(ProfilingConfig, "DO_EXTRACTION", True)
+    monkeypatch.setattr(Config, "MAX_RPM", -1)
+    db_metadata = profiler.run_metadata_extraction()
+
+    # The first key is rate limited on every call, its requests go to the other ones
+    members = [
+        FakeLlm(latency_seconds=0.002, error_rate=1.0, error_codes=(429,)),
+        FakeLlm(latency_seconds=0.002, seed=1),
+        FakeLlm(latency_seconds=0.002, seed=2),
+    ]
+    pool = LlmPool(members, cooldown_seconds=60)
+    outputs = profiler.run_metadata_llm_summary(db_metadata, "pool", pool)
+    assert outputs is not None and all(o.success for o in outputs.values())
+    # Only the requests sent together before its first failure
+    assert members[0].calls < len(db_metadata.tables) / 2
+    assert members[1].calls + members[2].calls == len(db_metadata.tables)
+    assert [m["cooling_down"] for m in pool.health()] == [True, False, False]
+    assert all(m.rate_limiter is None and m.usage is None for m in members)
+
+    # A rejected key is left out, no member left fails the request
+    class RevokedLlm(FakeLlm):
+        async def _agenerate_json(self, prompt: str, response_schema: Type) -> str | AiApiError:
+            self.calls += 1
+            return AiApiError(code=403, message="'Revoked'", details="")
+
+    revoked = LlmPool([RevokedLlm(latency_seconds=0)])
+    response = asyncio.run(revoked.agenerate_json("prompt", str))
+    assert isinstance(response, AiApiError) and response.code == 403
+    assert revoked.health()[0]["disabled"]
+    response = asyncio.run(revoked.agenerate_json("prompt", str))
+    assert isinstance(response, AiApiError) and response.code == 503
+
+
+def test_llm_pool_rate_limits_per_member(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path))
+    monkeypatch.setattr(ProfilingConfig, "DO_EXTRACTION", True)
+    # A request every ~0.1s per rate limiter
+    monkeypatch.setattr(Config, "MAX_RPM", 600)
+    db_metadata = profiler.run_metadata_extraction()
+
+    def timed_run(llm: GenAiApi) -> float:
+        start = time.perf_counter()
+        outputs = profiler.run_metadata_llm_summary(db_metadata, "pool", llm)
+        assert outputs is not None and all(o.success for o in outputs.values())
+        return time.perf_counter() - start
+
+    single = timed_run(FakeLlm(latency_seconds=0))
+    members = [FakeLlm(latency_seconds=0, seed=i) for i in range(4)]
+    pooled = timed_run(LlmPool(members))
+    assert pooled < single / 2
+    assert all(m.calls > 0 for m in members)
+
+
+def test_llm_pool_caches_by_answering_model(db, tmp_path):
+    table = table_profile(db, "Genre", sample_size=0)
+    cache = LlmCache(str(tmp_path), max_bytes=1024 * 1024)
+    pool = LlmPool(
+        [
+            FakeLlm(latency_seconds=0, error_rate=1.0, error_codes=(429,), model_name="a"),
+            FakeLlm(latency_seconds=0, model_name="b"),
+        ]
+    )
+    pool.set_cache(cache)
+    output, _ = asyncio.run(pool.asummarize_table_metadata(table))
+    assert output.success
+
+    prompt = pool.table_prompt(table)
+    assert cache.get(LlmCache.key("b", prompt, TableDescription)) is not None
+    assert cache.get(LlmCache.key("a", prompt, TableDescription)) is None
+    assert cache.get(LlmCache.key(pool.get_model_name(), prompt, TableDescription)) is None
+    # Any model of the pool answers from the cache, another model asks again
+    assert pool.cached_table_summary(table) == output
+    other = FakeLlm(latency_seconds=0, model_name="a")
+    other.set_cache(cache)
+    assert other.cached_table_summary(table) is None
@@ -0,0 +1,439 @@
+import shutil
+import sqlite3
+
+import pytest
+
+import profiler
+from profiler import (
+    approx_table_profile,
+    export_profile_sqlite,
+    table_profile,
+    run_metadata_extraction,
+    scan_table,
+)
+from src.lib.SqliteConnector import SqliteConnector
+from src.profiling.Models import DatabaseMetadata
+from src.profiling.Relationships import infer_relationships, type_affinity
+from src.profiling.ProfilingConfig import ProfilingConfig
+from src.profiling.PromptEncoding import compact_table_metadata, count_tokens
+
+
+def test_fused_table_profile_matches_per_column_queries(db):
+    for tablename in db.list_tables():
+        fused = table_profile(db, tablename, sample_size=10, fused=True)
+        per_column = table_profile(db, tablename, sample_size=10, fused=False)
+
+        # Per column mode also seeks the null counts in the indexes
+        assert fused.model_copy(update={"scans_avoided": 0}) == per_column.model_copy(
+            update={"scans_avoided": 0}
+        ), tablename
+
+
+def test_per_column_queries_quote_identifiers(db, tmp_path):
+    db_path = str(tmp_path / "names.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE "order item" ("order" INTEGER, "unit price" REAL, "say ""hi""" TEXT)')
+    conn.execute('CREATE INDEX idx_order ON "order item" ("order")')
+    conn.executemany('INSERT INTO "order item" VALUES (?, ?, ?)', [(1, 2.5, "a"), (2, None, "bb")])
+    conn.commit()
+    conn.close()
+
+    names_db = SqliteConnector(db_path, do_logging=False)
+    fused = table_profile(names_db, "order item", sample_size=2, fused=True)
+    per_column = table_profile(names_db, "order item", sample_size=2, fused=False)
+    assert fused.model_copy(update={"scans_avoided": 0}) == per_column.model_copy(
+        update={"scans_avoided": 0}
+    )
+    assert [c.distinct_count for c in per_column.columns] == [2, 1, 2]
+    assert names_db.sample_values("order item", 'say "hi"', 5) == ["a", "bb"]
+
+
+def test_fused_column_stats_chunks_wide_tables(db, monkeypatch):
+    columns = [c["column_name"] for c in db.table_columns("Customer")]
+    _, expected = db.fused_column_stats("Customer", columns)
+
+    monkeypatch.setattr(db, "FUSED_STATS_MAX_COLUMNS", 3)
+    row_count, stats = db.fused_column_stats("Customer", columns)
+
+    assert row_count == 59
+    assert stats == expected
+
+
+def test_index_backed_stats_match_table_scans(db):
+    for tablename in db.list_tables():
+        for fused in (True, False):
+            with_indexes = table_profile(db, tablename, sample_size=10, fused=fused)
+            without = table_profile(
+                db, tablename, sample_size=10, fused=fused, use_indexes=False
+            )
+
+            exclude = {
+                "scans_avoided": True,
+                "columns": {"__all__": {"is_indexed", "is_unique", "is_covered"}},
+            }
+            assert with_indexes.model_dump(exclude=exclude) == without.model_dump(
+                exclude=exclude
+            ), tablename
+
+    track = table_profile(db, "Track", sample_size=10)
+    flags = {c.name: (c.is_indexed, c.is_unique, c.is_covered) for c in track.columns}
+    assert flags["TrackId"] == (True, True, True)
+    assert flags["AlbumId"] == (True, False, True)
+    assert flags["Name"] == (False, False, False)
+    # Distinct count and min/max seeks of TrackId, AlbumId, GenreId, MediaTypeId
+    assert track.scans_avoided == 8
+
+
+def test_inferred_foreign_keys_recover_declared_ones(db):
+    tables = [table_profile(db, t, sample_size=0) for t in db.list_tables()]
+    declared = {
+        (r.table, r.columns[0], r.ref_table, r.ref_columns[0])
+        for t in tables
+        for r in t.foreign_keys
+    }
+    assert ("Track", "AlbumId", "Album", "AlbumId") in declared
+
+    for table in tables:
+        table.foreign_keys = []
+        # Declared foreign keys get no signature, they are never inferred again
+        sketches, _ = scan_table(db, table.name, db.table_columns(table.name), distinct=False)
+        for column, column_sketches in zip(table.columns, sketches):
+            if column.minhash is None and type_affinity(column.declared_type) == "INTEGER":
+                assert column_sketches.minhash is not None
+                column.minhash = column_sketches.minhash.signature()
+    inferred = {
+        (r.table, r.columns[0], r.ref_table, r.ref_columns[0])
+        for r in infer_relationships(tables)
+    }
+
+    # Values copied from another table (Invoice.BillingAddress) don't make a key
+    assert inferred <= declared
+    # Keys whose name differs from the referenced column aren't inferred
+    assert declared - inferred == {
+        ("Customer", "SupportRepId", "Employee", "EmployeeId"),
+        ("Employee", "ReportsTo", "Employee", "EmployeeId"),
+    }
+
+
+def test_join_path(db):
+    db_metadata = DatabaseMetadata(
+        name="Chinook", tables=[table_profile(db, t, sample_size=0) for t in db.list_tables()]
+    )
+
+    path = db_metadata.join_path("Artist", "Playlist")
+    assert path is not None
+    assert [(r.table, r.ref_table) for r in path] == [
+        ("Album", "Artist"),
+        ("Track", "Album"),
+        ("PlaylistTrack", "Track"),
+        ("PlaylistTrack", "Playlist"),
+    ]
+
+
+def test_top_values_and_histograms(db, tmp_path):
+    track = table_profile(db, "Track", sample_size=10)
+    genre = track.find_column_by_name("GenreId")
+    assert genre is not None
+
+    expected = db.select(
+        "SELECT GenreId, COUNT(*) FROM Track GROUP BY GenreId ORDER BY COUNT(*) DESC, GenreId LIMIT 10"
+    )
+    assert [(v.value, v.count) for v in genre.top_values] == expected
+    assert "top_values" not in genre.estimates
+
+    for column in track.columns:
+        assert sum(b.count for b in column.histogram) == column.non_null_count, column.name
+    assert genre.histogram[0].lower == 1
+    assert genre.histogram[-1].upper == 25
+
+    # Misra-Gries counts stay within their error bound once the counters overflow
+    approx = approx_table_profile(db, "Track", sample_size=10)
+    composer = approx.find_column_by_name("Composer")
+    assert composer is not None
+    error = composer.estimates["top_values"]
+    assert error is not None
+    counts = dict(db.select("SELECT Composer, COUNT(*) FROM Track GROUP BY Composer"))
+    for top_value in composer.top_values:
+        assert 0 <= counts[top_value.value] - top_value.count <= error
+
+    db_metadata = DatabaseMetadata(name="Chinook", tables=[track])
+    filepath = str(tmp_path / "profile.sqlite")
+    assert export_profile_sqlite(db_metadata, filepath)
+    exported = sqlite3.connect(filepath).execute(
+        "SELECT value, count FROM column_top_value t JOIN column_profile c ON c.id = t.column_id "
+        "WHERE c.column_name = 'GenreId' ORDER BY rank"
+    )
+    assert exported.fetchall() == expected
+
+
+def test_compact_prompt_metadata_fits_budget(db):
+    for table in run_metadata_extraction().tables:
+        compact = compact_table_metadata(table)
+        assert count_tokens(compact) < count_tokens(table.model_dump_json()) / 5, table.name
+        for budget in (400, 150):
+            budgeted = compact_table_metadata(table, budget)
+            # The names always stay, past the least detailed encoding the budget is exceeded
+            assert all(f"\n{c.name} | " in budgeted for c in table.columns)
+            assert count_tokens(budgeted) <= budget or budgeted.count(" | ") == 2 * (
+                len(table.columns) + 1
+            )
+
+
+def test_partitioned_profile_matches_whole_table(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path))
+    whole = run_metadata_extraction()
+
+    monkeypatch.setattr(ProfilingConfig, "PARTITION_ROWS", 500)
+    partitioned = run_metadata_extraction()
+    monkeypatch.setattr(ProfilingConfig, "WORKERS", 3)
+    assert run_metadata_extraction() == partitioned
+
+    for w, p in zip(whole.tables, partitioned.tables):
+        assert p.row_count == w.row_count
+        for wc, pc in zip(w.columns, p.columns):
+            # Without an index the distinct counts come from the merged HyperLogLog
+            if "distinct_count" in pc.estimates:
+                bound = pc.estimates["distinct_count"]
+                assert abs(pc.distinct_count - wc.distinct_count) <= bound + 1
+            # Merged moments differ in the last float bits
+            if wc.numeric is not None:
+                assert pc.numeric is not None
+                assert pc.numeric.mean == pytest.approx(wc.numeric.mean)
+                assert pc.numeric.stddev == pytest.approx(wc.numeric.stddev)
+                assert pc.numeric.model_dump(exclude={"mean", "stddev"}) == wc.numeric.model_dump(
+                    exclude={"mean", "stddev"}
+                )
+            exclude = {"distinct_count", "estimates", "numeric"}
+            # Overflowing Misra-Gries counters depend on the merge order
+            if "top_values" in wc.estimates or "top_values" in pc.estimates:
+                exclude.add("top_values")
+            assert pc.model_dump(exclude=exclude) == wc.model_dump(exclude=exclude), (
+                w.name,
+                wc.name,
+            )
+
+
+def test_partitioned_approx_profile_matches_whole_table(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path))
+    monkeypatch.setattr(ProfilingConfig, "APPROX", True)
+    whole = run_metadata_extraction()
+
+    monkeypatch.setattr(ProfilingConfig, "PARTITION_ROWS", 500)
+    partitioned = run_metadata_extraction()
+    # Every table fits in the reservoir, only the merged sketches differ
+    exclude = {"estimates", "numeric", "top_values"}
+    for w, p in zip(whole.tables, partitioned.tables):
+        assert p.row_count == w.row_count
+        for wc, pc in zip(w.columns, p.columns):
+            assert pc.model_dump(exclude=exclude) == wc.model_dump(exclude=exclude)
+            assert pc.estimates.keys() <= {"top_values"}
+
+
+def test_partitioned_profile_resumes_from_checkpoints(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path))
+    monkeypatch.setattr(ProfilingConfig, "PARTITION_ROWS", 500)
+    expected = run_metadata_extraction()
+
+    profiled: list[tuple] = []
+    profile_partition = profiler.profile_partition
+
+    def crashing_profile_partition(db, tablename, partition, approx=False):
+        if len(profiled) == 3:
+            raise KeyboardInterrupt
+        profiled.append((tablename, partition))
+        return profile_partition(db, tablename, partition, approx)
+
+    monkeypatch.setattr(profiler, "profile_partition", crashing_profile_partition)
+    try:
+        run_metadata_extraction()
+    except KeyboardInterrupt:
+        pass
+    assert len(profiled) == 3
+
+    monkeypatch.setattr(profiler, "profile_partition", profile_partition)
+    resumed: list[tuple] = []
+
+    def counting_profile_partition(db, tablename, partition, approx=False):
+        resumed.append((tablename, partition))
+        return profile_partition(db, tablename, partition, approx)
+
+    monkeypatch.setattr(profiler, "profile_partition", counting_profile_partition)
+    assert run_metadata_extraction() == expected
+    assert set(resumed).isdisjoint(profiled)
+
+
+def test_numeric_and_storage_class_stats(db, tmp_path):
+    invoice = table_profile(db, "Invoice", sample_size=0)
+    total = invoice.find_column_by_name("Total")
+    assert total is not None and total.numeric is not None
+    assert (total.min_value, total.max_value) == (0.99, 25.86)
+    assert total.storage_classes == {"real": 412}
+    assert total.numeric.mean == pytest.approx(db.select("SELECT AVG(Total) FROM Invoice")[0][0])
+
+    db_path = str(tmp_path / "mixed.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE t (v)")
+    values = [3, -1.5, 0, "abc", "10", b"\x00", None, 7]
+    conn.executemany("INSERT INTO t VALUES (?)", [(v,) for v in values])
+    conn.commit()
+    conn.close()
+
+    mixed_db = SqliteConnector(db_path, do_logging=False)
+    for fused in (True, False):
+        column = table_profile(mixed_db, "t", sample_size=0, fused=fused).columns[0]
+        assert (column.min_value, column.max_value) == (-1.5, b"\x00")
+        assert column.storage_classes == {"blob": 1, "integer": 3, "real": 1, "text": 2}
+        assert column.numeric is not None
+        assert column.numeric.count == 4
+        assert column.numeric.mean == pytest.approx(2.125)
+        assert (column.numeric.zero_count, column.numeric.negative_count) == (1, 1)
+        assert column.numeric.quantiles["p50"] == 1.5
+
+    approx = approx_table_profile(mixed_db, "t", sample_size=0).columns[0]
+    assert (approx.min_value, approx.max_value) == (-1.5, b"\x00")
+
+    # Integers and text only: the moments skip the text values too
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE u (a, b)")
+    conn.executemany("INSERT INTO u VALUES (?, ?)", [(1, "x"), ("abc", 2)])
+    conn.commit()
+    conn.close()
+    for column in table_profile(mixed_db, "u", sample_size=0).columns:
+        assert column.storage_classes == {"integer": 1, "text": 1}
+        assert column.numeric is not None
+        assert (column.numeric.count, column.numeric.min, column.numeric.max) in ((1, 1.0, 1.0), (1, 2.0, 2.0))
+
+
+def test_parallel_extraction_is_deterministic(db, monkeypatch):
+    sequential = run_metadata_extraction()
+
+    monkeypatch.setattr(ProfilingConfig, "WORKERS", 3)
+    parallel = run_metadata_extraction()
+
+    assert parallel == sequential
+    assert [t.name for t in parallel.tables] == db.list_tables()
+
+
+def test_sampled_profile_is_deterministic(tmp_path, monkeypatch):
+    # Past SAMPLE_ROWS rows the quantiles and histograms come from the sampled rows
+    db_path = str(tmp_path / "big.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE big (id INTEGER PRIMARY KEY, v REAL, tag TEXT)")
+    conn.executemany(
+        "INSERT INTO big VALUES (?, ?, ?)",
+        [(i, (i * 7919) % 20011 / 3, f"tag{i}") for i in range(20_000)],
+    )
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(ProfilingConfig, "DB_CONN_STRING", db_path)
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path / "out"))
+
+    sequential = run_metadata_extraction()
+    column = sequential.tables[0].find_column_by_name("v")
+    assert column is not None and "numeric.quantiles" in column.estimates
+    # Every tag is distinct, the top values are the smallest ones
+    tag = sequential.tables[0].find_column_by_name("tag")
+    assert tag is not None and [v.value for v in tag.top_values][:2] == ["tag0", "tag1"]
+    assert run_metadata_extraction() == sequential
+
+    monkeypatch.setattr(ProfilingConfig, "WORKERS", 2)
+    assert run_metadata_extraction() == sequential
+
+
+def test_exact_profile_query_count(db, tmp_path):
+    # The queries of a table without index don't grow with its columns
+    db_path = str(tmp_path / "wide.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"CREATE TABLE wide ({', '.join(f'c{i} INTEGER' for i in range(50))})")
+    conn.executemany(
+        f"INSERT INTO wide VALUES ({', '.join('?' * 50)})",
+        [tuple(r * i % 13 for i in range(50)) for r in range(100)],
+    )
+    conn.commit()
+    conn.close()
+
+    wide_db = SqliteConnector(db_path, do_logging=False)
+    queries = []
+    select, select_chunks = wide_db.select, wide_db.select_chunks
+
+    def counting_select(q, *args, **kwargs):
+        queries.append(q)
+        return select(q, *args, **kwargs)
+
+    def counting_select_chunks(q, *args, **kwargs):
+        queries.append(q)
+        return select_chunks(q, *args, **kwargs)
+
+    wide_db.select = counting_select
+    wide_db.select_chunks = counting_select_chunks
+    table = table_profile(wide_db, "wide", sample_size=5)
+    assert len(table.columns) == 50
+    # Fused stats, one scan, two value_stats aggregates, plus the schema pragmas
+    scans = [q for q in queries if 'FROM "wide"' in q]
+    assert len(scans) == 4, scans
+    assert len(queries) < 10, queries
+
+
+def test_approx_table_profile_is_exact_when_table_fits_in_sample(db):
+    exact = table_profile(db, "Customer", sample_size=10)
+    approx = approx_table_profile(db, "Customer", sample_size=10)
+
+    assert approx.row_count == exact.row_count
+    for a, e in zip(approx.columns, exact.columns):
+        assert a.estimates == {}
+        assert a.model_dump(exclude={"samples", "numeric"}) == e.model_dump(
+            exclude={"samples", "numeric"}
+        )
+        # The database sums in another order, the last float bits differ
+        if e.numeric is not None:
+            assert a.numeric is not None
+            assert a.numeric.mean == pytest.approx(e.numeric.mean)
+            assert a.numeric.stddev == pytest.approx(e.numeric.stddev)
+            assert a.numeric.model_dump(exclude={"mean", "stddev"}) == e.numeric.model_dump(
+                exclude={"mean", "stddev"}
+            )
+
+
+def test_approx_table_profile_estimates_within_bounds(db):
+    exact = table_profile(db, "Track", sample_size=10)
+    approx = approx_table_profile(db, "Track", sample_size=10, reservoir_size=1000)
+
+    assert approx.row_count == exact.row_count
+    for a, e in zip(approx.columns, exact.columns):
+        assert set(a.estimates.keys()) >= {"null_count", "distinct_count"}
+        # ~3 standard errors of slack
+        slack = 1.5 * a.estimates["distinct_count"] + 1
+        assert abs(a.distinct_count - e.distinct_count) <= slack, a.name
+
+
+def test_profile_cache_reuses_unchanged_tables(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "Chinook.db")
+    shutil.copy("db/Chinook.db", db_path)
+    monkeypatch.setattr(ProfilingConfig, "DB_CONN_STRING", db_path)
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path / "out"))
+    monkeypatch.setattr(ProfilingConfig, "USE_CACHE", True)
+
+    profiled: list[str] = []
+    profile_table = profiler.profile_table
+
+    def counting_profile_table(db, tablename, *args):
+        profiled.append(tablename)
+        return profile_table(db, tablename, *args)
+
+    monkeypatch.setattr(profiler, "profile_table", counting_profile_table)
+
+    first = run_metadata_extraction()
+    assert len(profiled) == len(first.tables)
+
+    profiled.clear()
+    assert run_metadata_extraction() == first
+    assert profiled == []
+
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO Genre (Name) VALUES ('Chiptune')")
+    conn.close()
+
+    profiled.clear()
+    after_write = run_metadata_extraction()
+    assert "Genre" in profiled
+    assert after_write.find_table_by_name("Genre").row_count == 26
@@ -0,0 +1,35 @@
+import sqlite3
+
+from src.bench.scaled_chinook import expected_row_counts, generate_scaled_chinook
+
+
+def test_scaled_chinook(db, tmp_path):
+    target = str(tmp_path / "chinook_3x.db")
+    row_counts = generate_scaled_chinook("db/Chinook.db", target, scale=3, seed=1)
+    assert row_counts == expected_row_counts("db/Chinook.db", 3)
+
+    conn = sqlite3.connect(target)
+    # Every generated key references an existing row
+    assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+    assert conn.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+
+    # The first block is the original data
+    original = sqlite3.connect("db/Chinook.db")
+    for tablename, pk in (("Track", "TrackId"), ("Invoice", "InvoiceId")):
+        (last,) = original.execute(f'SELECT MAX("{pk}") FROM "{tablename}"').fetchone()
+        q = f'SELECT * FROM "{tablename}" WHERE "{pk}" <= {last} ORDER BY "{pk}"'
+        assert conn.execute(q).fetchall() == original.execute(q).fetchall()
+
+    # Invoice totals still add up in the generated blocks
+    assert conn.execute(
+        """
+        SELECT COUNT(*) FROM Invoice i
+        WHERE ABS(Total - (SELECT SUM(UnitPrice * Quantity) FROM InvoiceLine l WHERE l.InvoiceId = i.InvoiceId)) > 0.001
+        """
+    ).fetchone() == (0,)
+
+    # Same seed, same database
+    again = str(tmp_path / "again.db")
+    generate_scaled_chinook("db/Chinook.db", again, scale=3, seed=1)
+    q = "SELECT * FROM InvoiceLine ORDER BY InvoiceLineId"
+    assert conn.execute(q).fetchall() == sqlite3.connect(again).execute(q).fetchall()
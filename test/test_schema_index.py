@@ -0,0 +1,98 @@
+import time
+
+import profiler
+from src.lib.Config import Config, OutputFormat
+from src.profiling.FakeLlmApi import FakeLlm
+from src.profiling.Models import DatabaseMetadata, FieldDescription, TableDescription, TableDescriptionOutput
+from src.profiling.ProfilingConfig import ProfilingConfig
+from src.profiling.SchemaIndex import SchemaIndex, identifier_words
+
+
+def test_identifier_words():
+    assert identifier_words("BillingPostalCode") == "Billing Postal Code"
+    assert identifier_words("invoice_line_id") == "invoice line id"
+
+
+def test_search_exported_summary(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_PATH", str(tmp_path))
+    monkeypatch.setattr(ProfilingConfig, "OUTPUT_FORMAT", OutputFormat.SQLITE)
+    monkeypatch.setattr(ProfilingConfig, "DO_EXTRACTION", True)
+    monkeypatch.setattr(Config, "MAX_RPM", -1)
+    db_metadata = profiler.run_metadata_extraction()
+    outputs = profiler.run_metadata_llm_summary(db_metadata, "index", FakeLlm(latency_seconds=0))
+    assert outputs is not None
+
+    index = SchemaIndex(str(tmp_path / "index.llm.sqlite"))
+    assert index.search_tables("Which artists have the most albums?", limit=2)[0][0] in ("Artist", "Album")
+    assert index.search_tables("invoice lines")[0][0] == "InvoiceLine"
+    tablename, column, _ = index.search_columns("postal code of the customers")[0]
+    assert (tablename, column) == ("Customer", "PostalCode")
+    postal_code = next(c for c in outputs["Customer"].data.columns if c.name == "PostalCode")
+    assert index.column_description("Customer", "PostalCode") == postal_code.description
+    assert index.column_description("Customer", "Missing") is None
+    assert index.search_columns("of the") == []
+    index.close()
+
+
+def test_search_wide_schema(tmp_path):
+    # 200 tables of 60 columns
+    outputs = {
+        f"Table{t}": TableDescriptionOutput(
+            success=True,
+            error=None,
+            data=TableDescription(
+                table=f"Measures of sensor group {t}.",
+                columns=[
+                    FieldDescription(name=f"metric_{t}_{c}", description=f"Reading {c} of sensor group {t}.")
+                    for c in range(60)
+                ],
+            ),
+        )
+        for t in range(200)
+    }
+    outputs["Shipment"] = TableDescriptionOutput(
+        success=True,
+        error=None,
+        data=TableDescription(
+            table="Parcels sent to the customers.",
+            columns=[FieldDescription(name="CarrierTrackingNumber", description="Number given by the carrier.")],
+        ),
+    )
+    assert profiler.export_model_outputs(outputs, str(tmp_path / "wide"), OutputFormat.SQLITE)
+
+    index = SchemaIndex(str(tmp_path / "wide.sqlite"))
+    start = time.perf_counter()
+    tables = index.search_tables("where are the parcels of the customers?")
+    columns = index.search_columns("carrier tracking number")
+    assert time.perf_counter() - start < 0.5
+    assert tables[0][0] == "Shipment"
+    assert columns[0][:2] == ("Shipment", "CarrierTrackingNumber")
+    index.close()
+
+
+def test_export_repeated_column(db, tmp_path):
+    # The first description of a column described twice is kept
+    output = TableDescriptionOutput(
+        success=True,
+        error=None,
+        data=TableDescription(
+            table="Music genres.",
+            columns=[
+                FieldDescription(name="GenreId", description="Key of the genre."),
+                FieldDescription(name="Name", description="Name of the genre."),
+                FieldDescription(name="GenreId", description="Repeated."),
+            ],
+        ),
+    )
+    assert profiler.export_model_outputs({"Genre": output}, str(tmp_path / "repeated"), OutputFormat.SQLITE)
+    index = SchemaIndex(str(tmp_path / "repeated.sqlite"))
+    assert index.column_description("Genre", "GenreId") == "Key of the genre."
+    assert [c for _, c, _ in index.search_columns("genre")] == ["GenreId", "Name"]
+    index.close()
+
+    # The summary rejects it, Name isn't described
+    metadata = DatabaseMetadata(name="Chinook", tables=[profiler.table_profile(db, "Genre", sample_size=0)])
+    output.data.columns[1].name = "GenreId"
+    output.data.columns.pop()
+    profiler.fix_generated_output({"Genre": output}, metadata)
+    assert not output.success and output.error is not None and "[ERR 3]" in output.error